@@ -5,12 +5,15 @@ import logging
 import shutil
 from datetime import datetime
 import argparse
+import threading
 
 # Import all of the programs modules
 import scraper
 import parser
 import cleaner
 import updater
+from parser.case_output import OUTPUT_FORMATS
+from parser.html_engine import HTML_ENGINES
 
 
 class Orchestrator:
@@ -26,6 +29,26 @@ class Orchestrator:
         ms_wait=None,
         parse_single_file=False,
         test=False,
+        pipeline=False,
+        parse_workers=1,
+        queue_size=100,
+        hedge=False,
+        case_numbers_file=None,
+        workers=4,
+        refresh=False,
+        slim=False,
+        health_check=True,
+        html_engine=None,
+        bulk_load=False,
+        force=False,
+        archive=None,
+        archive_ids_file=None,
+        archive_since=None,
+        archive_until=None,
+        output_format="json",
+        parquet_dir=None,
+        memory_budget_mb=None,
+        profile_slowest=0,
     ):
 
         self.create_logs_folder()
@@ -71,6 +94,37 @@ class Orchestrator:
         self.ms_wait = ms_wait
         self.parse_single_file = parse_single_file
         self.test = test
+        self.pipeline = pipeline
+        self.parse_workers = parse_workers
+        self.queue_size = queue_size
+        self.hedge = hedge
+        self.workers = workers
+        self.refresh = refresh
+        self.slim = slim
+        self.health_check = health_check
+        self.html_engine = html_engine
+        self.bulk_load = bulk_load
+        self.force = force
+        self.archive = archive
+        self.output_format = output_format
+        self.parquet_dir = parquet_dir
+        self.memory_budget_mb = memory_budget_mb
+        self.profile_slowest = profile_slowest
+        self.archive_ids = None
+        if archive_ids_file is not None:
+            with open(archive_ids_file, "r") as file_handle:
+                self.archive_ids = [line.strip() for line in file_handle if line.strip()]
+        self.archive_since = (
+            datetime.strptime(archive_since, "%Y-%m-%d").date() if archive_since else None
+        )
+        self.archive_until = (
+            datetime.strptime(archive_until, "%Y-%m-%d").date() if archive_until else None
+        )
+        self.case_numbers = None
+        if case_numbers_file is not None:
+            with open(case_numbers_file, "r") as file_handle:
+                self.case_numbers = [line.strip() for line in file_handle if line.strip()]
+            self.logger.info(f"Looking up {len(self.case_numbers)} case numbers.")
 
         self.logger.info(f"Scraping Start Date: {self.start_date}.")
         self.logger.info(f"Scraping End Date: {self.end_date}.")
@@ -117,15 +171,68 @@ class Orchestrator:
                 self.logger.error(f"{subfolder} folder not found here: {folder_path}")
         self.logger.info("Finished removing files.")
 
-    def orchestrate(self):
-        # Orchestration logic (same as before)
-        for c in self.counties:
-            c = c.lower()
-            self.logger.info(
-                f"Starting to scrape, parse, clean, and update this county: {c}"
+    def plan(self):
+        # Estimate the cost of the crawl from each county's crawl history without touching any portal
+        judicial_officers = self.judicial_officers
+        if isinstance(judicial_officers, str):
+            judicial_officers = [judicial_officers]
+        # only case number lookups and refreshes fetch case pages concurrently, date ranges fetch them in turn
+        workers = self.workers if self.case_numbers is not None or self.refresh else 1
+        plans = [
+            scraper.planner.estimate_crawl(
+                county=c.lower(),
+                start_date=self.start_date,
+                end_date=self.end_date,
+                ms_wait=self.ms_wait if self.ms_wait is not None else 200,
+                judicial_officers=judicial_officers,
+                workers=workers,
             )
-            scraper.Scraper().scrape(
-                county=c,
+            for c in self.counties
+        ]
+        print(scraper.planner.format_crawl_plan(plans))
+        return plans
+
+    def get_odyssey_ids(self, county):
+        # In refresh mode, known cases are fetched by their stored odyssey ID instead of searched for
+        if not self.refresh:
+            return None
+        odyssey_ids = parser.Parser().get_known_odyssey_ids(county)
+        self.logger.info(f"Refreshing {len(odyssey_ids)} known cases of {county}.")
+        return odyssey_ids
+
+    def orchestrate_pipeline(self, county):
+        # Scrape and parse at the same time: the scraper puts every case page on a
+        # bounded queue and blocks when the parse workers fall behind.
+        case_queue = scraper.CaseQueue(maxsize=self.queue_size)
+        parse_errors = []
+        case_parser = parser.Parser(
+            html_engine=self.html_engine,
+            output_format=self.output_format,
+            parquet_dir=self.parquet_dir,
+            memory_budget_mb=self.memory_budget_mb,
+            profile_slowest=self.profile_slowest,
+        )
+
+        def parse():
+            try:
+                case_parser.parse_stream(
+                    county=county,
+                    case_queue=case_queue,
+                    case_number=self.case_number,
+                    workers=self.parse_workers,
+                    test=self.test,
+                )
+            except Exception as e:
+                parse_errors.append(e)
+            finally:
+                # nothing reads the queue any more, so the scraper must not wait for room on it
+                case_queue.stop()
+
+        parse_thread = threading.Thread(target=parse, name="pipeline-parser")
+        parse_thread.start()
+        try:
+            scraper.Scraper(case_queue=case_queue, hedge=self.hedge, slim=self.slim).scrape(
+                county=county,
                 start_date=self.start_date,
                 end_date=self.end_date,
                 court_calendar_link_text=self.court_calendar_link_text,
@@ -133,39 +240,245 @@ class Orchestrator:
                 case_html_path=self.case_html_path,
                 judicial_officers=self.judicial_officers,
                 ms_wait=self.ms_wait,
+                case_numbers=self.case_numbers,
+                workers=self.workers,
+                odyssey_ids=self.get_odyssey_ids(county),
             )
-            parser.Parser().parse(
+        except scraper.ParserStoppedError:
+            # the parser's own error is raised below
+            self.logger.error(f"The parser stopped, stopping the crawl of {county}")
+        finally:
+            try:
+                case_queue.put(parser.STREAM_END)
+            except scraper.ParserStoppedError:
+                pass
+            parse_thread.join()
+        if parse_errors:
+            raise parse_errors[0]
+
+    def check_portal(self, county):
+        # Skip counties whose portal is blocked, failing, or not answering before spending any crawl time on them
+        if not self.health_check:
+            return True
+        base_url, _, _ = scraper.Scraper().get_ody_link(county, self.logger)
+        return scraper.health.check_portal(
+            county, base_url, scraper.health.CircuitBreaker(county), self.logger
+        )
+
+    def parse_archive(self):
+        # Reparse archived case pages of each county without scraping or extracting the archive
+        for c in self.counties:
+            c = c.lower()
+            self.logger.info(f"Parsing {c} case pages from {self.archive}")
+            parser.Parser(
+                html_engine=self.html_engine,
+                output_format=self.output_format,
+                parquet_dir=self.parquet_dir,
+                memory_budget_mb=self.memory_budget_mb,
+                profile_slowest=self.profile_slowest,
+            ).parse_archive(
                 county=c,
+                archive_path=self.archive,
                 case_number=self.case_number,
-                parse_single_file=self.parse_single_file,
+                workers=self.parse_workers,
+                odyssey_ids=self.archive_ids,
+                modified_after=self.archive_since,
+                modified_before=self.archive_until,
                 test=self.test,
             )
+
+    def orchestrate_county(self, c):
+        if self.pipeline:
+            self.orchestrate_pipeline(c)
+            return
+        scraper.Scraper(hedge=self.hedge, slim=self.slim).scrape(
+            county=c,
+            start_date=self.start_date,
+            end_date=self.end_date,
+            court_calendar_link_text=self.court_calendar_link_text,
+            case_number=self.case_number,
+            case_html_path=self.case_html_path,
+            judicial_officers=self.judicial_officers,
+            ms_wait=self.ms_wait,
+            case_numbers=self.case_numbers,
+            workers=self.workers,
+            odyssey_ids=self.get_odyssey_ids(c),
+        )
+        parser.Parser(
+            html_engine=self.html_engine,
+            bulk_load=self.bulk_load,
+            output_format=self.output_format,
+            parquet_dir=self.parquet_dir,
+            memory_budget_mb=self.memory_budget_mb,
+            profile_slowest=self.profile_slowest,
+        ).parse(
+            county=c,
+            odyssey_id=None,
+            case_number=self.case_number,
+            parse_single_file=self.parse_single_file,
+            test=self.test,
+            workers=self.parse_workers,
+            force=self.force,
+        )
+
+    def orchestrate(self):
+        # Orchestration logic (same as before)
+        failed_counties = []
+        for c in self.counties:
+            c = c.lower()
+            try:
+                if not self.check_portal(c):
+                    continue
+                self.logger.info(
+                    f"Starting to scrape, parse, clean, and update this county: {c}"
+                )
+                self.orchestrate_county(c)
+            except (Exception, SystemExit) as e:
+                # The scraper exits once a request has failed every retry; move on to the next county
+                if self.health_check:
+                    scraper.health.CircuitBreaker(c).record_failure(
+                        f"crawl: {type(e).__name__}: {e}", source="crawl"
+                    )
+                self.logger.exception(f"Failed to process this county: {c}")
+                failed_counties.append(c)
+                continue
+            if self.health_check:
+                scraper.health.CircuitBreaker(c).record_success(source="crawl")
             self.logger.info(
                 f"Completed with scraping, parsing, cleaning, and updating of this county: {c}"
             )
+        if failed_counties:
+            self.logger.error(f"Failed to process these counties: {', '.join(failed_counties)}")
+            sys.exit(1)
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Public Defense Data Orchestrator")
-    parser.add_argument(
+    argparser = argparse.ArgumentParser(description="Public Defense Data Orchestrator")
+    argparser.add_argument(
         "--counties", nargs="*", help="Counties to process (space-separated)"
     )
-    parser.add_argument("--start_date", help="Start date (YYYY-MM-DD)")
-    parser.add_argument("--end_date", help="End date (YYYY-MM-DD)")
-    parser.add_argument("--court_calendar_link_text", help="Court calendar link text")
-    parser.add_argument("--case_number", help="Case number")
-    parser.add_argument("--case_html_path", help="Case HTML path")
-    parser.add_argument("--judicial_officers", help="Judicial officers")
-    parser.add_argument("--ms_wait", type=int, help="Milliseconds wait")
-    parser.add_argument(
+    argparser.add_argument("--start_date", help="Start date (YYYY-MM-DD)")
+    argparser.add_argument("--end_date", help="End date (YYYY-MM-DD)")
+    argparser.add_argument("--court_calendar_link_text", help="Court calendar link text")
+    argparser.add_argument("--case_number", help="Case number")
+    argparser.add_argument("--case_html_path", help="Case HTML path")
+    argparser.add_argument("--judicial_officers", help="Judicial officers")
+    argparser.add_argument("--ms_wait", type=int, help="Milliseconds wait")
+    argparser.add_argument(
         "--parse_single_file", action="store_true", help="Parse single file"
     )
-    parser.add_argument("--test", action="store_true", help="Test mode")
+    argparser.add_argument("--test", action="store_true", help="Test mode")
+    argparser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Parse case pages while they are being scraped",
+    )
+    argparser.add_argument(
+        "--parse_workers",
+        type=int,
+        default=1,
+        help="Parse worker threads in pipeline and archive mode, parse worker processes otherwise",
+    )
+    argparser.add_argument(
+        "--html_engine",
+        choices=HTML_ENGINES,
+        help="Tree builder case pages are parsed with; defaults to the fastest one installed",
+    )
+    argparser.add_argument(
+        "--bulk_load",
+        action="store_true",
+        help="Write parsed cases in batches with one bulk insert (COPY on PostgreSQL) per table",
+    )
+    argparser.add_argument(
+        "--output_format",
+        choices=OUTPUT_FORMATS,
+        default="json",
+        help="Write one JSON file per parsed case, or append them to rotating NDJSON segments with an index",
+    )
+    argparser.add_argument(
+        "--parquet_dir",
+        help="Also write the parsed entities to a Parquet dataset partitioned by county and filing year (needs pyarrow)",
+    )
+    argparser.add_argument(
+        "--memory_budget_mb",
+        type=float,
+        help="Write out buffered cases early when the parser's resident memory goes over this many MB",
+    )
+    argparser.add_argument(
+        "--profile_slowest",
+        type=int,
+        default=0,
+        help="Profile every parsed case with cProfile and dump the profiles of this many of the slowest to logs/profiles",
+    )
+    argparser.add_argument(
+        "--force",
+        action="store_true",
+        help="Reparse every case page, even unchanged ones that were already parsed",
+    )
+    argparser.add_argument(
+        "--archive",
+        help="Parse the case pages of this zip or tar archive instead of scraping",
+    )
+    argparser.add_argument(
+        "--archive_ids_file",
+        help="File with one odyssey ID per line; only these cases are parsed from the archive",
+    )
+    argparser.add_argument(
+        "--archive_since",
+        help="Only parse archived pages written on or after this date (YYYY-MM-DD)",
+    )
+    argparser.add_argument(
+        "--archive_until",
+        help="Only parse archived pages written on or before this date (YYYY-MM-DD)",
+    )
+    argparser.add_argument(
+        "--queue_size",
+        type=int,
+        default=100,
+        help="Case pages buffered between scraper and parser in pipeline mode",
+    )
+    argparser.add_argument(
+        "--case_numbers_file",
+        help="File with one case number per line to look up after a single portal bootstrap",
+    )
+    argparser.add_argument(
+        "--workers", type=int, default=4, help="Concurrent case lookups or refreshes"
+    )
+    argparser.add_argument(
+        "--slim",
+        action="store_true",
+        help="Strip scripts, navigation and layout markup from case pages before writing them",
+    )
+    argparser.add_argument(
+        "--no_health_check",
+        action="store_true",
+        help="Schedule counties without probing their portal or consulting the circuit breaker",
+    )
+    argparser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Re-fetch the cases already in the database by odyssey ID, without searching",
+    )
+    argparser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Print the estimated requests, bytes, duration and disk use without scraping",
+    )
+    argparser.add_argument(
+        "--hedge",
+        action="store_true",
+        help="Send a second request for case pages slower than the observed p95",
+    )
 
-    args = parser.parse_args()
+    args = argparser.parse_args()
+    # pipeline and archive mode parse every page as it arrives, one case per transaction
+    if (args.pipeline or args.archive) and (args.bulk_load or args.force):
+        argparser.error(
+            "--bulk_load and --force only apply to parsing case pages on disk, not with --pipeline or --archive"
+        )
 
     # Create Orchestrator instance with parsed arguments
-    Orchestrator(
+    orchestrator = Orchestrator(
         counties=args.counties,
         start_date=args.start_date,
         end_date=args.end_date,
@@ -176,4 +489,30 @@ if __name__ == "__main__":
         ms_wait=args.ms_wait,
         parse_single_file=args.parse_single_file,
         test=args.test,
-    ).orchestrate()
+        pipeline=args.pipeline,
+        parse_workers=args.parse_workers,
+        queue_size=args.queue_size,
+        hedge=args.hedge,
+        case_numbers_file=args.case_numbers_file,
+        workers=args.workers,
+        refresh=args.refresh,
+        slim=args.slim,
+        health_check=not args.no_health_check,
+        html_engine=args.html_engine,
+        bulk_load=args.bulk_load,
+        force=args.force,
+        archive=args.archive,
+        archive_ids_file=args.archive_ids_file,
+        archive_since=args.archive_since,
+        archive_until=args.archive_until,
+        output_format=args.output_format,
+        parquet_dir=args.parquet_dir,
+        memory_budget_mb=args.memory_budget_mb,
+        profile_slowest=args.profile_slowest,
+    )
+    if args.plan:
+        orchestrator.plan()
+    elif args.archive:
+        orchestrator.parse_archive()
+    else:
+        orchestrator.orchestrate()
@@ -7,22 +7,158 @@ import xxhash
 from time import time
 import sys
 import importlib
-from bs4 import BeautifulSoup
-from typing import Tuple, List, Optional
-from datetime import datetime
+import queue
+import threading
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from dotenv import load_dotenv
+from sqlmodel import Session, create_engine, func, select
+from typing import Callable, Dict, Iterable, Iterator, Tuple, List, Optional, Union
+from datetime import date, datetime
+from .models import CaseMetadata
+from .case_archive import iter_case_archive
+from .case_output import OUTPUT_FORMATS, NdjsonCaseWriter
+from .parquet_sink import ParquetCaseSink
+from .memory_budget import MemoryBudget, format_peak_rss
+from .stage_timer import StageTimer, profiled, timed
+from .html_engine import get_html_engine, make_case_soup
+from .parse_manifest import ParseManifest, get_manifest_target
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 project_root = os.path.dirname(parent_dir)
 
+# Put on the queue consumed by `Parser.parse_stream` once the scraper is finished.
+STREAM_END = None
+
+# Seconds a `Parser.parse_stream` worker waits for a case page before checking whether parsing was stopped.
+STREAM_POLL_INTERVAL = 0.5
+
+# Case pages sent to a parse worker process at a time, and extracted cases written per transaction.
+PARSE_CHUNK_SIZE = 16
+WRITE_BATCH_SIZE = 100
+
+# Status of a case page whose content is already stored, so it wasn't parsed again.
+DUPLICATE_STATUS = {"status": "success", "duplicate": True}
+
+# County parsers of a parse worker process. They only extract, so they don't connect to the database.
+_extractors = {}
+
+
+def get_county_extractor(county: str):
+    if county not in _extractors:
+        if current_dir not in sys.path:
+            sys.path.insert(0, current_dir)
+        module = importlib.import_module(f"p_{county}")
+        _extractors[county] = getattr(module, f"Parser{county.capitalize()}")(
+            connect=False
+        )
+    return _extractors[county]
+
+
+def hash_case_file(job: Tuple[str, str]) -> Optional[str]:
+    """
+    Reads a case page and hashes it with the county parser's `hash_html`, without parsing it.
+    Runs in a parse worker process.
+
+    :param job: The county and the path of the case page.
+    :returns: The hash, or None if the page can't be read or the county parser doesn't hash pages.
+    """
+    county, case_html_file_path = job
+    try:
+        extractor = get_county_extractor(county)
+        if not hasattr(extractor, "hash_html"):
+            return None
+        with open(case_html_file_path, "rb") as file:
+            return extractor.hash_html(file.read(), county)
+    except Exception:
+        # extract_case_file reports it
+        return None
+
+
+def extract_case_file(
+    job: Tuple[str, str, str, Optional[str], bool]
+) -> Tuple[str, Optional[Dict], Optional[str], Dict[str, float], Dict]:
+    """
+    Reads a case page and extracts it with the county parser's `extract_case`. Runs in a parse worker process.
+
+    :param job: The county, the path of the case page, the HTML engine to parse it with, the
+        page's hash from `hash_case_file`, if any, and whether to profile the extraction.
+    :returns: The odyssey ID, the extracted case (None if it failed), the traceback of the failure,
+        the seconds spent in each stage and the cProfile stats, empty if it wasn't profiled.
+    """
+    county, case_html_file_path, html_engine, html_hash, profile = job
+    odyssey_id = os.path.basename(case_html_file_path).split(".")[0]
+    timings = {}
+    with profiled(profile) as profile_stats:
+        try:
+            with timed(timings, "case"):
+                with open(case_html_file_path, "rb") as file:
+                    case_html = file.read()
+                extractor = get_county_extractor(county)
+                with timed(timings, "soup"):
+                    case_soup = make_case_soup(case_html, html_engine)
+                try:
+                    case_record = extractor.extract_case(
+                        county, odyssey_id, case_soup, extractor.logger, html_hash, timings
+                    )
+                finally:
+                    # break the tree's reference cycles so it is freed now, not by the garbage collector
+                    case_soup.decompose()
+            error = None
+        except Exception:
+            case_record, error = None, traceback.format_exc()
+    return odyssey_id, case_record, error, timings, profile_stats
+
 
 class Parser:
-    def __init__(self):
-        pass
+    def __init__(
+        self,
+        html_engine: Optional[str] = None,
+        bulk_load: bool = False,
+        output_format: str = "json",
+        parquet_dir: Optional[str] = None,
+        memory_budget_mb: Optional[float] = None,
+        profile_slowest: int = 0,
+    ):
+        """
+        :param html_engine: Tree builder case pages are parsed with, one of `HTML_ENGINES`.
+            Defaults to the fastest one installed.
+        :param bulk_load: Write parsed cases in batches with one bulk statement per table
+            (COPY on PostgreSQL), see `ParserHays.bulk_write_cases`.
+        :param output_format: How `write_json_data` writes parsed cases, one of `OUTPUT_FORMATS`.
+        :param parquet_dir: Also write the parsed entities to a Parquet dataset there, see `ParquetCaseSink`.
+        :param memory_budget_mb: Resident memory in MB above which buffered cases are written out
+            early instead of waiting for a full batch, see `MemoryBudget`.
+        :param profile_slowest: Profile every case with cProfile and dump the profiles of this many
+            of the slowest at the end of a run, see `StageTimer`.
+        """
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(
+                f"Unknown output format '{output_format}', expected one of {OUTPUT_FORMATS}"
+            )
+        # County parsers set up by `get_county_parser`, one set per thread because
+        # each holds its own database session.
+        self.county_parsers = threading.local()
+        self.html_engine = get_html_engine(html_engine)
+        self.bulk_load = bulk_load
+        self.output_format = output_format
+        # NDJSON writers by output directory, shared by every thread and closed by `close_outputs`
+        self.case_writers = {}
+        self.case_writers_lock = threading.Lock()
+        self.parquet_sink = ParquetCaseSink(parquet_dir) if parquet_dir else None
+        self.memory_budget = MemoryBudget(memory_budget_mb)
+        self.profile_slowest = profile_slowest
+        # how long each stage of parsing took, for the summary at the end of a run
+        self.stage_timer = StageTimer(profile_slowest)
 
     def configure_logger(self):
         # Configure the logger
         logger = logging.getLogger(name=f"parser: pid: {os.getpid()}")
+        if any(isinstance(handler, logging.FileHandler) for handler in logger.handlers):
+            # already configured earlier in this process
+            return logger
 
         # Set up basic configuration for the logging system
         logging.basicConfig(level=logging.INFO)
@@ -60,7 +196,8 @@ class Parser:
         # )
 
         # Add the current directory to the system path
-        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        if os.path.dirname(os.path.abspath(__file__)) not in sys.path:
+            sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
         try:
             # Dynamically import the module
@@ -104,6 +241,40 @@ class Parser:
             logger.error(f"Traceback: {traceback.format_exc()}")
         return None, None
 
+    def get_county_parser(
+        self, logger, county: str, test=False
+    ) -> Tuple[Optional[object], Optional[callable]]:
+        """
+        Returns the county's parser instance and method, set up once per thread and reused for
+        every case so the engine, session and logger are not created again for each file.
+        """
+        cache = self.county_parsers.__dict__
+        if cache.get(county, (None, None))[1] is None:
+            cache[county] = self.get_class_and_method(
+                county=county, logger=logger, test=test
+            )
+        return cache[county]
+
+    def get_known_odyssey_ids(self, county: str, engine=None) -> List[str]:
+        """
+        Returns the odyssey IDs of every case of the county already in the database,
+        least recently parsed first, so `Scraper.scrape_odyssey_ids` can refresh them without searching.
+        """
+        if engine is None:
+            load_dotenv()
+            engine = create_engine(os.getenv("URL"))
+        with Session(engine) as session:
+            rows = session.exec(
+                select(CaseMetadata.odyssey_id)
+                .where(
+                    CaseMetadata.county_of_jurisdiction == county,
+                    CaseMetadata.odyssey_id.is_not(None),
+                )
+                .group_by(CaseMetadata.odyssey_id)
+                .order_by(func.max(CaseMetadata.parsing_date))
+            ).all()
+        return list(rows)
+
     def get_directories(
         self, county: str, logger, parse_single_file: bool = False
     ) -> Tuple[str, str]:
@@ -142,7 +313,7 @@ class Parser:
                 relative_path = os.path.join(project_root, "resources", "test_files")
                 return [os.path.join(relative_path, f"test_{odyssey_id}.html")]
             # This will loop through the html in the folder they were scraped to.
-            case_html_list = os.listdir(case_html_path)
+            case_html_list = sorted(os.listdir(case_html_path))
 
             # However, if an optional case number is passed to the function, then read in the case number html file from the data folder
             #   -Assumes that the requested parsed case number has been scraped to html
@@ -157,6 +328,29 @@ class Parser:
             logger.info(f"Error in get_list_of_html: {e}")
             raise
 
+    def iter_case_html_paths(
+        self,
+        case_html_path: str,
+        odyssey_id: str,
+        county: str,
+        logger,
+        parse_single_file: bool = False,
+    ) -> Iterator[str]:
+        """
+        Lists the HTML files to parse in the order of their names, so cases of the same cause number are
+        versioned in the same order on every filesystem. Only the names are sorted up front; the paths are
+        built one at a time. A single file or requested odyssey ID is listed by `get_list_of_html`.
+        """
+        if parse_single_file or odyssey_id:
+            yield from self.get_list_of_html(
+                case_html_path, odyssey_id, county, logger, parse_single_file
+            )
+            return
+        with os.scandir(case_html_path) as entries:
+            file_names = sorted(entry.name for entry in entries if entry.is_file())
+        for file_name in file_names:
+            yield os.path.join(case_html_path, file_name)
+
     def get_html_path(
         self, case_html_path: str, case_html_file_name: str, odyssey_id: str, logger
     ) -> str:
@@ -169,10 +363,62 @@ class Parser:
             logger.info(f"Error in get_html_path: {e}")
             raise
 
+    def get_case_writer(self, case_json_path: str) -> NdjsonCaseWriter:
+        # segments go next to the case_json folder, which holds one file per case
+        directory = os.path.join(os.path.dirname(case_json_path), "case_ndjson")
+        with self.case_writers_lock:
+            if directory not in self.case_writers:
+                self.case_writers[directory] = NdjsonCaseWriter(
+                    directory, compress=self.output_format == "ndjson.gz"
+                )
+            return self.case_writers[directory]
+
+    def write_buffers_if_over_budget(self, logger) -> bool:
+        """
+        Writes out the cases buffered for Parquet when the process is over its memory budget, at most every
+        few seconds while it stays over, see `MemoryBudget.should_write`.
+
+        :returns: Whether they were written, so callers can write what they are buffering too.
+        """
+        if not self.memory_budget.should_write():
+            return False
+        logger.info("parser: Over the memory budget, writing buffered cases")
+        if self.parquet_sink is not None:
+            self.parquet_sink.flush()
+        return True
+
+    def report_timings(self, logger) -> None:
+        """Logs the percentiles of every parse stage of the run and dumps the profiles of its slowest cases."""
+        for line in self.stage_timer.format_summary():
+            logger.info(line)
+        profile_dir = os.path.join(
+            os.path.dirname(__file__),
+            "..",
+            "..",
+            "logs",
+            "profiles",
+            datetime.now().strftime("%d-%m-%Y-%H.%M"),
+        )
+        for path in self.stage_timer.dump_profiles(profile_dir):
+            logger.info(f"parser: Wrote profile {os.path.abspath(path)}")
+        self.stage_timer = StageTimer(self.profile_slowest)
+
+    def close_outputs(self) -> None:
+        # finish the NDJSON segments and write the cases still buffered for Parquet
+        with self.case_writers_lock:
+            for case_writer in self.case_writers.values():
+                case_writer.close()
+            self.case_writers = {}
+        if self.parquet_sink is not None:
+            self.parquet_sink.close()
+
     def write_json_data(
         self, case_json_path: str, odyssey_id: str, case_data: str, logger
     ) -> None:
         try:
+            if self.output_format != "json":
+                self.get_case_writer(case_json_path).write(odyssey_id, case_data)
+                return
             indent_level = 4
             # logger.info(f"Writing JSON to: {case_json_path}")
             with open(
@@ -200,6 +446,348 @@ class Parser:
             print(f"Error in write_error_log: {e}")
             raise
 
+    def parse_case_html(
+        self,
+        county: str,
+        odyssey_id: str,
+        case_number: str,
+        case_html: Union[bytes, str],
+        case_json_path: str,
+        logger,
+        test=False,
+    ) -> Dict:
+        """
+        Parses a single case page that is already in memory, as bytes or text, and writes its JSON.
+
+        A page whose content is already stored is recognized from its raw bytes with the county
+        parser's `hash_html` and isn't parsed.
+
+        :returns: The county parser's status of the case, `DUPLICATE_STATUS` for a page already stored,
+            `{"status": "error", ...}` if it failed.
+        """
+        try:
+            logger.info(f"{odyssey_id} - parsing")
+
+            # get the correct class and method for the given county
+            parser_instance, parser_function = self.get_county_parser(
+                logger, county, test
+            )
+            if parser_instance is None or parser_function is None:
+                logger.info("Error: Could not obtain parser instance or function.")
+                return {"status": "error", "error": f"No parser for {county}"}
+
+            # the county parser hashes the page without its balance table, see `ParserHays.hash_html`
+            hash_kwargs = {}
+            if hasattr(parser_instance, "hash_html"):
+                html_hash = parser_instance.hash_html(case_html, county)
+                if parser_instance.find_known_hashes(county, [html_hash]):
+                    logger.info(f"{odyssey_id} - duplicate of a stored case, not parsing")
+                    self.write_json_data(case_json_path, odyssey_id, DUPLICATE_STATUS, logger)
+                    return DUPLICATE_STATUS
+                hash_kwargs["html_hash"] = html_hash
+
+            timings = {}
+            with profiled(self.profile_slowest > 0) as profile_stats, timed(timings, "case"):
+                with timed(timings, "soup"):
+                    case_soup = make_case_soup(case_html, self.html_engine)
+                try:
+                    if self.parquet_sink is not None:
+                        # the Parquet sink needs the extracted case, which the parser function doesn't return
+                        case_record = parser_instance.extract_case(
+                            county, odyssey_id, case_soup, logger, timings=timings, **hash_kwargs
+                        )
+                    else:
+                        case_data = parser_function(
+                            county,
+                            odyssey_id,
+                            case_number,
+                            logger,
+                            case_soup,
+                            timings=timings,
+                            **hash_kwargs,
+                        )
+                finally:
+                    # break the tree's reference cycles so it is freed now, not by the garbage collector
+                    case_soup.decompose()
+
+                if self.parquet_sink is not None:
+                    # writes the case's JSON status too
+                    case_data = self.write_case_batch(
+                        county, [(odyssey_id, case_record)], case_json_path, logger, test
+                    )[0]
+                else:
+                    self.write_json_data(case_json_path, odyssey_id, case_data, logger)
+            self.stage_timer.add_case(odyssey_id, timings, profile_stats)
+            return case_data
+
+        except Exception as e:
+            print(traceback.format_exc())
+            self.write_error_log(county, odyssey_id)
+            return {"status": "error", "error": str(e)}
+
+    def parse_stream(
+        self,
+        county: str,
+        case_queue: queue.Queue,
+        case_number: Optional[str] = None,
+        workers: int = 1,
+        test=False,
+    ) -> None:
+        """
+        Parses case pages as the scraper downloads them instead of re-reading them from disk.
+
+        Each item on `case_queue` is an `(odyssey_id, case_html)` tuple. `STREAM_END` tells the
+        workers that the scraper is done; every worker puts it back before exiting so a single
+        sentinel stops all of them. Returns once every worker has finished.
+
+        If a worker fails, the others stop too and the error is raised once they have finished. The
+        queue is no longer read then; the caller must stop its producer, see `scraper.CaseQueue`.
+        """
+        logger = self.configure_logger()
+        county = county.lower()
+        logger.info(
+            f"parser: Starting streaming parse for {county} county with {workers} workers"
+        )
+        case_html_path, case_json_path = self.get_directories(county, logger, test)
+        START_TIME_PARSER = time()
+
+        errors = []
+        stop_parsing = threading.Event()
+
+        def parse_worker() -> None:
+            try:
+                while not stop_parsing.is_set():
+                    try:
+                        item = case_queue.get(timeout=STREAM_POLL_INTERVAL)
+                    except queue.Empty:
+                        continue
+                    if item is STREAM_END:
+                        case_queue.put(STREAM_END)
+                        break
+                    odyssey_id, case_html = item
+                    self.parse_case_html(
+                        county, odyssey_id, case_number, case_html, case_json_path, logger, test
+                    )
+                    self.write_buffers_if_over_budget(logger)
+            except Exception as e:
+                logger.error(f"parser: Parse worker failed, stopping the streaming parse: {e}")
+                logger.error(f"Traceback: {traceback.format_exc()}")
+                errors.append(e)
+                stop_parsing.set()
+
+        threads = [
+            threading.Thread(target=parse_worker, name=f"parse-worker-{i}")
+            for i in range(max(1, workers))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.close_outputs()
+        if errors:
+            raise errors[0]
+
+        RUN_TIME_PARSER = time() - START_TIME_PARSER
+        logger.info(f"Streaming parse took {RUN_TIME_PARSER} seconds")
+        logger.info(format_peak_rss())
+        self.report_timings(logger)
+
+    def parse_archive(
+        self,
+        county: str,
+        archive_path: str,
+        case_number: Optional[str] = None,
+        workers: int = 1,
+        odyssey_ids: Optional[List[str]] = None,
+        modified_after: Optional[date] = None,
+        modified_before: Optional[date] = None,
+        test=False,
+    ) -> None:
+        """
+        Parses the case pages of a zip or tar archive without extracting it, see `iter_case_archive`.
+
+        A reader thread puts the wanted pages on a bounded queue that `parse_stream` consumes, so only
+        a few pages are in memory at a time. Returns once every page has been parsed.
+
+        :param odyssey_ids: Only parse these cases.
+        :param modified_after: Only parse pages last written on or after this date.
+        :param modified_before: Only parse pages last written on or before this date.
+        """
+        logger = self.configure_logger()
+        logger.info(f"parser: Parsing {county} case pages from {archive_path}")
+        case_queue = queue.Queue(maxsize=PARSE_CHUNK_SIZE * max(1, workers))
+        read_errors = []
+        stop_reading = threading.Event()
+
+        def read_archive() -> None:
+            try:
+                for item in iter_case_archive(
+                    archive_path, odyssey_ids, modified_after, modified_before
+                ):
+                    if stop_reading.is_set():
+                        break
+                    case_queue.put(item)
+            except Exception as e:
+                read_errors.append(e)
+            finally:
+                case_queue.put(STREAM_END)
+
+        reader = threading.Thread(target=read_archive, name="archive-reader")
+        reader.start()
+        try:
+            self.parse_stream(county, case_queue, case_number, workers, test)
+        finally:
+            # unblock the reader if parsing stopped before the archive was read
+            stop_reading.set()
+            while reader.is_alive():
+                try:
+                    case_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            reader.join()
+        if read_errors:
+            logger.error(f"Could not read {archive_path}: {read_errors[0]}")
+            raise read_errors[0]
+
+    def write_case_batch(
+        self,
+        county: str,
+        batch: List[Tuple[str, Dict]],
+        case_json_path: str,
+        logger,
+        test=False,
+    ) -> List[Dict]:
+        """
+        Writes `(odyssey_id, case_record)` pairs in one transaction and the JSON status of each case.
+
+        The Parquet sink gets the written cases with their resolved version, and not the duplicates, so a page
+        parsed twice isn't written to it again under the same ids.
+
+        :returns: The status of each case, in the order of `batch`.
+        """
+        parser_instance, _ = self.get_county_parser(logger, county, test)
+        timings = {}
+        statuses = parser_instance.write_cases(
+            [case_record for _, case_record in batch],
+            logger,
+            bulk=self.bulk_load,
+            timings=timings,
+        )
+        # the batch is written at once, each case is counted an even share of it
+        for stage, seconds in timings.items():
+            self.stage_timer.add(stage, seconds, cases=len(batch))
+        for (odyssey_id, _), status in zip(batch, statuses):
+            self.write_json_data(case_json_path, odyssey_id, status, logger)
+        if self.parquet_sink is not None:
+            self.parquet_sink.write_cases(
+                [
+                    {
+                        **case_record,
+                        "case_metadata": {**case_record["case_metadata"], "version": status["version"]},
+                    }
+                    for (_, case_record), status in zip(batch, statuses)
+                    if status.get("status") == "success" and status["version"] != -1
+                ]
+            )
+        return statuses
+
+    def parse_in_batches(
+        self,
+        county: str,
+        case_html_paths: Iterable[str],
+        case_json_path: str,
+        workers: int,
+        logger,
+        test=False,
+        on_parsed: Optional[Callable[[str, Dict], None]] = None,
+        on_batch_written: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """
+        Parses case pages with a pool of `workers` processes, or in this process for one worker.
+
+        The workers hash the pages first, and pages whose content is already stored aren't parsed.
+        They read and extract the others in chunks of `PARSE_CHUNK_SIZE`; this process is the only
+        one with a database session and writes the extracted cases in batches of `WRITE_BATCH_SIZE`.
+        Cases are written in the order of `case_html_paths`, so the versions stored don't depend on the
+        number of workers. The paths are read a window at a time, so they can be a lazy listing, and the
+        batch is written early whenever the process is over its memory budget.
+
+        :param on_parsed: Called with the path and status of every page once it is written or has failed.
+        :param on_batch_written: Called after each batch is written and its pages passed to `on_parsed`.
+        """
+        on_parsed = on_parsed or (lambda case_html_file_path, status: None)
+        parser_instance, _ = self.get_county_parser(logger, county, test)
+        if parser_instance is None:
+            logger.info("Error: Could not obtain parser instance or function.")
+            return
+
+        # submit a window at a time so extracted cases waiting for the writer stay bounded
+        window_size = PARSE_CHUNK_SIZE * workers * 4
+        batch = []
+        batch_paths = []
+
+        def write_batch(batch: List[Tuple[str, Dict]], batch_paths: List[str]) -> None:
+            statuses = self.write_case_batch(county, batch, case_json_path, logger, test)
+            for case_html_file_path, status in zip(batch_paths, statuses):
+                on_parsed(case_html_file_path, status)
+            if on_batch_written is not None:
+                on_batch_written()
+
+        def run(function, jobs):
+            if pool is None:
+                return map(function, jobs)
+            return pool.map(function, jobs, chunksize=PARSE_CHUNK_SIZE)
+
+        with ProcessPoolExecutor(max_workers=workers) if workers > 1 else nullcontext() as pool:
+            case_html_paths = iter(case_html_paths)
+            while True:
+                window = list(islice(case_html_paths, window_size))
+                if not window:
+                    break
+                # hash the raw pages first and only parse the ones whose content isn't stored yet
+                html_hashes = list(run(hash_case_file, [(county, path) for path in window]))
+                known_hashes = (
+                    parser_instance.find_known_hashes(county, set(html_hashes) - {None})
+                    if hasattr(parser_instance, "find_known_hashes")
+                    else set()
+                )
+                jobs = []
+                for case_html_file_path, html_hash in zip(window, html_hashes):
+                    if html_hash is not None and html_hash in known_hashes:
+                        odyssey_id = os.path.basename(case_html_file_path).split(".")[0]
+                        logger.info(f"{odyssey_id} - duplicate of a stored case, not parsing")
+                        self.write_json_data(case_json_path, odyssey_id, DUPLICATE_STATUS, logger)
+                        on_parsed(case_html_file_path, DUPLICATE_STATUS)
+                        continue
+                    jobs.append(
+                        (
+                            county,
+                            case_html_file_path,
+                            self.html_engine,
+                            html_hash,
+                            self.profile_slowest > 0,
+                        )
+                    )
+
+                results = run(extract_case_file, jobs)
+                for job, (odyssey_id, case_record, error, timings, profile_stats) in zip(
+                    jobs, results
+                ):
+                    case_html_file_path = job[1]
+                    self.stage_timer.add_case(odyssey_id, timings, profile_stats)
+                    if case_record is None:
+                        logger.error(f"{odyssey_id} - extraction failed: {error}")
+                        self.write_error_log(county, odyssey_id)
+                        on_parsed(case_html_file_path, {"status": "error", "error": error})
+                        continue
+                    batch.append((odyssey_id, case_record))
+                    batch_paths.append(case_html_file_path)
+                    if len(batch) >= WRITE_BATCH_SIZE or self.write_buffers_if_over_budget(logger):
+                        write_batch(batch, batch_paths)
+                        batch, batch_paths = [], []
+        if batch:
+            write_batch(batch, batch_paths)
+
     def parse(
         self,
         county: str,
@@ -207,7 +795,21 @@ class Parser:
         case_number: str,
         parse_single_file: bool = False,
         test=False,
+        workers: int = 1,
+        force: bool = False,
     ) -> None:
+        """
+        Parses the county's case pages on disk.
+
+        Pages are recorded in the county's `ParseManifest` for the database and outputs written to, and
+        pages it shows were already parsed successfully into them by the same parser version and haven't
+        changed since are skipped. The manifest is committed after every written batch. Test runs and
+        single files aren't tracked.
+
+        :param workers: With more than one, pages are extracted in that many processes and
+            written in batches, see `parse_in_batches`.
+        :param force: Parse every page, even unchanged ones. A requested odyssey ID is always parsed.
+        """
         logger = self.configure_logger()
 
         logger.info(
@@ -222,65 +824,87 @@ class Parser:
             START_TIME_PARSER = time()
             logger.info(f"parser: Time started: {START_TIME_PARSER}")
 
-            # Get a list of the HTML files that it needs to parse.
-            case_html_list = self.get_list_of_html(
+            # List the HTML files that it needs to parse as they are reached, not all up front.
+            case_html_paths = self.iter_case_html_paths(
                 case_html_path, odyssey_id, county, logger, parse_single_file
             )
-            logger.info(
-                f"parser: Starting for loop to parse {len(case_html_list)} cases"
-            )
-
-            # loop through list of HTML files to parse them
-            for case_html_file_path in case_html_list:
-                try:
-                    odyssey_id = os.path.basename(case_html_file_path).split(".")[0]
-
-                    logger.info(f"{odyssey_id} - parsing")
-
-                    with open(
-                        case_html_file_path, "r", encoding="utf-8", errors="ignore"
-                    ) as file:
-                        case_soup = BeautifulSoup(file, "html.parser")
-
-                    # get the correct class and method for the given county
-                    parser_instance, parser_function = self.get_class_and_method(
-                        county=county, logger=logger, test=test
+            manifest = None
+            if not parse_single_file and not test:
+                parser_instance, _ = self.get_county_parser(logger, county, test)
+                load_dotenv()
+                manifest = ParseManifest.for_county(
+                    county,
+                    getattr(parser_instance, "PARSER_VERSION", None),
+                    get_manifest_target(
+                        os.getenv("URL"),
+                        self.output_format,
+                        self.parquet_sink.directory if self.parquet_sink is not None else None,
+                    ),
+                )
+                case_html_paths = manifest.select_changed(
+                    case_html_paths, force=force or bool(odyssey_id)
+                )
+            parsed_count = 0
+            batched = workers > 1 or self.bulk_load
+
+            def on_parsed(case_html_file_path: str, status: Dict) -> None:
+                nonlocal parsed_count
+                parsed_count += 1
+                if manifest is not None:
+                    manifest.record(case_html_file_path, status.get("status", "error"))
+                    if not batched and parsed_count % WRITE_BATCH_SIZE == 0:
+                        manifest.commit()
+
+            def on_batch_written() -> None:
+                # keep the outcome of every written batch if the run is interrupted later
+                if manifest is not None:
+                    manifest.commit()
+
+            logger.info("parser: Starting for loop to parse cases")
+
+            try:
+                if batched:
+                    self.parse_in_batches(
+                        county,
+                        case_html_paths,
+                        case_json_path,
+                        workers,
+                        logger,
+                        test,
+                        on_parsed=on_parsed,
+                        on_batch_written=on_batch_written,
                     )
-
-                    if parser_instance is not None and parser_function is not None:
-                        case_data = parser_function(
-                            county, odyssey_id, case_number, logger, case_soup
-                        )
-                    else:
-                        logger.info(
-                            "Error: Could not obtain parser instance or function."
+                else:
+                    # loop through the HTML files to parse them
+                    for case_html_file_path in case_html_paths:
+                        odyssey_id = os.path.basename(case_html_file_path).split(".")[0]
+                        try:
+                            with open(case_html_file_path, "rb") as file:
+                                case_html = file.read()
+                        except Exception:
+                            print(traceback.format_exc())
+                            self.write_error_log(county, odyssey_id)
+                            on_parsed(case_html_file_path, {"status": "error"})
+                            continue
+
+                        status = self.parse_case_html(
+                            county, odyssey_id, case_number, case_html, case_json_path, logger, test
                         )
-                        continue
-
-                    body = case_soup.find("body")
-                    tables = body.find_all("table")
-                    if tables:
-                        """
-                        Why balance table is dropped before hashing:
-                        The balance table is excluded from the hashing because
-                        balance is updated as any costs are paid off. Otherwise,
-                        the hash would change frequently and multiple versions
-                        of the case would be captured that we don't want.
-                        """
-                        balance_table = tables[-1]
-                        if "Balance Due" in balance_table.text:
-                            balance_table.decompose()
-
-                    # case_data["html_hash"] = xxhash.xxh64(str(body)).hexdigest()
-
-                    self.write_json_data(case_json_path, odyssey_id, case_data, logger)
-
-                except Exception:
-                    print(traceback.format_exc())
-                    self.write_error_log(county, odyssey_id)
-
+                        on_parsed(case_html_file_path, status)
+                        self.write_buffers_if_over_budget(logger)
+            finally:
+                # keep what was parsed before a failure
+                if manifest is not None:
+                    manifest.close()
+                self.close_outputs()
+
+            if manifest is not None:
+                logger.info(f"parser: Skipped {manifest.skipped} unchanged cases")
+            logger.info(f"parser: Parsed {parsed_count} cases")
             RUN_TIME_PARSER = time() - START_TIME_PARSER
             logger.info(f"Parsing took {RUN_TIME_PARSER} seconds")
+            logger.info(format_peak_rss())
+            self.report_timings(logger)
         except Exception as e:
             logger.error(f"Unexpected error while parsing case: {e}")
             logger.error(f"Traceback: {traceback.format_exc()}")
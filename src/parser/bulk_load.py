@@ -0,0 +1,86 @@
+import io
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Type
+
+from sqlalchemy import insert
+from sqlmodel import Session, SQLModel
+
+
+def get_columns(model: Type[SQLModel]) -> List[str]:
+    """Returns the columns of a table written by the bulk load, every one but the `id` primary key."""
+    return [column.name for column in model.__table__.columns if column.name != "id"]
+
+
+def to_row(model: Type[SQLModel], data: Dict, **keys) -> Dict:
+    """
+    Builds a row of the model's table from extracted data. Keys that aren't columns are ignored and
+    missing columns are None, like constructing the model would.
+    """
+    data = {**data, **keys}
+    return {column: data.get(column) for column in get_columns(model)}
+
+
+def insert_returning_ids(session: Session, model: Type[SQLModel], rows: List[Dict]) -> List[int]:
+    """
+    Inserts rows with one multi-row INSERT ... RETURNING and returns their ids in the order of `rows`,
+    so child rows can reference them without a round trip per row.
+    """
+    if not rows:
+        return []
+    result = session.execute(
+        insert(model).returning(model.id, sort_by_parameter_order=True), rows
+    )
+    return list(result.scalars())
+
+
+def copy_value(value) -> str:
+    """Formats a value for PostgreSQL's COPY text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_rows(session: Session, model: Type[SQLModel], rows: List[Dict]) -> bool:
+    """
+    Loads rows with COPY FROM STDIN on the session's connection, inside its transaction.
+
+    :returns: False without writing anything when the backend or driver can't COPY.
+    """
+    connection = session.connection()
+    if connection.dialect.name != "postgresql":
+        return False
+    driver_connection = connection.connection.driver_connection
+    cursor = driver_connection.cursor()
+    if not hasattr(cursor, "copy_expert"):  # psycopg2 only
+        cursor.close()
+        return False
+
+    columns = get_columns(model)
+    quote = connection.dialect.identifier_preparer.quote
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(copy_value(row[column]) for column in columns) + "\n")
+    buffer.seek(0)
+    try:
+        cursor.copy_expert(
+            f"COPY {quote(model.__table__.name)} ({', '.join(quote(c) for c in columns)}) FROM STDIN",
+            buffer,
+        )
+    finally:
+        cursor.close()
+    return True
+
+
+def insert_rows(session: Session, model: Type[SQLModel], rows: Iterable[Dict]) -> None:
+    """Writes rows whose ids nobody needs with COPY where the backend supports it, else one executemany INSERT."""
+    rows = list(rows)
+    if rows and not copy_rows(session, model, rows):
+        session.execute(insert(model), rows)
@@ -0,0 +1,74 @@
+import os
+import tarfile
+import zipfile
+from datetime import date, datetime
+from typing import Iterable, Iterator, Optional, Tuple
+
+
+def get_member_odyssey_id(member_name: str) -> Optional[str]:
+    """Returns the odyssey ID of an archived case page from its file name, or None if it isn't one."""
+    file_name = os.path.basename(member_name)
+    if not file_name.endswith(".html"):
+        return None
+    return file_name.split(".")[0]
+
+
+def is_wanted(
+    odyssey_id: Optional[str],
+    modified: date,
+    odyssey_ids: Optional[set],
+    modified_after: Optional[date],
+    modified_before: Optional[date],
+) -> bool:
+    if odyssey_id is None:
+        return False
+    if odyssey_ids is not None and odyssey_id not in odyssey_ids:
+        return False
+    if modified_after is not None and modified < modified_after:
+        return False
+    if modified_before is not None and modified > modified_before:
+        return False
+    return True
+
+
+def iter_case_archive(
+    archive_path: str,
+    odyssey_ids: Optional[Iterable[str]] = None,
+    modified_after: Optional[date] = None,
+    modified_before: Optional[date] = None,
+) -> Iterator[Tuple[str, bytes]]:
+    """
+    Reads the case pages of an archive one at a time, without extracting it to disk.
+
+    Zip archives, like the one `tools/zip_folder.py` uploads, are filtered from their central directory
+    so only wanted pages are decompressed. Tar archives, compressed or not, are read front to back as a
+    stream, so they can be piped from cold storage.
+
+    :param odyssey_ids: Only read these cases.
+    :param modified_after: Only read pages last written on or after this date, e.g. scraped since then.
+    :param modified_before: Only read pages last written on or before this date.
+    :returns: The odyssey ID and raw bytes of each page, in archive order.
+    :raises ValueError: If the file is neither a zip nor a tar archive.
+    """
+    odyssey_ids = set(odyssey_ids) if odyssey_ids is not None else None
+    filters = (odyssey_ids, modified_after, modified_before)
+
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for member in archive.infolist():
+                odyssey_id = get_member_odyssey_id(member.filename)
+                modified = datetime(*member.date_time).date()
+                if not member.is_dir() and is_wanted(odyssey_id, modified, *filters):
+                    yield odyssey_id, archive.read(member)
+        return
+
+    try:
+        archive = tarfile.open(archive_path, "r|*")
+    except tarfile.ReadError:
+        raise ValueError(f"{archive_path} is neither a zip nor a tar archive")
+    with archive:
+        for member in archive:
+            odyssey_id = get_member_odyssey_id(member.name)
+            modified = datetime.fromtimestamp(member.mtime).date()
+            if member.isfile() and is_wanted(odyssey_id, modified, *filters):
+                yield odyssey_id, archive.extractfile(member).read()
@@ -0,0 +1,182 @@
+import json
+import os
+import re
+import threading
+import zlib
+from typing import Dict, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:  # optional, the standard library encoder is used without it
+    orjson = None
+
+# Ways `Parser.write_json_data` can write parsed cases: one indented <odyssey_id>.json file per case,
+# or compact records appended to NDJSON segments, plain or gzip compressed.
+OUTPUT_FORMATS = ("json", "ndjson", "ndjson.gz")
+
+# A segment is closed and the next one started once it holds this many bytes.
+SEGMENT_BYTES = 128 * 1024 * 1024
+
+# Compressed segments are written in gzip members of about this many uncompressed bytes, as in BGZF. Records
+# share a member's compression window, and reading one record decompresses at most one member.
+BLOCK_BYTES = 64 * 1024
+
+# Compressed bytes read at a time when decompressing a member for `read_case`.
+READ_CHUNK_BYTES = 16 * 1024
+
+SEGMENT_NAME = re.compile(r"^cases-(\d+)\.ndjson(\.gz)?$")
+INDEX_NAME = "index.tsv"
+
+
+def encode_record(record: Dict) -> bytes:
+    """Encodes a record as one compact JSON line, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(record, default=str) + b"\n"
+    return (json.dumps(record, separators=(",", ":"), default=str) + "\n").encode("utf-8")
+
+
+def gzip_member(data: bytes) -> bytes:
+    """Compresses data as a complete gzip member. Concatenated members read back as one gzip stream."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+class NdjsonCaseWriter:
+    """
+    Appends parsed cases as compact JSON lines to rotating segments, cases-00001.ndjson, cases-00002.ndjson,
+    ... in a directory, and records where each one is in index.tsv: the odyssey ID, segment file, byte offset
+    of its block, offset within the block and byte length of every record, one per line. The last line of an
+    odyssey ID is its latest record.
+
+    Plain segments have no blocks: the block offset is the record's byte offset and the offset within it 0.
+    Compressed segments are written in gzip members of about `block_bytes`, BGZF style, so they read back with
+    any gzip reader and `read_case` decompresses only the member holding a record. A block's records are
+    indexed once it is written.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        compress: bool = False,
+        segment_bytes: int = SEGMENT_BYTES,
+        block_bytes: int = BLOCK_BYTES,
+    ) -> None:
+        """
+        :param directory: Where the segments and index are written, created if it doesn't exist.
+        :param compress: Gzip the segments.
+        :param segment_bytes: Size at which a segment is closed and the next one started.
+        :param block_bytes: Uncompressed size at which a block of a compressed segment is written.
+        """
+        self.directory = directory
+        self.compress = compress
+        self.segment_bytes = segment_bytes
+        self.block_bytes = block_bytes
+        # records of the compressed block being filled, and their index lines without the block offset
+        self.block = bytearray()
+        self.block_entries = []
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # every run starts a new segment after the ones already there
+        self.segment_number = max(
+            (int(match.group(1)) for match in map(SEGMENT_NAME.match, os.listdir(directory)) if match),
+            default=0,
+        )
+        self.segment = None
+        self.segment_name = None
+        self.offset = 0
+        self.index = open(os.path.join(directory, INDEX_NAME), "a", encoding="utf-8")
+
+    def open_segment(self) -> None:
+        if self.segment is not None:
+            self.segment.close()
+        self.segment_number += 1
+        self.segment_name = f"cases-{self.segment_number:05d}.ndjson" + (".gz" if self.compress else "")
+        self.segment = open(os.path.join(self.directory, self.segment_name), "wb")
+        self.offset = 0
+
+    def write(self, odyssey_id: str, case_data: Dict) -> None:
+        line = encode_record({"odyssey_id": odyssey_id, **case_data})
+        with self.lock:
+            if not self.compress:
+                if self.segment is None or self.offset >= self.segment_bytes:
+                    self.open_segment()
+                self.segment.write(line)
+                self.index.write(f"{odyssey_id}\t{self.segment_name}\t{self.offset}\t0\t{len(line)}\n")
+                self.offset += len(line)
+                return
+            self.block_entries.append((odyssey_id, len(self.block), len(line)))
+            self.block += line
+            if len(self.block) >= self.block_bytes:
+                self.write_block()
+
+    def write_block(self) -> None:
+        """Compresses the filled block into the current segment and indexes its records. Needs the lock."""
+        if not self.block:
+            return
+        if self.segment is None or self.offset >= self.segment_bytes:
+            self.open_segment()
+        member = gzip_member(bytes(self.block))
+        self.segment.write(member)
+        for odyssey_id, block_offset, length in self.block_entries:
+            self.index.write(f"{odyssey_id}\t{self.segment_name}\t{self.offset}\t{block_offset}\t{length}\n")
+        self.offset += len(member)
+        self.block = bytearray()
+        self.block_entries = []
+
+    def close(self) -> None:
+        with self.lock:
+            self.write_block()
+            if self.segment is not None:
+                self.segment.close()
+                self.segment = None
+            self.index.close()
+
+
+def read_index(directory: str) -> Dict[str, Tuple[str, int, int, int]]:
+    """
+    Returns the segment, block offset, offset within the block and length of the latest record of every
+    odyssey ID in a segment directory.
+    """
+    index = {}
+    with open(os.path.join(directory, INDEX_NAME), "r", encoding="utf-8") as file_handle:
+        for line in file_handle:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) == 4:
+                # written before blocks: every compressed record is a member of its own
+                fields.insert(3, "0")
+            odyssey_id, segment_name, offset, block_offset, length = fields
+            index[odyssey_id] = (segment_name, int(offset), int(block_offset), int(length))
+    return index
+
+
+def read_block(file_handle, offset: int) -> bytes:
+    """Decompresses the gzip member starting at `offset`, reading no further than its end."""
+    file_handle.seek(offset)
+    decompressor = zlib.decompressobj(31)
+    block = bytearray()
+    while not decompressor.eof:
+        chunk = file_handle.read(READ_CHUNK_BYTES)
+        if not chunk:
+            raise EOFError(f"Compressed block at {offset} of {file_handle.name} is cut short")
+        block += decompressor.decompress(chunk)
+    return bytes(block)
+
+
+def read_case(directory: str, odyssey_id: str, index: Optional[Dict] = None) -> Optional[Dict]:
+    """
+    Reads the latest record of one case from a segment directory without scanning the segments.
+
+    :param index: The directory's `read_index`, read now when not given.
+    :returns: The record, or None if the case isn't in the index.
+    """
+    index = read_index(directory) if index is None else index
+    if odyssey_id not in index:
+        return None
+    segment_name, offset, block_offset, length = index[odyssey_id]
+    with open(os.path.join(directory, segment_name), "rb") as file_handle:
+        if segment_name.endswith(".gz"):
+            line = read_block(file_handle, offset)[block_offset : block_offset + length]
+        else:
+            file_handle.seek(offset)
+            line = file_handle.read(length)
+    return json.loads(line)
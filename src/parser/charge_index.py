@@ -0,0 +1,195 @@
+import json
+import mmap
+import os
+import struct
+import threading
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+import xxhash
+
+# Header of a compiled index: magic, source mtime (ns), source size, number of slots, number of records.
+HEADER = struct.Struct("<8sQQII")
+MAGIC = b"PDDCHIX1"
+# A slot is the 64-bit hash of a charge name and the offset of its record, 0 for an empty slot.
+SLOT = struct.Struct("<QI")
+RECORD_LENGTH = struct.Struct("<I")
+
+DEFAULT_SOURCE = os.path.join(
+    os.path.dirname(__file__), "..", "..", "resources", "umich-uccs-database.json"
+)
+
+
+def get_compiled_path(source_path: str) -> str:
+    """Returns where the compiled index of a charge database is kept: data/charge_index/<name>.idx."""
+    base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    name = os.path.splitext(os.path.basename(source_path))[0]
+    return os.path.join(base_dir, "data", "charge_index", f"{name}.idx")
+
+
+def compile_charge_index(
+    records: Iterable[Dict], compiled_path: str, source_mtime_ns: int = 0, source_size: int = 0
+) -> None:
+    """
+    Writes charge records, keyed by `charge_name`, as an open-addressing hash table.
+
+    Later records replace earlier ones with the same name, like building a dict would.
+    """
+    by_name = {record["charge_name"]: record for record in records}
+    num_slots = max(8, 1 << (len(by_name) * 2 - 1).bit_length())
+    slots = [(0, 0)] * num_slots
+    blob = bytearray()
+    records_start = HEADER.size + SLOT.size * num_slots
+
+    for name, record in by_name.items():
+        name_hash = xxhash.xxh3_64_intdigest(name.encode("utf-8"))
+        index = name_hash % num_slots
+        while slots[index][1]:
+            index = (index + 1) % num_slots
+        encoded = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        slots[index] = (name_hash, records_start + len(blob))
+        blob += RECORD_LENGTH.pack(len(encoded)) + encoded
+
+    os.makedirs(os.path.dirname(os.path.abspath(compiled_path)), exist_ok=True)
+    # write to a temporary file first so readers never map a half-written index
+    temporary_path = f"{compiled_path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file_handle:
+        file_handle.write(HEADER.pack(MAGIC, source_mtime_ns, source_size, num_slots, len(by_name)))
+        for slot in slots:
+            file_handle.write(SLOT.pack(*slot))
+        file_handle.write(blob)
+    os.replace(temporary_path, compiled_path)
+
+
+class ChargeIndex:
+    """
+    Read-only mapping of charge names to their UMich UCCS classification, backed by a memory-mapped
+    compiled index. Forked workers share the mapped pages, and a lookup hashes the name once and
+    decodes only the matching record.
+
+    An index replaced by a reload is retired rather than closed: callers still holding it, such as a
+    case halfway through its charges, keep looking up in it, and it is unmapped once the last of them
+    drops it.
+    """
+
+    def __init__(self, compiled_path: str) -> None:
+        self.compiled_path = compiled_path
+        self.retired = False
+        with open(compiled_path, "rb") as file_handle:
+            self.data = mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.source_mtime_ns, self.source_size, self.num_slots, self.num_records = (
+            HEADER.unpack_from(self.data, 0)
+        )
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Not a compiled charge index: {compiled_path}")
+
+    def _find(self, name: str) -> Optional[Dict]:
+        name_hash = xxhash.xxh3_64_intdigest(name.encode("utf-8"))
+        index = name_hash % self.num_slots
+        data = self.data
+        while True:
+            slot_hash, offset = SLOT.unpack_from(data, HEADER.size + SLOT.size * index)
+            if not offset:
+                return None
+            if slot_hash == name_hash:
+                (length,) = RECORD_LENGTH.unpack_from(data, offset)
+                start = offset + RECORD_LENGTH.size
+                record = json.loads(data[start : start + length])
+                if record["charge_name"] == name:
+                    return record
+            index = (index + 1) % self.num_slots
+
+    def __getitem__(self, name: str) -> Dict:
+        record = self._find(name)
+        if record is None:
+            raise KeyError(name)
+        return record
+
+    def get(self, name: str, default: Optional[Dict] = None) -> Optional[Dict]:
+        record = self._find(name)
+        return default if record is None else record
+
+    def __contains__(self, name: str) -> bool:
+        return self._find(name) is not None
+
+    def __len__(self) -> int:
+        return self.num_records
+
+    def __iter__(self) -> Iterator[str]:
+        data = self.data
+        for index in range(self.num_slots):
+            _, offset = SLOT.unpack_from(data, HEADER.size + SLOT.size * index)
+            if offset:
+                (length,) = RECORD_LENGTH.unpack_from(data, offset)
+                start = offset + RECORD_LENGTH.size
+                yield json.loads(data[start : start + length])["charge_name"]
+
+    def retire(self) -> None:
+        """
+        Marks the index as replaced, so `get_charge_index` no longer returns it. It stays usable, and the
+        mapping is closed when the index is garbage collected.
+        """
+        self.retired = True
+
+    def close(self) -> None:
+        if not self.data.closed:
+            self.data.close()
+
+
+_indexes: Dict[str, ChargeIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def _source_version(source_path: str) -> Tuple[int, int]:
+    stat = os.stat(source_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _is_current(charge_index: Optional[ChargeIndex], version: Tuple[int, int]) -> bool:
+    return (
+        charge_index is not None
+        and not charge_index.retired
+        and (charge_index.source_mtime_ns, charge_index.source_size) == version
+    )
+
+
+def get_charge_index(source_path: str = DEFAULT_SOURCE, compiled_path: Optional[str] = None) -> ChargeIndex:
+    """
+    Returns the process-wide index of a UMich charge database.
+
+    The index is compiled from the JSON file the first time it is needed and then only memory-mapped.
+    When the JSON file's modification time or size changes, it is compiled and mapped again.
+
+    :param source_path: The charge database, a JSON list of records with a `charge_name`.
+    :param compiled_path: Where the compiled index is kept. Defaults to `get_compiled_path(source_path)`.
+    """
+    source_path = os.path.abspath(source_path)
+    version = _source_version(source_path)
+    charge_index = _indexes.get(source_path)
+    if _is_current(charge_index, version):
+        return charge_index
+
+    with _indexes_lock:
+        charge_index = _indexes.get(source_path)
+        if _is_current(charge_index, version):
+            return charge_index
+        compiled_path = compiled_path or get_compiled_path(source_path)
+        compiled = None
+        if os.path.exists(compiled_path):
+            compiled = ChargeIndex(compiled_path)
+            if (compiled.source_mtime_ns, compiled.source_size) != version:
+                compiled.close()
+                compiled = None
+        if compiled is None:
+            with open(source_path, "r") as file_handle:
+                records = json.load(file_handle)
+            if not records:
+                raise FileNotFoundError(f"File not found or is empty: {source_path}")
+            compile_charge_index(records, compiled_path, *version)
+            compiled = ChargeIndex(compiled_path)
+        previous = _indexes.get(source_path)
+        _indexes[source_path] = compiled
+        if previous is not None:
+            # threads may still hold the previous index; it is unmapped once they drop it
+            previous.retire()
+        return compiled
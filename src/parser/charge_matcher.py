@@ -0,0 +1,174 @@
+import math
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+# Abbreviations common in Texas charge descriptions, expanded before matching.
+ABBREVIATIONS = {
+    "AGG": "AGGRAVATED",
+    "AGGR": "AGGRAVATED",
+    "ASLT": "ASSAULT",
+    "ASSLT": "ASSAULT",
+    "BI": "BODILY INJURY",
+    "CS": "CONTROLLED SUBSTANCE",
+    "DEL": "DELIVERY",
+    "DW": "DEADLY WEAPON",
+    "FAM": "FAMILY",
+    "GRP": "GROUP",
+    "HH": "HOUSEHOLD",
+    "INTOX": "INTOXICATED",
+    "MAN": "MANUFACTURE",
+    "MANUF": "MANUFACTURE",
+    "MARIJ": "MARIJUANA",
+    "MEMB": "MEMBER",
+    "MV": "MOTOR VEHICLE",
+    "OP": "OPERATING",
+    "PG": "PENALTY GROUP",
+    "POSS": "POSSESSION",
+    "UNAUTH": "UNAUTHORIZED",
+    "VEH": "VEHICLE",
+    "W": "WITH",
+    "WO": "WITHOUT",
+}
+# Words that carry no meaning for matching.
+STOPWORDS = {"A", "AN", "AND", "OF", "OR", "THE", "TO", "IN", "ON", "BY", "FOR"}
+
+PUNCTUATION = re.compile(r"[^A-Z0-9<>]+")
+
+# Confidence reported for each kind of match. Fuzzy matches scale FUZZY_CONFIDENCE by their similarity.
+EXACT_CONFIDENCE = 1.0
+NORMALIZED_CONFIDENCE = 0.95
+FUZZY_CONFIDENCE = 0.9
+FUZZY_THRESHOLD = 0.6
+
+# Bounds on fuzzy matching work: postings of this many of the query's rarest tokens are scored.
+MAX_QUERY_TOKENS = 3
+MAX_CANDIDATES = 300
+
+
+class ChargeMatch(NamedTuple):
+    record: Optional[Dict]
+    confidence: float
+    method: str  # "exact", "normalized", "fuzzy" or "unmatched"
+
+
+def normalize_charge_name(name: str) -> str:
+    """
+    Upper-cases a charge name, turns punctuation into spaces, expands common abbreviations and drops stopwords.
+    """
+    name = name.upper().replace("&", " AND ").replace("W/O", " WO ").replace("W/", " W ")
+    tokens = (ABBREVIATIONS.get(token, token) for token in PUNCTUATION.sub(" ", name).split())
+    return " ".join(token for token in " ".join(tokens).split() if token not in STOPWORDS)
+
+
+class ChargeMatcher:
+    """
+    Matches charge names from case pages to charge records (UMich UCCS classifications).
+
+    Lookups are tried in order, cheapest first:
+    1. exact name, looked up in the charge mapping itself;
+    2. normalized name (case, punctuation, abbreviations and stopwords ignored);
+    3. fuzzy: IDF-weighted token overlap with the candidates sharing the query's rarest tokens.
+
+    The normalized and fuzzy structures are only built from the records on the first name that has no
+    exact match, so a process whose charges all match exactly never copies the records. Step 2 is a
+    dictionary lookup; step 3 scores at most `MAX_CANDIDATES` records in Python, a few tenths of a
+    millisecond per name against the UMich records.
+
+    Charges aren't matched by statute: the UMich records have no statutes to match against.
+    """
+
+    def __init__(self, charges: Mapping[str, Dict]) -> None:
+        """:param charges: Charge records by `charge_name`, such as a `ChargeIndex`."""
+        self.charges = charges
+        self.built = False
+        self.records: List[Dict] = []
+        self.normalized: Dict[str, int] = {}
+        self.record_tokens: List[Dict[str, float]] = []
+        self.postings: Dict[str, List[int]] = defaultdict(list)
+        self.lock = threading.Lock()
+
+    def build(self) -> None:
+        """Builds the lookups used when a name has no exact match, once."""
+        if self.built:
+            return
+        with self.lock:
+            if self.built:
+                return
+            token_sets = []
+            for name in self.charges:
+                record = self.charges[name]
+                record_id = len(self.records)
+                self.records.append(record)
+                normalized = normalize_charge_name(record["charge_name"])
+                self.normalized.setdefault(normalized, record_id)
+                tokens = set(normalized.split())
+                token_sets.append(tokens)
+                for token in tokens:
+                    self.postings[token].append(record_id)
+
+            self.idf = {
+                token: math.log(1 + len(self.records) / len(record_ids))
+                for token, record_ids in self.postings.items()
+            }
+            self.record_tokens = [{token: self.idf[token] for token in tokens} for tokens in token_sets]
+            self.record_weights = [sum(weights.values()) for weights in self.record_tokens]
+            self.built = True
+
+    def match_fuzzy(self, normalized: str) -> Tuple[Optional[int], float]:
+        query = {token: self.idf[token] for token in set(normalized.split()) if token in self.idf}
+        if not query:
+            return None, 0.0
+        rarest = sorted(query, key=query.get, reverse=True)[:MAX_QUERY_TOKENS]
+        candidates = set()
+        for token in rarest:
+            candidates.update(self.postings[token][:MAX_CANDIDATES])
+            if len(candidates) >= MAX_CANDIDATES:
+                break
+
+        query_weight = sum(query.values())
+        best_id, best_score = None, 0.0
+        for record_id in candidates:
+            record_tokens = self.record_tokens[record_id]
+            shared = sum(weight for token, weight in query.items() if token in record_tokens)
+            # weighted Jaccard similarity of the two token sets
+            score = shared / (query_weight + self.record_weights[record_id] - shared)
+            if score > best_score:
+                best_id, best_score = record_id, score
+        return best_id, best_score
+
+    def match(self, charge_name: str) -> ChargeMatch:
+        record = self.charges.get(charge_name)
+        if record is not None:
+            return ChargeMatch(record, EXACT_CONFIDENCE, "exact")
+
+        self.build()
+        normalized = normalize_charge_name(charge_name)
+        record_id = self.normalized.get(normalized)
+        if record_id is not None:
+            return ChargeMatch(self.records[record_id], NORMALIZED_CONFIDENCE, "normalized")
+
+        record_id, score = self.match_fuzzy(normalized)
+        if record_id is not None and score >= FUZZY_THRESHOLD:
+            return ChargeMatch(self.records[record_id], round(FUZZY_CONFIDENCE * score, 3), "fuzzy")
+
+        return ChargeMatch(None, 0.0, "unmatched")
+
+
+# The charge index the process-wide matcher was built from, and the matcher.
+_matcher = (None, None)
+_matcher_lock = threading.Lock()
+
+
+def get_charge_matcher(charge_index) -> ChargeMatcher:
+    """Returns the process-wide matcher built from a `ChargeIndex`, rebuilt when the index is reloaded."""
+    global _matcher
+    built_from, matcher = _matcher
+    if built_from is not charge_index:
+        with _matcher_lock:
+            built_from, matcher = _matcher
+            if built_from is not charge_index:
+                matcher = ChargeMatcher(charge_index)
+                _matcher = (charge_index, matcher)
+    return matcher
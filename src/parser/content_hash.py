@@ -0,0 +1,151 @@
+import html
+import re
+from typing import List, Optional, Union
+
+import xxhash
+
+# One token of a case page: a comment, a script or style element with its body, a start or end tag,
+# a doctype or processing instruction, or a run of text. Quoted attribute values may contain ">".
+TOKENS = re.compile(
+    rb"<!--.*?(?:-->|\Z)"
+    rb"|<(?:script|style)\b.*?(?:</(?:script|style)\s*>|\Z)"
+    rb"|<(/?)([a-zA-Z][a-zA-Z0-9:]*)((?:\"[^\"]*\"|'[^']*'|[^'\">])*)>"
+    rb"|<[!?][^>]*>"
+    rb"|[^<]+"
+    rb"|<",
+    re.DOTALL | re.IGNORECASE,
+)
+
+# Tags that separate the text of a table into cells and rows, and are part of the canonical form.
+CELL_TAGS = {b"table", b"tr", b"th", b"td"}
+# Tags whose text is never rendered as content.
+SKIPPED_TAGS = {b"title", b"textarea", b"select"}
+
+# Marks the element above the tables that holds the case's cause number, "Case No. CR-17-5152-C".
+CASE_NUMBER_MARKER = b"ssCaseDetailCaseNbr"
+# Marks the navigation bar, whose links carry the session and are removed by `slim_case_html`.
+NAV_BAR_MARKER = b"ssBlackNavBarHyperlink"
+# Text of the balance table, which changes whenever costs are paid.
+BALANCE_MARKER = "Balance Due"
+
+# Hex digits of a `canonical_content_hash`. Cases stored before it have 16-digit xxh64 hashes of the soup.
+CONTENT_HASH_LENGTH = 32
+
+
+class RootTable:
+    """The canonical pieces of one table at the top of the page, held until it is known whether to hash it."""
+
+    def __init__(self) -> None:
+        self.pieces: List[bytes] = []
+        self.text: List[str] = []
+        self.is_nav_bar = False
+
+    def add_text(self, text: str) -> None:
+        text = " ".join(text.split())
+        if text:
+            self.text.append(text)
+            self.pieces.append(text.encode("utf-8") + b"\x00")
+
+
+def canonical_content_hash(case_html: Union[bytes, str], county: str) -> str:
+    """
+    Hashes what a case page says rather than how it was served, in one pass over the raw bytes and
+    without building a tree, so duplicate pages can be rejected before they are parsed.
+
+    Only the tables at the top of the page and the cause number above them are hashed: their cell
+    structure and their text, with entities decoded and whitespace collapsed. Tags, attributes, scripts,
+    comments and the rest of the content outside those tables are left out, which drops the session tokens
+    the portal puts in links and hidden fields, and so are the navigation bar, empty tables and a final
+    "Balance Due" table. A page hashes the same whether it was slimmed, re-serialized by BeautifulSoup or
+    read as is.
+
+    The county and cause number are part of the hash, so companion cases whose tables read the same
+    aren't duplicates of each other.
+
+    :param county: The county the page was scraped from.
+    :returns: The xxh3-128 hex digest of the canonical form.
+    """
+    if isinstance(case_html, str):
+        case_html = case_html.encode("utf-8")
+    content_hash = xxhash.xxh3_128()
+    table_depth = 0
+    skipped_tag = None
+    table: Optional[RootTable] = None
+    pending: Optional[RootTable] = None  # the last root table, hashed once another one follows
+    text = []
+    # depth of the divs in the cause number's element while it is read, and its text
+    case_number_depth = 0
+    case_number = []
+
+    def flush_text() -> None:
+        if text and table is not None:
+            table.add_text(html.unescape(b"".join(text).decode("utf-8", errors="ignore")))
+        text.clear()
+
+    for match in TOKENS.finditer(case_html):
+        token = match.group(0)
+        tag = match.group(2)
+        if tag is None:
+            # text, or a lone "<" in it; comments, scripts and the like split no words
+            if (token[:1] != b"<" or token == b"<") and skipped_tag is None:
+                if table is not None:
+                    text.append(token)
+                elif case_number_depth:
+                    case_number.append(token)
+            continue
+
+        tag = tag.lower()
+        is_end = bool(match.group(1))
+        if tag == b"div" and table is None:
+            if case_number_depth:
+                case_number_depth += -1 if is_end else 1
+            elif not is_end and not case_number and CASE_NUMBER_MARKER in match.group(3):
+                case_number_depth = 1
+        if skipped_tag is not None:
+            if is_end and tag == skipped_tag:
+                skipped_tag = None
+            continue
+        if tag in SKIPPED_TAGS and not is_end:
+            skipped_tag = tag
+            continue
+        if tag == b"br" and table is not None:
+            text.append(b" ")
+            continue
+        if NAV_BAR_MARKER in match.group(3) and table is not None:
+            table.is_nav_bar = True
+        if tag not in CELL_TAGS:
+            continue
+
+        flush_text()
+        if tag == b"table" and not is_end:
+            table_depth += 1
+            if table_depth == 1:
+                table = RootTable()
+        if table is not None and not is_end:
+            # end tags are left out; HTML lets cells and rows be closed implicitly
+            table.pieces.append(b"<" + tag + b">")
+        if tag == b"table" and is_end and table_depth > 0:
+            table_depth -= 1
+            if table_depth == 0:
+                if table.text and not table.is_nav_bar:
+                    if pending is not None:
+                        content_hash.update(b"".join(pending.pieces))
+                    pending = table
+                table = None
+
+    flush_text()
+    if table is not None and table.text and not table.is_nav_bar:
+        # left open at the end of the page
+        if pending is not None:
+            content_hash.update(b"".join(pending.pieces))
+        pending = table
+    if pending is not None and not any(BALANCE_MARKER in table_text for table_text in pending.text):
+        content_hash.update(b"".join(pending.pieces))
+    case_number_text = " ".join(html.unescape(b"".join(case_number).decode("utf-8", errors="ignore")).split())
+    content_hash.update(f"\x01{case_number_text}\x00{county}".encode("utf-8"))
+    return content_hash.hexdigest()
+
+
+def is_legacy_html_hash(html_hash: Optional[str]) -> bool:
+    """Whether a stored html hash predates `canonical_content_hash` and can't be compared with its hashes."""
+    return html_hash is not None and len(html_hash) != CONTENT_HASH_LENGTH
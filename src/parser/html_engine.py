@@ -0,0 +1,44 @@
+from typing import Optional, Union
+
+from bs4 import BeautifulSoup
+from bs4.builder import builder_registry
+
+# BeautifulSoup tree builders a case page can be parsed with, fastest first. lxml is C-backed;
+# html.parser ships with Python and is the fallback when lxml isn't installed.
+HTML_ENGINES = ("lxml", "html.parser")
+
+
+def is_html_engine_available(html_engine: str) -> bool:
+    return builder_registry.lookup(html_engine) is not None
+
+
+def get_html_engine(html_engine: Optional[str] = None) -> str:
+    """
+    Resolves the tree builder to parse case pages with.
+
+    :param html_engine: One of `HTML_ENGINES`, or None for the fastest one installed.
+    :raises ValueError: If the engine is unknown or not installed.
+    """
+    if html_engine is None:
+        return next(engine for engine in HTML_ENGINES if is_html_engine_available(engine))
+    if html_engine not in HTML_ENGINES:
+        raise ValueError(f"Unknown HTML engine '{html_engine}', expected one of {HTML_ENGINES}")
+    if not is_html_engine_available(html_engine):
+        raise ValueError(f"HTML engine '{html_engine}' is not installed")
+    return html_engine
+
+
+def decode_case_html(case_html: Union[bytes, str]) -> str:
+    """
+    Decodes a case page the way it used to be read from disk as text (UTF-8, undecodable bytes
+    dropped, universal newlines), so the html hash of a page doesn't depend on how it was read
+    or whether it came straight from the scraper.
+    """
+    if isinstance(case_html, bytes):
+        case_html = case_html.decode("utf-8", errors="ignore")
+    return case_html.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def make_case_soup(case_html: Union[bytes, str], html_engine: str = "html.parser") -> BeautifulSoup:
+    """Parses a case page, as bytes straight from disk or as text from the scraper."""
+    return BeautifulSoup(decode_case_html(case_html), html_engine)
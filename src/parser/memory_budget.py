@@ -0,0 +1,109 @@
+import gc
+import os
+import sys
+from time import monotonic
+from typing import Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# Bytes per page of /proc/self/statm, where the current resident set size is read from on Linux.
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# Seconds between the garbage collections `MemoryBudget.exceeded` runs while over the limit.
+GC_INTERVAL = 1.0
+
+# After an early write, `MemoryBudget.should_write` asks for the next one once memory has dropped below this
+# fraction of the limit and risen over it again, so staying just over the limit doesn't write every case.
+RELEASE_FRACTION = 0.9
+
+# Seconds between early writes while memory stays over the limit, which freed memory the allocator keeps from
+# the OS can make it do for the rest of a run.
+MIN_WRITE_INTERVAL = 5.0
+
+
+def get_peak_rss_mb(children: bool = False) -> Optional[float]:
+    """
+    Returns the peak resident set size of this process in MB, or of its largest finished child
+    process, such as a parse worker, with `children`. None where it can't be measured.
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # kilobytes on Linux, bytes on macOS
+    return usage.ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def get_rss_mb() -> Optional[float]:
+    """Returns the current resident set size of this process in MB, falling back to the peak."""
+    try:
+        with open("/proc/self/statm", "r") as file_handle:
+            return int(file_handle.read().split()[1]) * PAGE_SIZE / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return get_peak_rss_mb()
+
+
+class MemoryBudget:
+    """
+    A limit on the resident memory of the parsing process. Parsing loops call `should_write` between
+    cases and write out what they are buffering when it returns True.
+    """
+
+    def __init__(
+        self, limit_mb: Optional[float] = None, min_write_interval: float = MIN_WRITE_INTERVAL
+    ) -> None:
+        """
+        :param limit_mb: The limit in MB, or None for no limit.
+        :param min_write_interval: Seconds between early writes while memory stays over the limit.
+        """
+        self.limit_mb = limit_mb
+        self.min_write_interval = min_write_interval
+        self.last_collection = 0.0
+        # when `should_write` last returned True, None once memory dropped below the release fraction
+        self.last_write = None
+
+    def exceeded(self) -> bool:
+        """Whether the process is over the limit. While it is, garbage is collected every `GC_INTERVAL` seconds."""
+        if self.limit_mb is None:
+            return False
+        rss_mb = get_rss_mb()
+        if rss_mb is None or rss_mb <= self.limit_mb:
+            return False
+        if monotonic() - self.last_collection >= GC_INTERVAL:
+            # freed memory isn't always returned to the OS, so don't collect on every case
+            gc.collect()
+            self.last_collection = monotonic()
+            rss_mb = get_rss_mb()
+        return rss_mb > self.limit_mb
+
+    def should_write(self) -> bool:
+        """
+        Whether buffered cases should be written out now: when the process goes over the limit, and then
+        again only every `min_write_interval` seconds until memory drops below `RELEASE_FRACTION` of it.
+        """
+        if self.limit_mb is None:
+            return False
+        if self.last_write is not None:
+            rss_mb = get_rss_mb()
+            if rss_mb is not None and rss_mb < self.limit_mb * RELEASE_FRACTION:
+                self.last_write = None
+            elif monotonic() - self.last_write < self.min_write_interval:
+                return False
+        if not self.exceeded():
+            return False
+        self.last_write = monotonic()
+        return True
+
+
+def format_peak_rss() -> str:
+    """Describes the peak memory use of this process and its parse workers, for the end of a run."""
+    peak_mb = get_peak_rss_mb()
+    if peak_mb is None:
+        return "Peak memory use: unknown"
+    description = f"Peak memory use: {peak_mb:.1f} MB"
+    children_mb = get_peak_rss_mb(children=True)
+    if children_mb:
+        description += f", largest parse worker {children_mb:.1f} MB"
+    return description
@@ -6,11 +6,11 @@ from datetime import date
 class CaseMetadata(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     county_of_jurisdiction: Optional[str]
-    court_case_number: Optional[str]
+    court_case_number: Optional[str] = Field(default=None, index=True)
     good_motions: Optional[str]
     has_evidence_of_representation: Optional[bool]
     parsing_date: Optional[date]
-    html_hash: Optional[str]
+    html_hash: Optional[str] = Field(default=None, index=True)
     odyssey_id: Optional[str]
     court_case_number_hashed: Optional[str]
     case_name: Optional[str]
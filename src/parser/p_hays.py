@@ -1,14 +1,24 @@
-from typing import Dict, List
+from typing import Dict, List, Optional, Set, Tuple, Union
 from bs4 import BeautifulSoup
 import traceback
 from datetime import datetime
 from parser.models import *
+from parser.seen_set import SeenSet
+from parser.charge_index import get_charge_index
+from parser.charge_matcher import ChargeMatcher, get_charge_matcher
+from parser import bulk_load
+from parser.content_hash import BALANCE_MARKER, canonical_content_hash, is_legacy_html_hash
+from parser.stage_timer import timed
 from sqlmodel import SQLModel, Field, Relationship, create_engine, Session, select
+from sqlalchemy import or_, text
+from collections import Counter
+import soupsieve
 import xxhash
 import os
 import json
 from dotenv import load_dotenv
 import logging
+import threading
 from datetime import datetime as dt
 
 CHARGE_SEVERITY = {
@@ -20,6 +30,10 @@ CHARGE_SEVERITY = {
     "Misdemeanor B": 6,
 }
 
+UMICH_CHARGE_FILE = os.path.join(
+    os.path.dirname(__file__), "..", "..", "resources", "umich-uccs-database.json"
+)
+
 # List of motions identified as evidentiary.
 # TODO: These should be moved to a separate JSON in resources
 GOOD_MOTIONS = [
@@ -32,20 +46,61 @@ GOOD_MOTIONS = [
     "Motion In Limine",
 ]
 
+# CSS selectors used on every case page, compiled once instead of on each call.
+ROOT_TABLES = soupsieve.compile("body>table")
+TABLE_ROWS = soupsieve.compile("tr")
+HEADER_CELLS = soupsieve.compile("th")
+DATA_CELLS = soupsieve.compile("td")
+BOLD_TEXT = soupsieve.compile("b")
+CASE_NUMBER = soupsieve.compile('div[class="ssCaseDetailCaseNbr"] > span')
+
+# Root tables of a case page, recognized by the text they contain. The first matching section wins.
+SECTION_MARKERS = (
+    ("case_details", ("Case Type:", "Date Filed:")),
+    ("related_cases", ("Related Case Information",)),
+    ("parties", ("Party Information",)),
+    ("charges", ("Charge Information",)),
+    ("events", ("Events & Orders of the Court",)),
+)
+
+# Tables `bulk_write_cases` loads without needing their ids, and the key of their rows in an extracted case.
+BULK_LEAF_TABLES = {
+    Defendant: "defendants",
+    DefenseAttorney: "defense_attorneys",
+    StateInformation: "state_information",
+    Charge: "charges",
+    Event: "events",
+}
+
+# One engine (and connection pool) per database URL for the whole process.
+ENGINES = {}
+ENGINES_LOCK = threading.Lock()
+
+# The seen-sets of each (database, county), shared by every instance of a process so only one seeds them.
+SEEN_SETS: Dict[Tuple[str, str], Dict[str, SeenSet]] = {}
+SEEN_SETS_LOCK = threading.Lock()
+
 
 class ParserHays:
+    # Bump when a change to the parser changes what it stores, so pages parsed before are parsed again.
+    PARSER_VERSION = 1
 
-    def __init__(self):
-        self.engine = self.create_postgres_engine()
-        SQLModel.metadata.create_all(self.engine)
-        self.session = Session(self.engine)
+    def __init__(self, connect: bool = True):
+        """
+        :param connect: Whether to connect to the database. Parse workers that only call
+            `extract_case` don't need to.
+        """
+        self.engine = self.create_postgres_engine() if connect else None
+        self.session = Session(self.engine) if connect else None
         self.logger = self.configure_logger()
-
-        pass
+        self.seen_sets = {}
 
     def configure_logger(self):
         # Configure the logger
         logger = logging.getLogger(name=f"parser: pid: {os.getpid()}")
+        if any(isinstance(handler, logging.FileHandler) for handler in logger.handlers):
+            # already configured by an earlier instance in this process
+            return logger
 
         # Set up basic configuration for the logging system
         logging.basicConfig(level=logging.INFO)
@@ -75,19 +130,26 @@ class ParserHays:
         # Fetch and create the url
         DATABASE_URL = os.getenv("URL")
 
-        # Create the engine
-        engine = create_engine(DATABASE_URL)
-        return engine
+        # Create the engine and tables once, every later instance reuses them
+        with ENGINES_LOCK:
+            if DATABASE_URL not in ENGINES:
+                engine = create_engine(DATABASE_URL)
+                SQLModel.metadata.create_all(engine)
+                # create_all skips tables that exist, so indexes added later are created here
+                for index in CaseMetadata.__table__.indexes:
+                    index.create(engine, checkfirst=True)
+                ENGINES[DATABASE_URL] = engine
+            return ENGINES[DATABASE_URL]
 
     def extract_rows(self, table: BeautifulSoup, logger) -> List[List[str]]:
         try:
             rows = [
                 [
-                    tag.strip().replace("\xa0", "").replace("Â", "")
-                    for tag in tr.find_all(text=True)
-                    if tag.strip()
+                    text.replace("\xa0", "").replace("Â", "")
+                    for text in (tag.strip() for tag in tr.find_all(string=True))
+                    if text
                 ]
-                for tr in table.select("tr")
+                for tr in TABLE_ROWS.select(table)
             ]
             return [row for row in rows if row]
         except Exception as e:
@@ -179,9 +241,7 @@ class ParserHays:
         try:
             # logger.info(f"Getting case metadata for {county} case {odyssey_id}")
             return {
-                "court_case_number": case_soup.select(
-                    'div[class="ssCaseDetailCaseNbr"] > span'
-                )[0].text,
+                "court_case_number": CASE_NUMBER.select(case_soup)[0].text,
                 "odyssey_id": odyssey_id,
                 "county_of_jurisdiction": county,
             }
@@ -195,7 +255,7 @@ class ParserHays:
 
     def get_case_details(self, table: BeautifulSoup, logger) -> Dict[str, str]:
         try:
-            table_values = table.select("b")
+            table_values = BOLD_TEXT.select(table)
             # logger.info(f"Getting case details")
             return {
                 "case_name": table_values[0].text,
@@ -277,9 +337,9 @@ class ParserHays:
         try:
             # logger.info(f"Getting charge information")
             table_rows = [
-                tag.strip().replace("\xa0", " ")
-                for tag in table.find_all(text=True)
-                if tag.strip()
+                text.replace("\xa0", " ")
+                for text in (tag.strip() for tag in table.find_all(string=True))
+                if text
             ]
 
             charge_information = []
@@ -322,7 +382,7 @@ class ParserHays:
             raise ValueError(f"Invalid data structure: {file_path}")
 
     def process_charges(
-        self, charges: list[dict], charge_mapping: dict
+        self, charges: list[dict], charge_matcher: ChargeMatcher
     ) -> tuple[list[dict], str]:
         """
         Processes a list of charges by formatting charge details,
@@ -330,7 +390,7 @@ class ParserHays:
 
         Args:
             charges: A list of charges where each charge is a dictionary containing charge details.
-            charge_mapping: A dictionary mapping charge names to corresponding UMich data.
+            charge_matcher: A ChargeMatcher mapping charge names to corresponding UMich data.
 
         Returns:
             tuple: A list of processed charges and the earliest charge date.
@@ -364,10 +424,16 @@ class ParserHays:
             charge_date = charge["charge_date"]  # Get the date object
 
             # Try to map the charge to UMich data
-            try:
-                charge_dict.update(charge_mapping[charge["original_charge"]])
+            match = charge_matcher.match(charge["original_charge"])
+            if match.record is not None:
+                charge_dict.update(match.record)
+                if match.method not in ("exact", "normalized"):
+                    self.logger.info(
+                        f"Matched charge {charge['original_charge']} to {match.record['charge_name']} "
+                        f"by {match.method} with confidence {match.confidence}"
+                    )
                 processed_charges.append(charge_dict)
-            except KeyError:
+            else:
                 self.logger.warning(
                     f"Couldn't find this charge: {charge['original_charge']}"
                 )
@@ -398,12 +464,12 @@ class ParserHays:
             # logger.info(f"Formatting events and orders of the court")
             table_rows = [
                 [
-                    tag.strip().replace("\xa0", " ")
-                    for tag in tr.find_all(text=True)
-                    if tag.strip()
+                    text.replace("\xa0", " ")
+                    for text in (tag.strip() for tag in tr.find_all(string=True))
+                    if text
                 ]
-                for tr in table.select("tr")
-                if tr.select("th")
+                for tr in TABLE_ROWS.select(table)
+                if HEADER_CELLS.select_one(tr)
             ]
             table_rows = [
                 [" ".join(word.strip() for word in text.split()) for text in sublist]
@@ -474,317 +540,565 @@ class ParserHays:
             logger.info(f"Error getting disposition information: {e}")
             return dispositions
 
-    def add_version(self, case_metadata: CaseMetadata) -> int:
-        """
-        Determines the version number for a CaseMetadata entry based on existing data.
+    def get_seen_sets(self, county: str) -> Dict[str, SeenSet]:
         """
+        Loads the county's seen-set of html hashes, seeding it from the database the first
+        time it is created. Legacy hashes are left out, no page hashes to them any more.
 
-        html_hash = (
-            case_metadata.html_hash
-        )  # get the html hash from the case metadata instance.
-        cause_number = case_metadata.court_case_number
-
-        # 1. Duplicate HTML Hash Check
-        existing_case_metadata = self.session.exec(
-            select(CaseMetadata).where(CaseMetadata.html_hash == html_hash)
-        ).first()
-
-        if existing_case_metadata:
+        Every instance of the process shares the seen-sets of a county and database, which are
+        opened and seeded under a lock, so no thread reads a filter that is still being seeded.
+        """
+        if county not in self.seen_sets:
+            database = ""
+            if self.engine is not None:
+                database = self.engine.url.render_as_string(hide_password=True)
+            with SEEN_SETS_LOCK:
+                if (database, county) not in SEEN_SETS:
+                    SEEN_SETS[(database, county)] = self.open_seen_sets(county, database)
+            self.seen_sets[county] = SEEN_SETS[(database, county)]
+        return self.seen_sets[county]
+
+    def open_seen_sets(self, county: str, database: str) -> Dict[str, SeenSet]:
+        seen_sets = {"html_hashes": SeenSet.for_county(county, "html_hashes", database=database)}
+        if any(seen_set.is_new for seen_set in seen_sets.values()):
+            rows = self.session.exec(
+                select(CaseMetadata.html_hash).where(
+                    CaseMetadata.county_of_jurisdiction == county
+                )
+            ).all()
+            for html_hash in rows:
+                if not is_legacy_html_hash(html_hash):
+                    seen_sets["html_hashes"].add(html_hash)
             self.logger.info(
-                f"Version: Duplicate. Not adding. Case with matching HTML hash exists: {html_hash}"
+                f"Seeded seen-sets for {county} with {len(rows)} existing cases"
             )
-            return -1
+        return seen_sets
 
-        # 2. New Case Check
-        existing_case_metadatas = self.session.exec(
-            select(CaseMetadata).where(CaseMetadata.court_case_number == cause_number)
-        ).all()
+    def lock_cause_numbers(self, cause_numbers) -> None:
+        """
+        Takes a transaction-scoped advisory lock per cause number on PostgreSQL, so concurrent writers
+        resolve and write versions of the same case one after the other. The locks are released when the
+        transaction ends.
 
-        if not existing_case_metadatas:
-            version = 1
-            self.logger.info(
-                f"Version: New Case. Adding. No case with matching cause number exists: {cause_number}"
-            )
-            return version
+        A call takes its locks in key order, but locks taken by later calls of the same transaction come
+        after them, so a transaction writing several cases takes all of their locks in its first call.
+        Then two writers can't deadlock.
+        """
+        if self.session.get_bind().dialect.name != "postgresql":
+            return
+        keys = sorted(
+            int.from_bytes(xxhash.xxh64_digest(str(cause_number)), "big", signed=True)
+            for cause_number in cause_numbers
+        )
+        self.session.execute(
+            text("SELECT pg_advisory_xact_lock(key) FROM unnest(CAST(:keys AS bigint[])) AS key"),
+            {"keys": keys},
+        )
 
-        # 3. Existing Case Check
-        else:
-            versions = [
-                cm.version for cm in existing_case_metadatas if cm.version is not None
-            ]  # only add versions that are not None.
-            if versions:
-                highest_version = max(versions)
-                version = highest_version + 1
-            else:
-                version = 1  # if there are no versions, set to one.
-            self.logger.info(
-                f"Version: Updated Case. Adding. {len(existing_case_metadatas)} cases with matching cause number exists: {cause_number}"
-            )
-            return version
-
-    def hash_html(self, html_tables):
-        if html_tables:
-            """
-            Why balance table is dropped before hashing:
-            The balance table is excluded from the hashing because
-            balance is updated as any costs are paid off. Otherwise,
-            the hash would change frequently and multiple versions
-            of the case would be captured that we don't want.
-            """
-            balance_table = html_tables[-1]
-            if "Balance Due" in balance_table.text:
-                balance_table.decompose()
-            html_hash = xxhash.xxh64(str(balance_table.text)).hexdigest()
-        return html_hash
+    def resolve_versions(self, case_metadatas: List[CaseMetadata]) -> List[int]:
+        """
+        Determines the version numbers of a batch of CaseMetadata entries with one query, in order:
+        -1 for a duplicate of a stored or earlier html hash, 1 for a new cause number, and one more
+        than the highest version of the cause number otherwise. The query uses the indexes on
+        `court_case_number` and `html_hash`.
 
-    def parser_hays(
-        self,
-        county: str,
-        odyssey_id: str,
-        case_number,
-        logger,
-        case_soup: BeautifulSoup,
-    ) -> Dict[str, Dict]:
-        try:
-            with self.session:
+        Hashes the county's seen-set has never seen can't be duplicates and are left out of the query.
 
-                body = case_soup.select("body")
-                root_tables = case_soup.select("body>table")
+        Cases stored before `canonical_content_hash` have legacy hashes no page hashes to any more, so the
+        first page of such a cause number parsed since is a new version, even if its content is unchanged.
+        """
+        cause_numbers = {case_metadata.court_case_number for case_metadata in case_metadatas}
+        self.lock_cause_numbers(cause_numbers)
+        possible_hashes = {
+            case_metadata.html_hash
+            for case_metadata in case_metadatas
+            if self.get_seen_sets(case_metadata.county_of_jurisdiction)[
+                "html_hashes"
+            ].might_contain(case_metadata.html_hash)
+        }
+        conditions = [
+            CaseMetadata.court_case_number.in_(cause_numbers - {None}),
+            CaseMetadata.html_hash.in_(possible_hashes),
+        ]
+        if None in cause_numbers:
+            conditions.append(CaseMetadata.court_case_number.is_(None))
+        rows = self.session.exec(
+            select(
+                CaseMetadata.court_case_number, CaseMetadata.html_hash, CaseMetadata.version
+            ).where(or_(*conditions))
+        ).all()
 
-                # Get fields related to the case
-                case_metadata_data = self.get_case_metadata(
-                    county, odyssey_id, case_soup, logger
+        stored_hashes = set()
+        case_counts = Counter()
+        highest_versions = {}
+        for cause_number, html_hash, version in rows:
+            stored_hashes.add(html_hash)
+            if cause_number in cause_numbers:
+                case_counts[cause_number] += 1
+                if version is not None:
+                    highest_versions[cause_number] = max(
+                        version, highest_versions.get(cause_number, version)
+                    )
+
+        versions = []
+        for case_metadata in case_metadatas:
+            html_hash = case_metadata.html_hash
+            cause_number = case_metadata.court_case_number
+            if html_hash in stored_hashes:
+                version = -1
+                self.logger.info(
+                    f"Version: Duplicate. Not adding. Case with matching HTML hash exists: {html_hash}"
                 )
-
-                # Create CaseMetadata
-
-                case_metadata = CaseMetadata(
-                    county_of_jurisdiction=case_metadata_data["county_of_jurisdiction"],
-                    court_case_number=case_metadata_data["court_case_number"],
-                    good_motions=None,
-                    has_evidence_of_representation=None,
-                    parsing_date=datetime.now().date(),
-                    html_hash=self.hash_html(root_tables),
-                    odyssey_id=odyssey_id,
-                    court_case_number_hashed=xxhash.xxh64(
-                        str(case_metadata_data["court_case_number"])
-                    ).hexdigest(),
-                    case_name=None,
-                    case_type=None,
-                    date_filed=None,
-                    location=None,
-                    version=None,
+            elif not case_counts[cause_number]:
+                version = 1
+                self.logger.info(
+                    f"Version: New Case. Adding. No case with matching cause number exists: {cause_number}"
+                )
+            else:
+                # if there are no versions, set to one
+                version = highest_versions.get(cause_number, 0) + 1
+                self.logger.info(
+                    f"Version: Updated Case. Adding. {case_counts[cause_number]} cases with matching cause number exists: {cause_number}"
                 )
+            # later cases of the batch see this one, as if it were already stored
+            versions.append(version)
+            stored_hashes.add(html_hash)
+            case_counts[cause_number] += 1
+            highest_versions[cause_number] = max(
+                version, highest_versions.get(cause_number, version)
+            )
+        return versions
 
-                # Find the correct version number per this cause number
-                case_metadata.version = self.add_version(CaseMetadata)
+    def classify_section(self, table_text: str) -> Optional[str]:
+        """Returns which `SECTION_MARKERS` section a root table is, from its text, or None."""
+        for section, markers in SECTION_MARKERS:
+            if all(marker in table_text for marker in markers):
+                return section
+        return None
 
-                self.session.add(case_metadata)
-                self.session.commit()
-                self.session.refresh(case_metadata)
+    def hash_html(self, case_html: Union[bytes, str], county: str) -> str:
+        """
+        Hashes a case page of a county from its raw bytes, before it is parsed, see `canonical_content_hash`.
 
-                for table in root_tables:
+        Why balance table is dropped before hashing:
+        The balance table is excluded from the hashing because
+        balance is updated as any costs are paid off. Otherwise,
+        the hash would change frequently and multiple versions
+        of the case would be captured that we don't want.
+        """
+        return canonical_content_hash(case_html, county)
 
-                    if "Case Type:" in table.text and "Date Filed:" in table.text:
-                        case_details = self.get_case_details(table, logger)
+    def find_known_hashes(self, county: str, html_hashes) -> Set[str]:
+        """
+        Returns which of the html hashes are already stored, with at most one query. Hashes the
+        county's seen-set has never seen are left out of it, so a batch of new pages costs none.
+        """
+        seen_hashes = self.get_seen_sets(county)["html_hashes"]
+        possible_hashes = {
+            html_hash for html_hash in html_hashes if seen_hashes.might_contain(html_hash)
+        }
+        if not possible_hashes:
+            return set()
+        return set(
+            self.session.exec(
+                select(CaseMetadata.html_hash).where(
+                    CaseMetadata.html_hash.in_(possible_hashes)
+                )
+            ).all()
+        )
 
-                        # Update CaseMetadata row with event-related field
-                        case_metadata_row = self.session.get(
-                            CaseMetadata, case_metadata.id
-                        )
-                        if case_metadata_row:
-                            case_metadata_row.case_name = case_details["case_name"]
-                            case_metadata_row.case_type = case_details["case_type"]
-                            case_metadata_row.date_filed = case_details["date_filed"]
-                            case_metadata_row.location = case_details["location"]
-                            self.session.add(case_metadata_row)
-                            self.session.commit()
-
-                    elif "Related Case Information" in table.text:
-                        related_cases_data = [
-                            case.text.strip().replace("\xa0", " ")
-                            for case in table.select("td")
-                        ]
-                        for related_case_text in related_cases_data:
-                            related_case = RelatedCase(
-                                case_id=case_metadata.id, related_case=related_case_text
-                            )
-                            self.session.add(related_case)
+    def extract_case(
+        self,
+        county: str,
+        odyssey_id: str,
+        case_soup: BeautifulSoup,
+        logger,
+        html_hash: Optional[str] = None,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> Dict:
+        """
+        Extracts every row `write_case` stores for a case page, as plain dictionaries and
+        lists so the result can be sent between processes. Needs no database.
 
-                    elif "Party Information" in table.text:
-                        # Extract and add defendant row
-                        defendant_data = self.parse_defendant_rows(
-                            self.extract_rows(table, logger), logger
-                        )
-                        defendant = Defendant(
-                            case_id=case_metadata.id, **defendant_data
-                        )
-                        self.session.add(defendant)
+        :param html_hash: The `hash_html` of the page as read, hashed from the soup when not given.
+        :param timings: Seconds spent in each section are added to it, see `StageTimer`.
+        """
+        if html_hash is None:
+            html_hash = self.hash_html(str(case_soup), county)
+
+        # Each root table's text is built once, to classify it and to find the balance table
+        with timed(timings, "sections"):
+            root_tables = ROOT_TABLES.select(case_soup)
+            table_texts = [table.get_text() for table in root_tables]
+            if table_texts and BALANCE_MARKER in table_texts[-1]:
+                root_tables[-1].decompose()
+            sections = [
+                (self.classify_section(table_text), table)
+                for table, table_text in zip(root_tables, table_texts)
+                if not table.decomposed
+            ]
 
-                        # Extract and add defense attorney row
-                        defense_attorney_data = self.parse_defense_attorney_rows(
-                            self.extract_rows(table, logger), logger
+        # Get fields related to the case
+        with timed(timings, "case_metadata"):
+            case_metadata_data = self.get_case_metadata(county, odyssey_id, case_soup, logger)
+        case_record = {
+            "case_metadata": {
+                "county_of_jurisdiction": case_metadata_data["county_of_jurisdiction"],
+                "court_case_number": case_metadata_data["court_case_number"],
+                "good_motions": None,
+                "has_evidence_of_representation": None,
+                "parsing_date": datetime.now().date(),
+                "html_hash": html_hash,
+                "odyssey_id": odyssey_id,
+                "court_case_number_hashed": xxhash.xxh64(
+                    str(case_metadata_data["court_case_number"])
+                ).hexdigest(),
+                "case_name": None,
+                "case_type": None,
+                "date_filed": None,
+                "location": None,
+                "version": None,
+            },
+            "related_cases": [],
+            "defendants": [],
+            "defense_attorneys": [],
+            "state_information": [],
+            "charges": [],
+            "dispositions": [],
+            "events": [],
+        }
+        case_metadata = case_record["case_metadata"]
+        charge_information_data = []
+
+        for section, table in sections:
+
+            if section == "case_details":
+                with timed(timings, "case_details"):
+                    case_metadata.update(self.get_case_details(table, logger))
+
+            elif section == "related_cases":
+                with timed(timings, "related_cases"):
+                    case_record["related_cases"] += [
+                        case.text.strip().replace("\xa0", " ") for case in DATA_CELLS.select(table)
+                    ]
+
+            elif section == "parties":
+                with timed(timings, "parties"):
+                    # one set of rows shared by the defendant, defense and state parsers
+                    rows = self.extract_rows(table, logger)
+                    case_record["defendants"].append(self.parse_defendant_rows(rows, logger))
+                    case_record["defense_attorneys"].append(
+                        self.parse_defense_attorney_rows(rows, logger)
+                    )
+                    case_record["state_information"].append(self.parse_state_rows(rows, logger))
+
+            elif section == "charges":
+                with timed(timings, "charges"):
+                    # Get charge information from the HTML table
+                    charge_information_data = self.get_charge_information(table, logger)
+
+                    # Create preliminary dictionary with charge information
+                    charges_dict = [
+                        {
+                            "original_charge": charge_info["charges"],
+                            "statute": charge_info["statute"],
+                            "charge_level": charge_info["level"],
+                            "charge_date": (
+                                datetime.strptime(charge_info["date"], "%m/%d/%Y").date()
+                                if charge_info["date"]
+                                else None
+                            ),
+                        }
+                        for charge_info in charge_information_data
+                    ]
+
+                with timed(timings, "umich_mapping"):
+                    # Charge database to categorize charge text, compiled and mapped once per process
+                    charges_mapped = get_charge_matcher(get_charge_index(UMICH_CHARGE_FILE))
+
+                    # Process the charge dictionary to add additional fields
+                    charges_processed, earliest_charge_date = self.process_charges(
+                        charges_dict, charges_mapped
+                    )
+                    case_record["charges"] += charges_processed
+
+            elif section == "events":
+                with timed(timings, "events"):
+                    # Extract dispositions and events
+                    disposition_rows, other_event_rows = (
+                        self.format_events_and_orders_of_the_court(table, case_soup, logger)
+                    )
+
+                    # Parse dispositions
+                    dispositions = []
+                    for row in disposition_rows:
+                        disposition_data = self.get_disposition_information(
+                            row,
+                            dispositions,
+                            {},  # case_data not used here
+                            table,
+                            county,
+                            case_soup,
+                            logger,
                         )
-                        defense_attorney = DefenseAttorney(
-                            case_id=case_metadata.id, **defense_attorney_data
+                        if disposition_data and disposition_data != dispositions:
+                            dispositions = disposition_data
+
+                    for disp in dispositions:
+                        case_record["dispositions"].append(
+                            {
+                                "date": (
+                                    datetime.strptime(disp["date"], "%m/%d/%Y").date()
+                                    if disp["date"]
+                                    else None
+                                ),
+                                "event": disp["event"],
+                                "judicial_officer": disp.get("judicial_officer"),
+                                "details": [
+                                    {"charge": detail.get("charge"), "outcome": detail.get("outcome")}
+                                    for detail in disp.get("details", [])
+                                ],
+                            }
                         )
-                        self.session.add(defense_attorney)
 
-                        # Extract and add state attorney row
-                        state_data = self.parse_state_rows(
-                            self.extract_rows(table, logger), logger
-                        )
-                        state_info = StateInformation(
-                            case_id=case_metadata.id,
-                            **state_data,
+                    # Parse the event rows
+                    for event_row in other_event_rows:
+                        case_record["events"].append(
+                            {
+                                "date": (
+                                    datetime.strptime(event_row[0], "%m/%d/%Y").date()
+                                    if event_row[0]
+                                    else None
+                                ),
+                                "event": event_row[1],
+                                "details": " ".join(event_row[2:]),
+                            }
                         )
-                        self.session.add(state_info)
 
-                    elif "Charge Information" in table.text:
+                    # Disposition and event-related fields of the case
+                    good_motions = self.find_good_motions(other_event_rows, GOOD_MOTIONS)
+                    # stored as a JSON list, the column is a string
+                    case_metadata["good_motions"] = json.dumps(good_motions)
+                    case_metadata["has_evidence_of_representation"] = len(good_motions) > 0
+                    top_charge_data = (
+                        self.get_top_charge(dispositions, charge_information_data, logger) or {}
+                    )
+                    case_metadata["top_charge_name"] = top_charge_data.get("charge_name")
+                    case_metadata["top_charge_level"] = top_charge_data.get("charge_level")
+                    case_metadata["dismissed_charges_count"] = self.count_dismissed_charges(
+                        dispositions, logger
+                    )
+
+        return case_record
+
+    def write_case(
+        self,
+        case_record: Dict,
+        commit: bool = True,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> CaseMetadata:
+        """
+        Writes a case extracted by `extract_case`, with its version resolved against the database.
+        A duplicate, version -1, is not written.
 
-                        # Load charge database to categorize charge text
-                        charge_name_to_umich_file = os.path.join(
-                            os.path.dirname(__file__),
-                            "..",
-                            "..",
-                            "resources",
-                            "umich-uccs-database.json",
-                        )
-                        charges_mapped = self.load_and_map_charge_names(
-                            charge_name_to_umich_file
-                        )
+        With `commit=False` the rows are only flushed, so several cases can be committed together.
 
-                        # Get charge information from the HTML table
-                        charge_information_data = self.get_charge_information(
-                            table, logger
-                        )
-                        charges_dict = []
-
-                        # Create preliminary dictionary with charge information
-                        for i, charge_info in enumerate(charge_information_data):
-                            charge_dict = {
-                                "case_id": case_metadata.id,
-                                "original_charge": charge_info["charges"],
-                                "statute": charge_info["statute"],
-                                "charge_level": charge_info["level"],
-                                "charge_date": (
-                                    datetime.strptime(
-                                        charge_info["date"], "%m/%d/%Y"
-                                    ).date()
-                                    if charge_info["date"]
-                                    else None
-                                ),
-                            }
-                            charges_dict.append(charge_dict)
+        :param timings: Seconds spent resolving the version and writing are added to it, see `StageTimer`.
+        """
+        case_metadata_data = case_record["case_metadata"]
+        case_metadata = CaseMetadata(**case_metadata_data)
+
+        # Find the correct version number per this cause number
+        with timed(timings, "versions"):
+            case_metadata.version = self.resolve_versions([case_metadata])[0]
+        if case_metadata.version == -1:
+            return case_metadata
+
+        with timed(timings, "db_write"):
+            self.write_case_rows(case_record, case_metadata, commit)
+        return case_metadata
+
+    def write_case_rows(
+        self, case_record: Dict, case_metadata: CaseMetadata, commit: bool = True
+    ) -> None:
+        """Adds the rows of a case whose version `write_case` resolved."""
+        case_metadata_data = case_record["case_metadata"]
+        self.session.add(case_metadata)
+        self.session.flush()
+        case_id = case_metadata.id
+
+        for related_case_text in case_record["related_cases"]:
+            self.session.add(RelatedCase(case_id=case_id, related_case=related_case_text))
+        for defendant_data in case_record["defendants"]:
+            self.session.add(Defendant(case_id=case_id, **defendant_data))
+        for defense_attorney_data in case_record["defense_attorneys"]:
+            self.session.add(DefenseAttorney(case_id=case_id, **defense_attorney_data))
+        for state_data in case_record["state_information"]:
+            self.session.add(StateInformation(case_id=case_id, **state_data))
+        for charge_data in case_record["charges"]:
+            self.session.add(Charge(case_id=case_id, **charge_data))
+        for disp in case_record["dispositions"]:
+            disposition_model = Disposition(
+                case_id=case_id,
+                date=disp["date"],
+                event=disp["event"],
+                judicial_officer=disp["judicial_officer"],
+            )
+            self.session.add(disposition_model)
+            self.session.flush()
+            for detail in disp["details"]:
+                self.session.add(
+                    DispositionDetail(disposition_id=disposition_model.id, **detail)
+                )
+        for event_data in case_record["events"]:
+            self.session.add(Event(case_id=case_id, **event_data))
 
-                        # Process the charge dictionary to add additional fields
-                        charges_processed, earliest_charge_date = self.process_charges(
-                            charges_dict, charges_mapped
-                        )
+        self.session.flush()
+        # added before the commit so a later case of the same batch sees this one
+        self.add_to_seen_sets([case_metadata_data])
+        if commit:
+            self.session.commit()
 
-                        # Add the final processes charges to the table
-                        for charge_data in charges_processed:
-                            charge = Charge(case_id=case_metadata.id, **charge_data)
-                            self.session.add(charge)
+    def add_to_seen_sets(self, case_metadatas: List[Dict]) -> None:
+        """
+        Adds written cases to their county's seen-set of html hashes. If the transaction is
+        rolled back, the stale entries only cost a database check later.
+        """
+        for case_metadata in case_metadatas:
+            seen_sets = self.get_seen_sets(case_metadata["county_of_jurisdiction"])
+            seen_sets["html_hashes"].add(case_metadata["html_hash"])
 
-                    elif "Events & Orders of the Court" in table.text:
+    def bulk_write_cases(
+        self, case_records: List[Dict], timings: Optional[Dict[str, float]] = None
+    ) -> List[int]:
+        """
+        Writes a batch of extracted cases with one statement per table, without committing.
 
-                        # Extract dispositions and events
-                        disposition_rows, other_event_rows = (
-                            self.format_events_and_orders_of_the_court(
-                                table, case_soup, logger
-                            )
-                        )
+        Cases and dispositions are inserted with RETURNING to get the ids their child rows need;
+        every other table is loaded with COPY on PostgreSQL and one executemany INSERT elsewhere.
+        Versions are resolved for the whole batch by `resolve_versions`, in the order of `case_records`,
+        and duplicates, version -1, are not written.
 
-                        # Parse dispositions and add them as rows
-                        dispositions = []
-                        for row in disposition_rows:
-                            disposition_data = self.get_disposition_information(
-                                row,
-                                dispositions,
-                                {},  # case_data not used here
-                                table,
-                                county,
-                                case_soup,
-                                logger,
-                            )
-                            if disposition_data and disposition_data != dispositions:
-                                dispositions = disposition_data
-
-                        if dispositions:
-                            for disp in dispositions:
-                                disposition_model = Disposition(
-                                    case_id=case_metadata.id,
-                                    date=(
-                                        datetime.strptime(
-                                            disp["date"], "%m/%d/%Y"
-                                        ).date()
-                                        if disp["date"]
-                                        else None
-                                    ),
-                                    event=disp["event"],
-                                    judicial_officer=disp.get("judicial_officer"),
-                                )
-                                self.session.add(disposition_model)
-                                self.session.commit()
-                                self.session.refresh(disposition_model)
-
-                                for detail in disp.get("details", []):
-                                    disp_detail = DispositionDetail(
-                                        disposition_id=disposition_model.id,
-                                        charge=detail.get("charge"),
-                                        outcome=detail.get("outcome"),
-                                    )
-                                    self.session.add(disp_detail)
-
-                        # Parse and write the event rows to the database
-                        for event_row in other_event_rows:
-                            event_date = (
-                                datetime.strptime(event_row[0], "%m/%d/%Y").date()
-                                if event_row[0]
-                                else None
-                            )
-                            event_model = Event(
-                                case_id=case_metadata.id,
-                                date=event_date,
-                                event=event_row[1],
-                                details=" ".join(event_row[2:]),
-                            )
-                            self.session.add(event_model)
+        :param timings: Seconds spent resolving versions and writing are added to it, see `StageTimer`.
+        :returns: The version of each case, in the order of `case_records`.
+        """
+        case_metadatas = [
+            CaseMetadata(**case_record["case_metadata"]) for case_record in case_records
+        ]
+        with timed(timings, "versions"):
+            versions = self.resolve_versions(case_metadatas)
+        with timed(timings, "db_write"):
+            self.bulk_write_rows(
+                [case_record for case_record, version in zip(case_records, versions) if version != -1],
+                [version for version in versions if version != -1],
+            )
+        return versions
 
-                        # Update CaseMetadata row with disposition and event-related field
-                        case_metadata_row = self.session.get(
-                            CaseMetadata, case_metadata.id
-                        )
-                        if case_metadata_row:
-                            case_metadata_row.good_motions = self.find_good_motions(
-                                other_event_rows, GOOD_MOTIONS
-                            )
-                            case_metadata_row.has_evidence_of_representation = (
-                                len(case_metadata_row.good_motions) > 0
-                            )
+    def bulk_write_rows(self, case_records: List[Dict], versions: List[int]) -> None:
+        """Inserts the rows of a batch whose versions `bulk_write_cases` resolved."""
+        metadata_rows = [
+            bulk_load.to_row(CaseMetadata, case_record["case_metadata"], version=version)
+            for case_record, version in zip(case_records, versions)
+        ]
 
-                            top_charge_data = self.get_top_charge(
-                                dispositions,
-                                charge_information_data,
-                                logger,
-                            )
-                            case_metadata_row.top_charge_name = top_charge_data[
-                                "charge_name"
-                            ]
-                            case_metadata_row.top_charge_level = top_charge_data[
-                                "charge_level"
-                            ]
-
-                            case_metadata_row.dismissed_charges_count = (
-                                self.count_dismissed_charges(dispositions, logger)
-                            )
+        case_ids = bulk_load.insert_returning_ids(self.session, CaseMetadata, metadata_rows)
+
+        disposition_rows = []
+        disposition_details = []
+        rows = {RelatedCase: [], **{model: [] for model in BULK_LEAF_TABLES}}
+        for case_id, case_record in zip(case_ids, case_records):
+            rows[RelatedCase] += [
+                {"case_id": case_id, "related_case": related_case}
+                for related_case in case_record["related_cases"]
+            ]
+            for model, key in BULK_LEAF_TABLES.items():
+                rows[model] += [
+                    bulk_load.to_row(model, data, case_id=case_id)
+                    for data in case_record[key]
+                ]
+            for disp in case_record["dispositions"]:
+                disposition_rows.append(bulk_load.to_row(Disposition, disp, case_id=case_id))
+                disposition_details.append(disp["details"])
+
+        disposition_ids = bulk_load.insert_returning_ids(
+            self.session, Disposition, disposition_rows
+        )
+        rows[DispositionDetail] = [
+            bulk_load.to_row(DispositionDetail, detail, disposition_id=disposition_id)
+            for disposition_id, details in zip(disposition_ids, disposition_details)
+            for detail in details
+        ]
+        for model, model_rows in rows.items():
+            bulk_load.insert_rows(self.session, model, model_rows)
 
-                            self.session.add(case_metadata_row)
-                            self.session.commit()
+        self.add_to_seen_sets([case_record["case_metadata"] for case_record in case_records])
 
-                self.session.commit()
-                return {"status": "success"}  # Return a success status
+    def write_cases(
+        self,
+        case_records: List[Dict],
+        logger,
+        bulk: bool = False,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> List[Dict]:
+        """
+        Writes a batch of extracted cases in one transaction. If the batch fails, the cases are
+        written again one at a time so one bad case doesn't lose the others.
+
+        :param bulk: Write the batch with `bulk_write_cases` instead of one case at a time.
+        :param timings: Seconds spent resolving versions and writing the batch are added to it.
+        :returns: A status per case, in the order of `case_records`. Written cases have their resolved
+            version, -1 for a duplicate.
+        """
+        try:
+            with self.session:
+                if bulk:
+                    versions = self.bulk_write_cases(case_records, timings)
+                else:
+                    # every lock up front, each write_case locking its own case could deadlock
+                    self.lock_cause_numbers(
+                        {case_record["case_metadata"]["court_case_number"] for case_record in case_records}
+                    )
+                    versions = [
+                        self.write_case(case_record, commit=False, timings=timings).version
+                        for case_record in case_records
+                    ]
+                with timed(timings, "db_write"):
+                    self.session.commit()
+            return [{"status": "success", "version": version} for version in versions]
+        except Exception as e:
+            logger.warning(f"Batch of {len(case_records)} cases failed, writing them one by one: {e}")
+            self.session.rollback()
+
+        statuses = []
+        for case_record in case_records:
+            try:
+                with self.session:
+                    version = self.write_case(case_record, timings=timings).version
+                statuses.append({"status": "success", "version": version})
+            except Exception as e:
+                logger.error(f"Unexpected error while writing Hays case: {e}")
+                logger.error(f"Traceback: {traceback.format_exc()}")
+                self.session.rollback()
+                statuses.append({"status": "error", "error": str(e)})
+        return statuses
+
+    def parser_hays(
+        self,
+        county: str,
+        odyssey_id: str,
+        case_number,
+        logger,
+        case_soup: BeautifulSoup,
+        html_hash: Optional[str] = None,
+        timings: Optional[Dict[str, float]] = None,
+    ) -> Dict[str, Dict]:
+        try:
+            case_record = self.extract_case(
+                county, odyssey_id, case_soup, logger, html_hash, timings
+            )
+            with self.session:
+                self.write_case(case_record, timings=timings)
+            return {"status": "success"}  # Return a success status
         except Exception as e:
             logger.error(f"Unexpected error while parsing Hays case: {e}")
             logger.error(f"Traceback: {traceback.format_exc()}")
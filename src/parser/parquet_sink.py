@@ -0,0 +1,203 @@
+import os
+import re
+import threading
+import uuid
+from datetime import date
+from typing import Dict, List, Optional, Type
+
+import xxhash
+from sqlalchemy.sql import sqltypes
+from sqlalchemy.types import TypeDecorator
+from sqlmodel import SQLModel
+
+from .models import (
+    CaseMetadata,
+    Charge,
+    Defendant,
+    DefenseAttorney,
+    Disposition,
+    DispositionDetail,
+    Event,
+    RelatedCase,
+    StateInformation,
+)
+from .bulk_load import to_row
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional, only needed for --parquet_dir
+    pyarrow = None
+
+# Entities written by `ParquetCaseSink`.
+PARQUET_TABLES = (
+    CaseMetadata,
+    RelatedCase,
+    Defendant,
+    DefenseAttorney,
+    StateInformation,
+    Charge,
+    Disposition,
+    DispositionDetail,
+    Event,
+)
+# Tables whose rows are dictionaries under a key of an extracted case, and that key.
+CASE_CHILD_TABLES = {
+    Defendant: "defendants",
+    DefenseAttorney: "defense_attorneys",
+    StateInformation: "state_information",
+    Charge: "charges",
+    Disposition: "dispositions",
+    Event: "events",
+}
+
+# Cases buffered before their rows are written out, one file per table and partition.
+PARQUET_BATCH_SIZE = 5000
+
+# Directory partitions every table is split by, Hive style: <table>/county=hays/filing_year=2016/.
+PARTITION_COLUMNS = ["county", "filing_year"]
+
+FILING_YEAR = re.compile(r"\b(\d{4})\b")
+
+
+def get_arrow_schema(model: Type[SQLModel]):
+    """Builds the Arrow schema of a table from its model's columns, every one nullable."""
+    # DateTime before Date and Boolean before Integer, since a type can derive from another
+    arrow_types = [
+        (sqltypes.String, pyarrow.string()),
+        (sqltypes.Boolean, pyarrow.bool_()),
+        (sqltypes.Integer, pyarrow.int64()),
+        (sqltypes.DateTime, pyarrow.timestamp("us")),
+        (sqltypes.Date, pyarrow.date32()),
+    ]
+
+    def get_arrow_type(column):
+        # type decorators such as SQLModel's AutoString wrap a plain SQL type
+        column_type = column.type.impl if isinstance(column.type, TypeDecorator) else column.type
+        return next(
+            arrow_type for sql_type, arrow_type in arrow_types if isinstance(column_type, sql_type)
+        )
+
+    return pyarrow.schema(
+        [pyarrow.field(column.name, get_arrow_type(column)) for column in model.__table__.columns]
+        + [pyarrow.field(name, pyarrow.string()) for name in PARTITION_COLUMNS]
+    )
+
+
+def to_arrow_date(value) -> Optional[date]:
+    # some extracted dates are still ISO strings
+    if isinstance(value, str):
+        return date.fromisoformat(value) if value else None
+    return value
+
+
+def get_filing_year(date_filed: Optional[str]) -> Optional[str]:
+    """Returns the year of a case's filing date, e.g. '01/05/2016', or None if it has none."""
+    match = FILING_YEAR.search(date_filed or "")
+    return match.group(1) if match else None
+
+
+def make_key(*parts) -> int:
+    """A signed 64-bit key derived from its parts, the same on every run."""
+    return int.from_bytes(xxhash.xxh64_digest("\x00".join(map(str, parts))), "big", signed=True)
+
+
+class ParquetCaseSink:
+    """
+    Writes extracted cases to a Parquet dataset, one directory per entity of models.py, partitioned by
+    county and filing year. Columns match the model fields.
+
+    The files don't come from the database, so `id`, `case_id` and `disposition_id` are 64-bit keys derived
+    from the case's html hash: the same case version gets the same keys on every run, so a page written twice
+    can be told apart by its id, and the tables join on them the way the database tables join on their ids.
+    """
+
+    def __init__(self, directory: str, batch_size: int = PARQUET_BATCH_SIZE) -> None:
+        """
+        :param directory: Root of the dataset, created if it doesn't exist.
+        :param batch_size: Cases buffered before they are written.
+        :raises ImportError: If pyarrow isn't installed.
+        """
+        if pyarrow is None:
+            raise ImportError("Parquet output needs pyarrow, pip install pyarrow")
+        self.directory = directory
+        self.batch_size = batch_size
+        self.schemas = {model: get_arrow_schema(model) for model in PARQUET_TABLES}
+        self.rows: Dict[Type[SQLModel], List[Dict]] = {model: [] for model in PARQUET_TABLES}
+        self.buffered_cases = 0
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def add_case(self, case_record: Dict) -> None:
+        case_metadata = case_record["case_metadata"]
+        partition = {
+            "county": case_metadata["county_of_jurisdiction"],
+            "filing_year": get_filing_year(case_metadata["date_filed"]),
+        }
+        case_id = make_key(case_metadata["html_hash"])
+        self.rows[CaseMetadata].append(
+            {**to_row(CaseMetadata, case_metadata), "id": case_id, **partition}
+        )
+        self.rows[RelatedCase] += [
+            {
+                "id": make_key(case_id, "related_cases", i),
+                "case_id": case_id,
+                "related_case": related_case,
+                **partition,
+            }
+            for i, related_case in enumerate(case_record["related_cases"])
+        ]
+        for model, key in CASE_CHILD_TABLES.items():
+            for i, data in enumerate(case_record[key]):
+                row_id = make_key(case_id, key, i)
+                self.rows[model].append(
+                    {**to_row(model, data, case_id=case_id), "id": row_id, **partition}
+                )
+                if model is Disposition:
+                    self.rows[DispositionDetail] += [
+                        {
+                            **to_row(DispositionDetail, detail, disposition_id=row_id),
+                            "id": make_key(row_id, j),
+                            **partition,
+                        }
+                        for j, detail in enumerate(data["details"])
+                    ]
+        self.buffered_cases += 1
+
+    def write_cases(self, case_records: List[Dict]) -> None:
+        """
+        Buffers extracted cases and writes them out once `batch_size` are buffered. The case metadata of each
+        has its version resolved against the database; duplicates, version -1, are left out by the caller.
+        """
+        with self.lock:
+            for case_record in case_records:
+                self.add_case(case_record)
+            if self.buffered_cases >= self.batch_size:
+                self.write_buffered()
+
+    def flush(self) -> None:
+        """Writes the buffered cases, one new file per table and partition, so earlier files are never rewritten."""
+        with self.lock:
+            self.write_buffered()
+
+    def write_buffered(self) -> None:
+        basename_template = f"part-{uuid.uuid4().hex}-{{i}}.parquet"
+        for model, rows in self.rows.items():
+            if not rows:
+                continue
+            schema = self.schemas[model]
+            columns = {field.name: [row.get(field.name) for row in rows] for field in schema}
+            for field in schema:
+                if field.type == pyarrow.date32():
+                    columns[field.name] = [to_arrow_date(value) for value in columns[field.name]]
+            pyarrow.parquet.write_to_dataset(
+                pyarrow.table(columns, schema=schema),
+                os.path.join(self.directory, model.__tablename__),
+                partition_cols=PARTITION_COLUMNS,
+                basename_template=basename_template,
+            )
+        self.rows = {model: [] for model in PARQUET_TABLES}
+        self.buffered_cases = 0
+
+    def close(self) -> None:
+        self.flush()
@@ -0,0 +1,179 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+import xxhash
+from sqlalchemy.engine import make_url
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS parsed_files (
+    target TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    content_hash TEXT NOT NULL,
+    parser_version TEXT,
+    status TEXT NOT NULL,
+    parsed_at TEXT NOT NULL,
+    PRIMARY KEY (target, path)
+)
+"""
+
+
+def hash_file(path: str) -> str:
+    """Returns the xxh3-128 hex digest of a file's bytes."""
+    file_hash = xxhash.xxh3_128()
+    with open(path, "rb") as file_handle:
+        for chunk in iter(lambda: file_handle.read(1 << 20), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def get_manifest_target(
+    database_url: Optional[str], output_format: str, parquet_dir: Optional[str] = None
+) -> str:
+    """
+    Identifies where parsed cases go: the database URL without its password, the output format
+    and the Parquet directory, if any.
+    """
+    if database_url:
+        database_url = make_url(database_url).render_as_string(hide_password=True)
+    target = f"{database_url or 'no database'} {output_format}"
+    if parquet_dir:
+        target += f" {os.path.abspath(parquet_dir)}"
+    return target
+
+
+def fingerprint_file(path: str) -> Tuple[int, int, str]:
+    """Returns a file's size, modification time in nanoseconds and content hash, stat first."""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns, hash_file(path)
+
+
+class ParseManifest:
+    """
+    SQLite record of every case page parsed for a county: its size, modification time, content hash,
+    the county parser version that parsed it and whether that succeeded.
+
+    `select_changed` uses it to skip pages that were parsed successfully by the same parser version
+    and haven't changed since. The size and modification time are checked first; only pages where
+    they differ are hashed, so a rewritten but identical page is still skipped.
+
+    Pages are recorded per target, the database and output the cases were written to, so parsing
+    into another database doesn't skip the pages that are only stored in the first one.
+    """
+
+    def __init__(self, path: str, parser_version: Optional[str] = None, target: str = "") -> None:
+        """
+        :param path: The manifest database file, created if it doesn't exist.
+        :param parser_version: Version of the county parser. Pages parsed by another version are parsed again.
+        :param target: Identifies where parsed cases are written, see `get_manifest_target`.
+        """
+        self.path = path
+        self.parser_version = None if parser_version is None else str(parser_version)
+        self.target = target
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        # fingerprints of the pages picked by `select_changed` that haven't been recorded yet
+        self.fingerprints: Dict[str, Tuple[int, int, str]] = {}
+        self.skipped = 0
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(parsed_files)")]
+        if columns and "target" not in columns:
+            # manifests from before targets were recorded can't tell which database their pages went to
+            self.connection.execute("DROP TABLE parsed_files")
+        self.connection.execute(SCHEMA)
+        self.connection.commit()
+
+    @classmethod
+    def for_county(
+        cls, county: str, parser_version: Optional[str] = None, target: str = ""
+    ) -> "ParseManifest":
+        """Opens the manifest of a county, data/<county>/parse_manifest.sqlite."""
+        base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+        return cls(os.path.join(base_dir, "data", county, "parse_manifest.sqlite"), parser_version, target)
+
+    def select_changed(self, paths: Iterable[str], force: bool = False) -> Iterator[str]:
+        """
+        Picks the pages that are new, changed, failed last time or were parsed by another parser version,
+        looking each one up as it comes so a directory of any size is never held in memory.
+
+        The fingerprint of a picked page is taken before it is parsed, so a page rewritten while it is
+        being parsed is picked again next time, and kept until `record` is called for it.
+        `skipped` counts the pages left out.
+
+        :param force: Pick every page.
+        :returns: Those paths in their original order.
+        """
+        for path in paths:
+            with self.lock:
+                entry = self.connection.execute(
+                    "SELECT size, mtime_ns, content_hash, parser_version, status FROM parsed_files"
+                    " WHERE target = ? AND path = ?",
+                    (self.target, os.path.abspath(path)),
+                ).fetchone()
+                try:
+                    if force or entry is None or entry[3:] != (self.parser_version, "success"):
+                        self.fingerprints[path] = fingerprint_file(path)
+                        changed = True
+                    else:
+                        stat = os.stat(path)
+                        changed = (stat.st_size, stat.st_mtime_ns) != entry[:2]
+                        if changed:
+                            fingerprint = fingerprint_file(path)
+                            changed = fingerprint[2] != entry[2]
+                            if changed:
+                                self.fingerprints[path] = fingerprint
+                            else:
+                                # rewritten with the same content, remember the new stat so it isn't hashed again
+                                self.connection.execute(
+                                    "UPDATE parsed_files SET size = ?, mtime_ns = ?"
+                                    " WHERE target = ? AND path = ?",
+                                    (*fingerprint[:2], self.target, os.path.abspath(path)),
+                                )
+                except OSError:
+                    # unreadable or gone; the parser reports it
+                    changed = True
+                if not changed:
+                    self.skipped += 1
+            if changed:
+                yield path
+
+    def record(self, path: str, status: str) -> None:
+        """
+        Records the outcome of parsing a page, once the case is written. Call `commit` to persist it.
+
+        :param status: "success" or "error"; only successfully parsed pages are skipped later.
+        """
+        with self.lock:
+            fingerprint = self.fingerprints.pop(path, None)
+        try:
+            size, mtime_ns, content_hash = fingerprint or fingerprint_file(path)
+        except OSError:
+            # gone since it was parsed; it will be parsed again if it comes back
+            return
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO parsed_files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.target,
+                    os.path.abspath(path),
+                    size,
+                    mtime_ns,
+                    content_hash,
+                    self.parser_version,
+                    status,
+                    datetime.now().isoformat(timespec="seconds"),
+                ),
+            )
+
+    def commit(self) -> None:
+        with self.lock:
+            self.connection.commit()
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
@@ -0,0 +1,120 @@
+import math
+import mmap
+import os
+import struct
+import threading
+from typing import Callable, Iterable, Optional
+
+import xxhash
+
+# Header of a persisted filter: magic, number of bits, number of hash functions.
+HEADER = struct.Struct("<8sQI")
+MAGIC = b"PDDBLOOM"
+
+
+def get_file_name(kind: str, database: str = "") -> str:
+    """The file name of a filter of the given kind for a database, e.g. seen_html_hashes-<hash>.bloom."""
+    if not database:
+        return f"seen_{kind}.bloom"
+    return f"seen_{kind}-{xxhash.xxh64_hexdigest(database)}.bloom"
+
+
+class SeenSet:
+    """
+    Bloom filter of keys, such as html hashes, that have already been seen.
+
+    The bit array lives in a file that is memory-mapped, so loading it at startup costs
+    no read and the pages are shared by every process that maps it. A miss is definite:
+    the key has never been added. A hit only means the key was *probably* added, so callers
+    confirm it with an exact check (see `contains`).
+
+    The filter only knows about keys added through it. A filter is seeded from the
+    database when its file is first created; if other writers add rows without updating
+    the filter, delete the file so it is rebuilt. Open one instance per file in a process
+    and share it between threads, so only its opener sees it as new.
+    """
+
+    def __init__(
+        self, path: str, capacity: int = 2_000_000, error_rate: float = 0.01
+    ) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.is_new = not os.path.exists(path)
+
+        if self.is_new:
+            num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+            num_hashes = max(1, round(num_bits / capacity * math.log(2)))
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # written aside and linked into place, so no other process maps a file without its header
+            temporary_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary_path, "wb") as file_handle:
+                file_handle.write(HEADER.pack(MAGIC, num_bits, num_hashes))
+                file_handle.truncate(HEADER.size + (num_bits + 7) // 8)
+            try:
+                os.link(temporary_path, path)
+            except FileExistsError:
+                # another process created it first
+                self.is_new = False
+            finally:
+                os.remove(temporary_path)
+
+        self.file_handle = open(path, "r+b")
+        self.bits = mmap.mmap(self.file_handle.fileno(), 0)
+        magic, self.num_bits, self.num_hashes = HEADER.unpack_from(self.bits, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Not a seen-set file: {path}")
+
+    @classmethod
+    def for_county(cls, county: str, kind: str, database: str = "", **kwargs) -> "SeenSet":
+        """
+        Opens the filter of the given kind, e.g. 'html_hashes', for a county.
+
+        :param database: The database whose keys it holds, such as its URL without the password. Each
+            database has a filter file of its own.
+        """
+        base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+        return cls(os.path.join(base_dir, "data", county, get_file_name(kind, database)), **kwargs)
+
+    def _positions(self, key: str):
+        digest = xxhash.xxh3_128_intdigest(key.encode("utf-8"))
+        h1 = digest & 0xFFFFFFFFFFFFFFFF
+        h2 = (digest >> 64) | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def might_contain(self, key: str) -> bool:
+        """False means the key was never added. True means it probably was."""
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[HEADER.size + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def contains(self, key: str, exact_check: Callable[[str], bool]) -> bool:
+        """Membership answered in memory for misses and by `exact_check` only for possible hits."""
+        if not self.might_contain(key):
+            return False
+        return exact_check(key)
+
+    def add(self, key: Optional[str]) -> None:
+        if key is None:
+            return
+        bits = self.bits
+        with self.lock:
+            for position in self._positions(key):
+                index = HEADER.size + (position >> 3)
+                bits[index] = bits[index] | (1 << (position & 7))
+
+    def update(self, keys: Iterable[Optional[str]]) -> None:
+        for key in keys:
+            self.add(key)
+
+    def flush(self) -> None:
+        self.bits.flush()
+
+    def close(self) -> None:
+        if not self.bits.closed:
+            self.bits.flush()
+            self.bits.close()
+        self.file_handle.close()
@@ -0,0 +1,192 @@
+import cProfile
+import heapq
+import itertools
+import marshal
+import math
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict, Iterator, List, Optional
+
+# Stages of parsing a case, in the order `StageTimer.format_summary` lists them. The parser times the
+# soup, the whole case and the writes; `ParserHays.extract_case` times the sections in between.
+STAGES = (
+    "soup",
+    "sections",
+    "case_metadata",
+    "case_details",
+    "related_cases",
+    "parties",
+    "charges",
+    "umich_mapping",
+    "events",
+    "versions",
+    "db_write",
+    "case",
+)
+
+# Percentiles reported for every stage.
+PERCENTILES = (50, 90, 99)
+
+# Durations are counted in buckets this factor apart, so percentiles are within 2% of the real value
+# and the memory a run takes doesn't grow with the number of cases.
+BUCKET_GROWTH = 1.02
+LOG_BUCKET_GROWTH = math.log(BUCKET_GROWTH)
+
+# Durations are counted as at least this many seconds, below the resolution of the clock anyway.
+MIN_SECONDS = 1e-7
+
+# Only one thread can be profiled at a time, the others parse their case without a profile.
+PROFILE_LOCK = threading.Lock()
+
+
+@contextmanager
+def timed(timings: Optional[Dict[str, float]], stage: str) -> Iterator[None]:
+    """Adds the seconds spent in the block to `timings[stage]`. Does nothing when `timings` is None."""
+    if timings is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + perf_counter() - start
+
+
+@contextmanager
+def profiled(enabled: bool) -> Iterator[Dict]:
+    """
+    Profiles the block with cProfile when enabled, unless another thread is being profiled.
+
+    :returns: A dictionary that holds the profile's stats after the block, empty if it wasn't profiled.
+    """
+    stats = {}
+    if not enabled or not PROFILE_LOCK.acquire(blocking=False):
+        yield stats
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            yield stats
+        finally:
+            profiler.disable()
+        profiler.create_stats()
+        stats.update(profiler.stats)
+    finally:
+        PROFILE_LOCK.release()
+
+
+def get_bucket(seconds: float) -> int:
+    return math.ceil(math.log(max(seconds, MIN_SECONDS)) / LOG_BUCKET_GROWTH)
+
+
+class StageTimer:
+    """
+    Aggregates how long each stage of parsing took over a run into percentiles per case, and with
+    `profile_slowest` keeps the cProfile stats of the slowest cases so they can be dumped at the end.
+
+    Shared by every thread of a parse; parse worker processes send their cases' timings back with the case.
+    """
+
+    def __init__(self, profile_slowest: int = 0) -> None:
+        """:param profile_slowest: Number of slowest cases whose profiles are kept, none by default."""
+        self.profile_slowest = profile_slowest
+        self.histograms: Dict[str, Counter] = {}
+        self.counts: Counter = Counter()
+        self.totals: Dict[str, float] = {}
+        self.maximums: Dict[str, float] = {}
+        # (seconds, sequence, odyssey_id, stats) of the slowest profiled cases, fastest first
+        self.slowest = []
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float, cases: int = 1) -> None:
+        """
+        Records that a stage took `seconds`. A stage run for several cases at once, such as writing a batch,
+        is counted as an even share of it for each of the `cases`.
+        """
+        if cases < 1:
+            return
+        share = seconds / cases
+        with self.lock:
+            self.histograms.setdefault(stage, Counter())[get_bucket(share)] += cases
+            self.counts[stage] += cases
+            self.totals[stage] = self.totals.get(stage, 0.0) + seconds
+            self.maximums[stage] = max(self.maximums.get(stage, 0.0), share)
+
+    def add_case(
+        self, odyssey_id: str, timings: Dict[str, float], profile_stats: Optional[Dict] = None
+    ) -> None:
+        """
+        Records the stages of one case, timed with `timed`. The "case" stage is its total, and its profile
+        is kept if it is among the `profile_slowest` slowest cases so far.
+        """
+        for stage, seconds in timings.items():
+            self.add(stage, seconds)
+        if not profile_stats or self.profile_slowest < 1:
+            return
+        entry = (timings.get("case", 0.0), next(self.sequence), odyssey_id, profile_stats)
+        with self.lock:
+            if len(self.slowest) < self.profile_slowest:
+                heapq.heappush(self.slowest, entry)
+            else:
+                heapq.heappushpop(self.slowest, entry)
+
+    def percentile(self, stage: str, percent: float) -> float:
+        """The seconds within which `percent` percent of the cases finished the stage, 0 if it never ran."""
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if not histogram:
+                return 0.0
+            rank = math.ceil(self.counts[stage] * percent / 100)
+            seen = 0
+            for bucket in sorted(histogram):
+                seen += histogram[bucket]
+                if seen >= rank:
+                    break
+            return min(BUCKET_GROWTH**bucket, self.maximums[stage])
+
+    def format_summary(self) -> List[str]:
+        """A table of the percentiles, maximum and total of every stage that ran, in milliseconds."""
+        stages = [stage for stage in STAGES if stage in self.histograms]
+        stages += sorted(set(self.histograms) - set(STAGES))
+        if not stages:
+            return ["Stage timings: no cases were timed"]
+        header = ["stage", *(f"p{percent}" for percent in PERCENTILES), "max", "total", "cases"]
+        lines = [f"Stage timings in ms over {self.counts.get('case', 0)} cases:"]
+        lines.append("".join(column.rjust(14) for column in header))
+        for stage in stages:
+            columns = [
+                *(self.percentile(stage, percent) * 1000 for percent in PERCENTILES),
+                self.maximums[stage] * 1000,
+                self.totals[stage] * 1000,
+            ]
+            lines.append(
+                stage.rjust(14)
+                + "".join(f"{column:14.2f}" for column in columns)
+                + str(self.counts[stage]).rjust(14)
+            )
+        return lines
+
+    def dump_profiles(self, directory: str) -> List[str]:
+        """
+        Writes the kept profiles, slowest first, as <rank>-<odyssey_id>.prof files that `pstats` or
+        snakeviz can read.
+
+        :returns: The paths written.
+        """
+        with self.lock:
+            slowest = sorted(self.slowest, reverse=True)
+        if not slowest:
+            return []
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for rank, (_, _, odyssey_id, stats) in enumerate(slowest, 1):
+            path = os.path.join(directory, f"{rank:03d}-{odyssey_id}.prof")
+            with open(path, "wb") as file_handle:
+                marshal.dump(stats, file_handle)
+            paths.append(path)
+        return paths
@@ -8,15 +8,59 @@ from time import time
 import requests
 from bs4 import BeautifulSoup
 from .helpers import *
+from .planner import record_crawl_stats
+from . import health
 import importlib
 from typing import Optional, Tuple, Callable, Type, List
 import importlib.util
 import re
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+# Returned by a case number lookup that failed, as opposed to None when the portal has no such case.
+LOOKUP_FAILED = object()
 
 class Scraper:
     """Scrape Odyssey html files into an output folder"""
-    def __init__(self):
-        pass
+    def __init__(
+        self,
+        case_queue: Optional[queue.Queue] = None,
+        hedge: bool = False,
+        slim: bool = False,
+        priority: Optional[Priority] = None
+    ):
+        """
+        :param case_queue: Optional bounded queue. When given, every scraped case page is also put on it
+            as an `(odyssey_id, case_html)` tuple so `Parser.parse_stream` can parse it while the crawl continues.
+            With a `CaseQueue`, the crawl stops with `ParserStoppedError` once the parser has stopped.
+        :param hedge: Send a hedged duplicate for case detail requests that are slower than the observed p95.
+        :param slim: Strip scripts, navigation and layout markup from case pages before writing them, see `slim_case_html`.
+        :param priority: Priority of this scraper's requests on the portal's shared rate limiter. By default a single
+            case number is `INTERACTIVE`, batches and refreshes are `REFRESH` and date-range crawls are `BACKFILL`.
+        """
+        self.case_queue = case_queue
+        self.hedge = hedge
+        self.slim = slim
+        self.priority = priority
+        self.request_priority = priority if priority is not None else Priority.BACKFILL
+        self.metrics = RequestMetrics()
+        self.timeout = DEFAULT_TIMEOUT
+        self.rate_limiter = None
+        self.single_flight = SingleFlight()
+        self.quit_on_failure = True
+        self.update_request_kwargs()
+
+    def update_request_kwargs(self) -> None:
+        """Rebuilds the keyword arguments passed to every `request_page_with_retry` call of this scraper."""
+        self.request_kwargs = {
+            "timeout": self.timeout,
+            "metrics": self.metrics,
+            "rate_limiter": self.rate_limiter,
+            "single_flight": self.single_flight,
+            "priority": self.request_priority,
+            "quit_on_failure": self.quit_on_failure,
+        }
+        self.detail_request_kwargs = dict(self.request_kwargs, hedge=self.hedge)
 
     def set_defaults(
         self, 
@@ -181,6 +225,29 @@ class Scraper:
             raise
         return base_url, odyssey_version, notes
 
+    def get_portal_timeouts(self, county: str, logger: logging.Logger) -> Tuple[float, float]:
+        """
+        Reads the connect and read timeouts for a county's portal from the CSV file.
+
+        Empty `connect_timeout` or `read_timeout` columns fall back to `DEFAULT_TIMEOUT`.
+
+        :param county: The name of the county.
+        :param logger: Logger instance for logging information.
+        :returns: A `(connect, read)` timeout tuple in seconds.
+        """
+        connect_timeout, read_timeout = DEFAULT_TIMEOUT
+        with open(
+            os.path.join(os.path.dirname(__file__), "..", "..", "resources", "texas_county_data.csv"),
+            mode="r",
+        ) as file_handle:
+            for row in csv.DictReader(file_handle):
+                if row["county"].lower() == county.lower():
+                    connect_timeout = float(row.get("connect_timeout") or connect_timeout)
+                    read_timeout = float(row.get("read_timeout") or read_timeout)
+                    break
+        logger.info(f"scraper: request timeouts are {connect_timeout}s connect, {read_timeout}s read")
+        return connect_timeout, read_timeout
+
     def get_class_and_method(
         self,
         county: str, 
@@ -272,6 +339,7 @@ class Scraper:
                     logger=logger,
                     http_method=HTTPMethod.GET,
                     ms_wait=ms_wait,
+                    **self.request_kwargs,
                     data=data,
                 )
 
@@ -282,6 +350,7 @@ class Scraper:
                 logger=logger,
                 http_method=HTTPMethod.GET,
                 ms_wait=ms_wait,
+                **self.request_kwargs,
             )
             main_soup = BeautifulSoup(main_page_html, "html.parser")
         except Exception as e:
@@ -353,6 +422,7 @@ class Scraper:
             http_method=HTTPMethod.GET,
             logger=logger,
             ms_wait=ms_wait,
+            **self.request_kwargs,
         )
         search_soup = BeautifulSoup(search_page_html, "html.parser")
 
@@ -423,6 +493,7 @@ class Scraper:
             logger=logger,
             data=create_single_case_search_form_data(hidden_values, case_number),
             ms_wait=ms_wait,
+            **self.request_kwargs,
         )
         return BeautifulSoup(results_page_html, "html.parser")
 
@@ -435,8 +506,16 @@ class Scraper:
         case_html_path: str,
         session: requests.sessions.Session,
         logger: logging.Logger,
-        ms_wait: int
-    ) -> None:
+        ms_wait: int,
+        max_age_hours: Optional[float] = None
+    ) -> Optional[str]:
+        """
+        Searches for a case number and scrapes the first matching case.
+
+        :param max_age_hours: When given, a case whose HTML was written less than this many hours ago
+            is considered current and its detail page is not requested again.
+        :returns: The odyssey ID of the case, or None if the search found no case.
+        """
 
         results_soup = self.get_search_results(session, search_url, logger, ms_wait, hidden_values, case_number)
         case_urls = [
@@ -448,6 +527,11 @@ class Scraper:
         
         if case_urls:
             case_id = case_urls[0].split("=")[1]
+            if is_case_current(case_html_path, case_id, max_age_hours):
+                logger.info(f"{case_id} - already current, skipping")
+                self.metrics.increment("cases_skipped")
+                return case_id
+
             logger.info(f"{case_id} - scraping case")
             
             case_html = request_page_with_retry(
@@ -456,16 +540,144 @@ class Scraper:
                 verification_text="Date Filed",
                 logger=logger,
                 ms_wait=ms_wait,
+                **self.detail_request_kwargs,
             )
             
-            logger.info(f"scraper: {len(case_html)} response string length")
-
-            with open(
-                os.path.join(case_html_path, f"{case_id}.html"), "w"
-            ) as file_handle:
-                file_handle.write(case_html)
+            write_case_html(case_html_path, case_id, case_html, logger, self.case_queue, self.metrics, self.slim)
+            return case_id
         else:
             logger.warning("No case URLs found.")
+            return None
+
+    def scrape_case_numbers(
+        self,
+        base_url: str,
+        search_url: str,
+        hidden_values: Dict[str, str],
+        case_numbers: List[str],
+        case_html_path: str,
+        session: requests.sessions.Session,
+        logger: logging.Logger,
+        ms_wait: int,
+        workers: int = 4,
+        max_age_hours: Optional[float] = 24
+    ) -> List[str]:
+        """
+        Looks up a batch of case numbers with one portal bootstrap.
+
+        Every search reuses the session and hidden values gathered once by `scrape`. Searches run on
+        `workers` threads, and the scraper's rate limiter keeps them within the portal's pacing budget.
+
+        Case numbers whose lookup failed, for instance because the portal kept erroring, are not counted as
+        not found: they are written to `case_numbers_failed.txt` so they can be retried.
+
+        :param case_numbers: The case numbers to look up.
+        :param workers: Number of case numbers looked up at the same time.
+        :param max_age_hours: Cases scraped less than this many hours ago are skipped. None refreshes every case.
+        :returns: The case numbers the portal had no case for.
+        """
+        mount_connection_pool(session, workers)
+
+        def look_up(case_number: str) -> object:
+            self.check_case_queue()
+            try:
+                return self.scrape_individual_case(
+                    base_url, search_url, hidden_values, case_number, case_html_path, session, logger, ms_wait,
+                    max_age_hours
+                )
+            except ParserStoppedError:
+                raise
+            except Exception:
+                logger.exception(f"Issue with looking up case number {case_number}. Moving to next one.")
+                return LOOKUP_FAILED
+
+        # a failed page raises PageRequestError instead of quitting, so one bad case doesn't end the batch
+        self.quit_on_failure = False
+        self.update_request_kwargs()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="case-lookup") as executor:
+                case_ids = list(executor.map(look_up, case_numbers))
+        finally:
+            self.quit_on_failure = True
+            self.update_request_kwargs()
+
+        not_found = [case_number for case_number, case_id in zip(case_numbers, case_ids) if case_id is None]
+        failed = [case_number for case_number, case_id in zip(case_numbers, case_ids) if case_id is LOOKUP_FAILED]
+        logger.info(
+            f"scraper: looked up {len(case_numbers)} case numbers, {len(not_found)} not found, {len(failed)} failed"
+        )
+        for file_name, case_numbers_written, description in (
+            ("case_numbers_not_found.txt", not_found, "not found"),
+            ("case_numbers_failed.txt", failed, "that failed"),
+        ):
+            if case_numbers_written:
+                path = os.path.join(case_html_path, "..", file_name)
+                with open(path, "w") as file_handle:
+                    file_handle.write("\n".join(case_numbers_written) + "\n")
+                logger.warning(f"scraper: case numbers {description} written to {os.path.abspath(path)}")
+        return not_found
+
+    def scrape_odyssey_ids(
+        self,
+        base_url: str,
+        odyssey_ids: List[str],
+        case_html_path: str,
+        session: requests.sessions.Session,
+        logger: logging.Logger,
+        ms_wait: int,
+        workers: int = 4,
+        max_age_hours: Optional[float] = 24
+    ) -> List[str]:
+        """
+        Refreshes known cases by requesting their detail pages directly, without searching for them.
+
+        Detail URLs are built from the odyssey IDs stored in `CaseMetadata.odyssey_id`, the same IDs
+        `scraper_hays` takes from the `CaseDetail` links of the search results. Each case costs one request.
+
+        :param odyssey_ids: Odyssey IDs of the cases to refresh.
+        :param workers: Number of detail pages requested at the same time.
+        :param max_age_hours: Cases scraped less than this many hours ago are skipped. None refreshes every case.
+        :returns: The odyssey IDs whose detail page could not be fetched.
+        """
+        mount_connection_pool(session, workers)
+
+        def refresh(case_id: str) -> bool:
+            self.check_case_queue()
+            if is_case_current(case_html_path, case_id, max_age_hours):
+                logger.info(f"{case_id} - already current, skipping")
+                self.metrics.increment("cases_skipped")
+                return True
+            try:
+                logger.info(f"{case_id} - refreshing case")
+                case_html = request_page_with_retry(
+                    session=session,
+                    url=f"{base_url}CaseDetail.aspx?CaseID={case_id}",
+                    verification_text="Date Filed",
+                    logger=logger,
+                    ms_wait=ms_wait,
+                    **self.detail_request_kwargs,
+                )
+                write_case_html(case_html_path, case_id, case_html, logger, self.case_queue, self.metrics, self.slim)
+                return True
+            except ParserStoppedError:
+                raise
+            except Exception:
+                logger.exception(f"Issue with refreshing case {case_id}. Moving to next one.")
+                return False
+
+        # a failed page raises PageRequestError instead of quitting, so one bad case doesn't end the refresh
+        self.quit_on_failure = False
+        self.update_request_kwargs()
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="case-refresh") as executor:
+                refreshed = list(executor.map(refresh, odyssey_ids))
+        finally:
+            self.quit_on_failure = True
+            self.update_request_kwargs()
+
+        failed = [case_id for case_id, ok in zip(odyssey_ids, refreshed) if not ok]
+        logger.info(f"scraper: refreshed {len(odyssey_ids) - len(failed)} of {len(odyssey_ids)} known cases")
+        return failed
 
     def scrape_jo_list(
         self,
@@ -547,12 +759,21 @@ class Scraper:
             logger=logger,
             data=create_search_form_data(date_string, jo_id, hidden_values, odyssey_version),
             ms_wait=ms_wait,
+            **self.request_kwargs,
         )
         
         results_soup = BeautifulSoup(results_page_html, "html.parser")
         
         return results_page_html, results_soup
 
+    def check_case_queue(self) -> None:
+        """
+        Raises `ParserStoppedError` once the parser reading `case_queue` has stopped, so no more pages are requested
+        for it.
+        """
+        if isinstance(self.case_queue, CaseQueue) and self.case_queue.stopped.is_set():
+            raise ParserStoppedError("The parser stopped reading scraped case pages")
+
     def scrape_multiple_cases(
         self,
         county: str,
@@ -581,14 +802,19 @@ class Scraper:
                     continue
                 
                 jo_id = judicial_officer_to_ID[JO_name]
+                self.check_case_queue()
                 logger.info(f"Searching cases on {date_string} for {JO_name}")
                 
                 results_page_html, results_soup = self.scrape_results_page(
                     odyssey_version, base_url, search_url, hidden_values, jo_id, date_string, session, logger, ms_wait
                 )
+                self.metrics.increment("jo_days")
                 
                 scraper_instance, scraper_function = self.get_class_and_method(county, logger)
-                scraper_function(base_url, results_soup, case_html_path, logger, session, ms_wait)
+                scraper_function(
+                    base_url, results_soup, case_html_path, logger, session, ms_wait,
+                    case_queue=self.case_queue, request_kwargs=self.detail_request_kwargs, slim=self.slim
+                )
 
     def scrape(
         self,
@@ -600,8 +826,23 @@ class Scraper:
         court_calendar_link_text: Optional[str],
         case_number: Optional[str],
         case_html_path: Optional[str],
-        ssl: Optional[bool] = True
-    ) -> None:
+        ssl: Optional[bool] = True,
+        case_numbers: Optional[List[str]] = None,
+        workers: int = 4,
+        max_age_hours: Optional[float] = 24,
+        odyssey_ids: Optional[List[str]] = None
+    ) -> Optional[List[str]]:
+        """
+        Bootstraps a session on the county's portal and scrapes either known cases by odyssey ID, one case
+        number, a batch of case numbers, or every case heard by the judicial officers in the date range.
+
+        :param case_numbers: Batch of case numbers looked up with a single bootstrap, see `scrape_case_numbers`.
+        :param workers: Number of concurrent requests in batch and refresh mode.
+        :param max_age_hours: In batch and refresh mode, skip cases scraped less than this many hours ago.
+        :param odyssey_ids: Known cases refreshed without any search, see `scrape_odyssey_ids`.
+        :returns: In batch mode, the case numbers that were not found. In refresh mode, the odyssey IDs that
+            could not be fetched. Otherwise None.
+        """
         ms_wait, start_date, end_date, court_calendar_link_text, case_number, ssl, county, case_html_path = self.set_defaults(
             ms_wait, start_date, end_date, court_calendar_link_text, case_number, ssl, county, case_html_path
         )
@@ -613,6 +854,18 @@ class Scraper:
         self.make_directories(case_html_path, logger)
         
         base_url, odyssey_version, notes = self.get_ody_link(county, logger)
+        self.timeout = self.get_portal_timeouts(county, logger)
+        # shared with every other scraper of this portal in the process, so priorities are weighed against each other
+        self.rate_limiter = RateLimiter.for_portal(base_url, ms_wait)
+        if self.priority is not None:
+            self.request_priority = self.priority
+        elif odyssey_ids is not None or case_numbers:
+            self.request_priority = Priority.REFRESH
+        elif case_number:
+            self.request_priority = Priority.INTERACTIVE
+        else:
+            self.request_priority = Priority.BACKFILL
+        self.update_request_kwargs()
         main_page_html, main_soup = self.scrape_main_page(base_url, odyssey_version, session, notes, logger, ms_wait)
         search_url, search_page_html, search_soup = self.scrape_search_page(
             base_url, odyssey_version, main_page_html, main_soup, session, logger, ms_wait, court_calendar_link_text
@@ -620,7 +873,17 @@ class Scraper:
         
         hidden_values = self.get_hidden_values(odyssey_version, main_soup, search_soup, logger)
         
-        if case_number:
+        not_found = None
+        if odyssey_ids is not None:
+            not_found = self.scrape_odyssey_ids(
+                base_url, odyssey_ids, case_html_path, session, logger, ms_wait, workers, max_age_hours
+            )
+        elif case_numbers:
+            not_found = self.scrape_case_numbers(
+                base_url, search_url, hidden_values, case_numbers, case_html_path, session, logger, ms_wait,
+                workers, max_age_hours
+            )
+        elif case_number:
             self.scrape_individual_case(
                 base_url, search_url, hidden_values, case_number, case_html_path, session, logger, ms_wait
             )
@@ -634,3 +897,7 @@ class Scraper:
                 case_html_path, logger, session, ms_wait, start_date, end_date
             )
             logger.info(f"\nTime to run script: {round(time() - scraper_start_time, 2)} seconds")
+            # keep per-county history for `main.py --plan`
+            record_crawl_stats(county, start_date, end_date, time() - scraper_start_time, ms_wait, self.metrics)
+        logger.info(f"scraper: request metrics: {self.metrics.summary()}")
+        return not_found
@@ -0,0 +1,188 @@
+import csv
+import json
+import os
+import threading
+from datetime import datetime
+from time import monotonic, time
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+# Columns of texas_county_data.csv that mark a portal the scraper cannot use, whatever its health.
+BLOCKING_COLUMNS = ("site_down", "captcha", "must_register", "search_disabled")
+
+# Timeout of a health probe; a portal that can't serve its main page this fast isn't worth scheduling.
+PROBE_TIMEOUT = (5, 15)
+
+# Kinds of attempt a circuit breaker counts consecutive failures of, each in its own `<source>_failures` field.
+# A portal can answer probes while every crawl of it fails, so a probe success must not clear crawl failures.
+FAILURE_SOURCES = ("probe", "crawl")
+
+
+def get_status_store_path() -> str:
+    """Returns the path of the portal status store shared by every county."""
+    return os.path.join(os.path.dirname(__file__), "..", "..", "data", "portal_status.json")
+
+
+def get_portal_blockers(county: str) -> List[str]:
+    """
+    Reads the reasons in texas_county_data.csv that a county's portal can't be scraped.
+
+    :returns: One "column: value" entry per non-empty blocking column, empty if the portal is usable.
+    """
+    with open(
+        os.path.join(os.path.dirname(__file__), "..", "..", "resources", "texas_county_data.csv"),
+        mode="r",
+    ) as file_handle:
+        for row in csv.DictReader(file_handle):
+            if row["county"].lower() == county.lower():
+                return [f"{column}: {row[column]}" for column in BLOCKING_COLUMNS if row.get(column)]
+    return []
+
+
+def probe_portal(
+    base_url: str,
+    session: Optional[requests.sessions.Session] = None,
+    timeout: Tuple[float, float] = PROBE_TIMEOUT,
+) -> Tuple[bool, float, Optional[str]]:
+    """
+    Requests a portal's main page once, without retries.
+
+    :param base_url: The portal's base URL.
+    :param session: Session to send the probe with. A plain `requests.get` when None.
+    :param timeout: `(connect, read)` timeout of the probe in seconds.
+    :returns: Whether the portal answered with a non-error status, the latency in seconds and the error, if any.
+    """
+    send = session.get if session is not None else requests.get
+    start = monotonic()
+    try:
+        response = send(base_url, timeout=timeout)
+    except requests.RequestException as e:
+        return False, monotonic() - start, f"{type(e).__name__}: {e}"
+    latency = monotonic() - start
+    if response.status_code >= 400:
+        return False, latency, f"HTTP {response.status_code}"
+    return True, latency, None
+
+
+class PortalStatusStore:
+    """
+    JSON file with the last known health of every portal, keyed by county.
+
+    Each entry holds the circuit breaker state (`closed` or `open`), the number of consecutive
+    probe and crawl failures and the larger of the two, when the breaker opened, and the outcome of
+    the last probe or crawl.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path or get_status_store_path()
+        self.lock = threading.Lock()
+
+    def load(self) -> Dict[str, Dict]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as file_handle:
+            return json.load(file_handle)
+
+    def get(self, county: str) -> Dict:
+        with self.lock:
+            return self.load().get(county, {"state": "closed", "consecutive_failures": 0})
+
+    def update(self, county: str, **fields) -> Dict:
+        with self.lock:
+            statuses = self.load()
+            status = statuses.setdefault(county, {"state": "closed", "consecutive_failures": 0})
+            status.update(fields, updated_at=datetime.now().isoformat(timespec="seconds"))
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # write to a temporary file first so a crash never leaves a half-written store
+            temporary_path = self.path + ".tmp"
+            with open(temporary_path, "w") as file_handle:
+                json.dump(statuses, file_handle, indent=4)
+            os.replace(temporary_path, self.path)
+            return status
+
+
+class CircuitBreaker:
+    """
+    Stops scheduling a county after repeated failures and lets one attempt through after a cooldown.
+
+    The breaker opens after `failure_threshold` consecutive failed probes, or as many consecutive failed
+    crawls. The two are counted apart: a successful probe only clears probe failures, so a portal that
+    answers its main page but fails every crawl still opens the breaker, while a successful crawl clears both.
+    While it is open `allow` returns False until `cooldown_seconds` have passed; the next attempt is then a
+    trial and re-opens the breaker for another cooldown on failure. It closes once no failures are left.
+    """
+
+    def __init__(
+        self,
+        county: str,
+        store: Optional[PortalStatusStore] = None,
+        failure_threshold: int = 3,
+        cooldown_seconds: float = 1800,
+    ) -> None:
+        self.county = county
+        self.store = store or PortalStatusStore()
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+
+    def allow(self) -> bool:
+        status = self.store.get(self.county)
+        if status["state"] != "open":
+            return True
+        return time() - status.get("opened_at", 0) >= self.cooldown_seconds
+
+    def record_success(self, latency: Optional[float] = None, source: str = "crawl") -> Dict:
+        """
+        :param latency: Seconds the portal took to answer, kept as `last_latency`.
+        :param source: "probe" clears only the probe failures, "crawl" clears every failure.
+        """
+        status = self.store.get(self.county)
+        cleared = FAILURE_SOURCES if source == "crawl" else (source,)
+        failures = {
+            f"{kind}_failures": 0 if kind in cleared else status.get(f"{kind}_failures", 0)
+            for kind in FAILURE_SOURCES
+        }
+        fields = dict(failures, consecutive_failures=max(failures.values()), last_latency=latency)
+        if not fields["consecutive_failures"]:
+            fields.update(state="closed", last_error=None)
+        return self.store.update(self.county, **fields)
+
+    def record_failure(self, error: str, source: str = "crawl") -> Dict:
+        """
+        :param error: Description of the failure, kept as `last_error`.
+        :param source: "probe" or "crawl", whose consecutive failures are counted.
+        """
+        status = self.store.get(self.county)
+        failures = {f"{kind}_failures": status.get(f"{kind}_failures", 0) for kind in FAILURE_SOURCES}
+        failures[f"{source}_failures"] += 1
+        fields = dict(failures, consecutive_failures=max(failures.values()), last_error=error)
+        if status["state"] == "open" or failures[f"{source}_failures"] >= self.failure_threshold:
+            fields.update(state="open", opened_at=time())
+        return self.store.update(self.county, **fields)
+
+
+def check_portal(county: str, base_url: str, breaker: CircuitBreaker, logger) -> bool:
+    """
+    Decides whether a county should be scheduled: its portal must not be marked as blocked in
+    texas_county_data.csv, its circuit breaker must allow an attempt, and it must answer a probe.
+
+    The probe result is written to the breaker's status store.
+    """
+    blockers = get_portal_blockers(county)
+    if blockers:
+        logger.warning(f"health: skipping {county}, portal is marked as {'; '.join(blockers)}")
+        return False
+    if not breaker.allow():
+        logger.warning(f"health: skipping {county}, circuit breaker is open after repeated failures")
+        return False
+    healthy, latency, error = probe_portal(base_url)
+    if not healthy:
+        status = breaker.record_failure(f"probe: {error}", source="probe")
+        logger.warning(
+            f"health: skipping {county}, probe failed ({error}), "
+            f"{status['consecutive_failures']} consecutive failures"
+        )
+        return False
+    breaker.record_success(round(latency, 3), source="probe")
+    logger.info(f"health: {county} portal answered in {latency:.2f}s")
+    return True
@@ -1,10 +1,72 @@
 import os, sys
+import json
+import queue
+import threading
 import requests
-from time import sleep
+from time import sleep, monotonic, time
 from datetime import date
 from logging import Logger
-from typing import Dict, Optional, Tuple, Literal
+from typing import Callable, Dict, Optional, Tuple, Literal
 from enum import Enum
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import xxhash
+from bs4 import BeautifulSoup, Comment, Doctype, ProcessingInstruction
+from .metrics import RequestMetrics
+from .rate_limiter import Priority, RateLimiter
+from .single_flight import SingleFlight
+
+# (connect, read) timeout in seconds used when a portal has none configured in texas_county_data.csv
+DEFAULT_TIMEOUT = (10, 60)
+
+# Attributes kept by `slim_case_html`; the rest (style, width, headers, xmlns:*, ...) only affect layout.
+SLIM_KEPT_ATTRIBUTES = {"id", "class", "href", "name", "colspan", "rowspan"}
+STRUCTURAL_TAGS = {"[document]", "html", "head", "body", "table", "thead", "tbody", "tfoot", "tr", "colgroup"}
+
+# Threads that run hedged requests; shared by every request in the process.
+HEDGE_EXECUTOR = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+
+# Seconds between the checks a `CaseQueue.put` blocked on a full queue makes for a stopped parser.
+CASE_QUEUE_POLL_INTERVAL = 0.5
+
+
+class PageRequestError(RuntimeError):
+    """Raised by `request_page_with_retry` with `quit_on_failure=False` when every attempt at a page failed."""
+
+
+class ParserStoppedError(RuntimeError):
+    """Raised when a scraped case page can't be handed on because the parser consuming it has stopped."""
+
+
+class CaseQueue(queue.Queue):
+    """
+    Bounded queue of scraped `(odyssey_id, case_html)` pages for `Parser.parse_stream`.
+
+    `put` blocks while the queue is full, like `queue.Queue`, but gives up with `ParserStoppedError`
+    once `stop` is called, so a crawl whose parser died fails instead of waiting forever for room.
+    """
+
+    def __init__(self, maxsize: int = 0) -> None:
+        super().__init__(maxsize)
+        self.stopped = threading.Event()
+
+    def stop(self) -> None:
+        """Called when the parser stops reading the queue, for whatever reason."""
+        self.stopped.set()
+
+    def put(self, item, block: bool = True, timeout: Optional[float] = None) -> None:
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            if self.stopped.is_set():
+                raise ParserStoppedError("The parser stopped reading scraped case pages")
+            wait_for = CASE_QUEUE_POLL_INTERVAL
+            if deadline is not None:
+                wait_for = min(wait_for, max(0.0, deadline - monotonic()))
+            try:
+                return super().put(item, block, wait_for)
+            except queue.Full:
+                if not block or (deadline is not None and monotonic() >= deadline):
+                    raise
 
 #This is called debug and quit.
 def write_debug_and_quit(
@@ -72,11 +134,174 @@ def create_single_case_search_form_data(hidden_values: Dict[str, str], case_numb
     return form_data
 
 
+def slim_case_html(case_html: str) -> str:
+    """
+    Strips the parts of a case page that no parser reads: scripts, styles, the navigation bar,
+    comments, whitespace-only text and presentational attributes.
+
+    Content tables, their cells and every non-blank text node are kept as they are, so the county
+    parsers extract the same rows from the slimmed page. The xxh3-128 hash of the page as received
+    is kept in a `raw-xxh3-128` meta tag for provenance.
+    """
+    raw_hash = xxhash.xxh3_128_hexdigest(case_html.encode("utf-8"))
+    soup = BeautifulSoup(case_html, "html.parser")
+
+    for tag in soup.find_all(["script", "style", "link", "meta"]):
+        tag.decompose()
+    for form in soup.find_all("form"):
+        # some portals wrap the whole case in a form; keep what's inside it
+        form.unwrap()
+    for node in soup.find_all(string=lambda text: isinstance(text, (Comment, Doctype, ProcessingInstruction))):
+        node.extract()
+    body = soup.body or soup
+    for table in body.find_all("table", recursive=False):
+        # the navigation bar and the empty spacer table above it
+        if table.select_one("a.ssBlackNavBarHyperlink") or not table.get_text(strip=True):
+            table.decompose()
+    for node in soup.find_all(string=lambda text: not text.strip(" \t\r\n")):
+        # whitespace between table parts is never rendered; elsewhere it still separates words
+        if node.parent.name in STRUCTURAL_TAGS:
+            node.extract()
+        elif node != " ":
+            node.replace_with(" ")
+    for tag in soup.find_all(True):
+        tag.attrs = {name: value for name, value in tag.attrs.items() if name in SLIM_KEPT_ATTRIBUTES}
+
+    head = soup.head
+    if head is None:
+        head = soup.new_tag("head")
+        (soup.html or soup).insert(0, head)
+    head.append(soup.new_tag("meta", attrs={"name": "raw-xxh3-128", "content": raw_hash}))
+    return str(soup)
+
+
+def write_case_html(
+    case_html_path: str,
+    case_id: str,
+    case_html: str,
+    logger: Logger,
+    case_queue: Optional[queue.Queue] = None,
+    metrics: Optional[RequestMetrics] = None,
+    slim: bool = False,
+) -> None:
+    """
+    Writes a scraped case page to disk and, when a queue is given, hands it to the parse workers.
+
+    `case_queue.put` blocks while the queue is full, so a slow parser applies backpressure to the scraper
+    instead of letting downloaded pages pile up in memory.
+
+    :param case_html_path: Folder the case HTML is written to.
+    :param case_id: Odyssey ID of the case, used as the file name.
+    :param case_html: The case page HTML.
+    :param logger: Logger instance for logging information.
+    :param case_queue: Optional bounded queue consumed by `Parser.parse_stream`.
+    :param metrics: Optional `RequestMetrics` that counts the cases and bytes written.
+    :param slim: Write the page through `slim_case_html`.
+    """
+    if slim:
+        case_html = slim_case_html(case_html)
+    logger.info(f"{len(case_html)} response string length")
+    with open(
+        os.path.join(case_html_path, f"{case_id}.html"), "w"
+    ) as file_handle:
+        file_handle.write(case_html)
+    if metrics is not None:
+        metrics.increment("cases")
+        metrics.increment("case_bytes", len(case_html))
+    if case_queue is not None:
+        case_queue.put((case_id, case_html))
+
+
 class HTTPMethod(Enum):
     POST: int = 1
     GET: int = 2
 
 
+def is_case_current(case_html_path: str, case_id: str, max_age_hours: Optional[float]) -> bool:
+    """Returns True if the case's HTML was written less than `max_age_hours` ago. None never counts as current."""
+    if max_age_hours is None:
+        return False
+    case_file_path = os.path.join(case_html_path, f"{case_id}.html")
+    return os.path.exists(case_file_path) and time() - os.path.getmtime(case_file_path) < max_age_hours * 3600
+
+
+def mount_connection_pool(session: requests.sessions.Session, workers: int) -> None:
+    """Gives the session one pooled connection per worker so concurrent requests don't queue for a socket."""
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(workers, 10))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+
+def send_request(
+    session: requests.Session,
+    url: str,
+    http_method: Literal[HTTPMethod.POST, HTTPMethod.GET],
+    params: Dict[str, str],
+    data: Optional[Dict[str, str]],
+    timeout: Optional[Tuple[float, float]],
+    metrics: Optional[RequestMetrics] = None,
+) -> requests.Response:
+    """Sends one request and records its latency and size."""
+    start_time = monotonic()
+    if http_method == HTTPMethod.POST:
+        if not data:
+            response = session.post(url, params=params, timeout=timeout)
+        else:
+            response = session.post(url, data=data, params=params, timeout=timeout)
+    elif http_method == HTTPMethod.GET:
+        if not data:
+            response = session.get(url, params=params, timeout=timeout)
+        else:
+            response = session.get(url, data=data, params=params, timeout=timeout)
+    if metrics is not None:
+        metrics.increment("requests")
+        metrics.increment("bytes", len(response.content))
+        metrics.record_latency(monotonic() - start_time)
+    return response
+
+
+def send_hedged_request(
+    send: Callable[[], requests.Response],
+    hedge_after: float,
+    metrics: RequestMetrics,
+    acquire: Optional[Callable[[], None]] = None,
+) -> requests.Response:
+    """
+    Sends a request and, if it has not answered after `hedge_after` seconds, sends a duplicate and
+    returns whichever response arrives first. The slower request is left to finish in the background.
+
+    :param acquire: Optional call that waits for a rate limiter slot. The first request waits for its slot
+        before `hedge_after` starts counting, so time spent queueing never triggers a hedge, and the hedge
+        waits for a slot of its own.
+    """
+
+    def send_paced() -> requests.Response:
+        if acquire is not None:
+            acquire()
+        return send()
+
+    if acquire is not None:
+        acquire()
+    first = HEDGE_EXECUTOR.submit(send)
+    try:
+        return first.result(timeout=hedge_after)
+    except FutureTimeoutError:
+        pass
+    metrics.increment("hedges_sent")
+    second = HEDGE_EXECUTOR.submit(send_paced)
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                if future is second:
+                    metrics.increment("hedges_won")
+                return future.result()
+            error = future.exception()
+    raise error
+
+
 def request_page_with_retry(
     session: requests.Session,
     url: str,
@@ -87,22 +312,72 @@ def request_page_with_retry(
     data: Optional[Dict[str, str]] = None,
     max_retries: int = 5,
     ms_wait: str = 200,
+    timeout: Optional[Tuple[float, float]] = DEFAULT_TIMEOUT,
+    hedge: bool = False,
+    metrics: Optional[RequestMetrics] = None,
+    rate_limiter: Optional[RateLimiter] = None,
+    single_flight: Optional[SingleFlight] = None,
+    priority: Priority = Priority.BACKFILL,
+    quit_on_failure: bool = True,
 ) -> Tuple[str, bool]:
+    """
+    Requests a page, retrying with a growing wait until the response contains `verification_text`.
+
+    Gives up and calls `write_debug_and_quit` once `max_retries` attempts have failed.
+
+    :param timeout: `(connect, read)` timeout in seconds so one stalled connection cannot hang a worker.
+    :param hedge: For idempotent requests (GET, or POST without a form body such as case detail pages),
+        send a duplicate request once the first has taken longer than the observed p95 latency.
+        Needs `metrics` to know the p95; until enough latencies are observed no hedge is sent.
+    :param metrics: Optional `RequestMetrics` that counts requests, retries, timeouts and hedges.
+    :param rate_limiter: Optional `RateLimiter` shared by concurrent workers. When given, it starts every
+        request (hedges included) at least `ms_wait` after the previous one, and `ms_wait` otherwise only
+        adds the backoff between retries.
+    :param single_flight: Optional `SingleFlight` shared by concurrent workers. Identical requests (same method,
+        URL, params and body) that are in flight at the same time are sent once and every caller gets the page.
+    :param priority: Class of the request when waiting for a slot of `rate_limiter`.
+    :param quit_on_failure: When False, raise `PageRequestError` instead of calling `write_debug_and_quit`,
+        so a batch can report the failed page and carry on with the others.
+    """
+    if single_flight is not None:
+        key = json.dumps([http_method.name, url, params, data, verification_text], sort_keys=True, default=str)
+        page, shared = single_flight.do(
+            key,
+            lambda: request_page_with_retry(
+                session, url, logger, verification_text, http_method, params, data, max_retries, ms_wait,
+                timeout, hedge, metrics, rate_limiter, priority=priority, quit_on_failure=quit_on_failure,
+            ),
+        )
+        if shared and metrics is not None:
+            metrics.increment("coalesced")
+        return page
+
     response = None
+    idempotent = http_method == HTTPMethod.GET or not data
+
+    def acquire() -> None:
+        if rate_limiter is not None:
+            rate_limiter.acquire(priority, ms_wait)
+
+    def send() -> requests.Response:
+        return send_request(session, url, http_method, params, data, timeout, metrics)
+
     for i in range(max_retries):
-        sleep(ms_wait / 1000 * (i + 1))
+        sleep(ms_wait / 1000 * (i if rate_limiter is not None else i + 1))
+        if i > 0 and metrics is not None:
+            metrics.increment("retries")
         failed = False
         try:
-            if http_method == HTTPMethod.POST:
-                if not data:
-                    response = session.post(url, params=params)
-                else:
-                    response = session.post(url, data=data, params=params)
-            elif http_method == HTTPMethod.GET:
-                if not data:
-                    response = session.get(url, params=params)
-                else:
-                    response = session.get(url, data=data, params=params)
+            hedge_after = (
+                metrics.latency_percentile(95)
+                if hedge and idempotent and metrics is not None
+                else None
+            )
+            if hedge_after is not None:
+                response = send_hedged_request(send, hedge_after, metrics, acquire)
+            else:
+                acquire()
+                response = send()
             response.raise_for_status()
             if verification_text:
                 if verification_text not in response.text:
@@ -110,17 +385,26 @@ def request_page_with_retry(
                     logger.error(
                         f"Verification text {verification_text} not in response"
                     )
+        except requests.Timeout:
+            logger.exception(f"Timed out getting url {url}, try {i}")
+            if metrics is not None:
+                metrics.increment("timeouts")
+            failed = True
         except requests.RequestException as e:
             logger.exception(f"Failed to get url {url}, try {i}")
             failed = True
-        if failed:
-            if response == None:
-                response_text = 'No response from Odyssey.'
-            else:
-                response_text = response.text
-            write_debug_and_quit(
-                verification_text=verification_text,
-                page_text=response_text,
-                logger=logger,
-            )
-    return response.text
+        if not failed:
+            return response.text
+    if metrics is not None:
+        metrics.increment("failures")
+    if response == None:
+        response_text = 'No response from Odyssey.'
+    else:
+        response_text = response.text
+    if not quit_on_failure:
+        raise PageRequestError(f"Failed to get url {url} after {max_retries} tries")
+    write_debug_and_quit(
+        verification_text=verification_text,
+        page_text=response_text,
+        logger=logger,
+    )
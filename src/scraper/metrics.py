@@ -0,0 +1,62 @@
+import threading
+from collections import Counter, deque
+from statistics import mean
+from typing import Dict, Optional
+
+
+class RequestMetrics:
+    """
+    Thread-safe request counters and a rolling window of response latencies for one crawl.
+
+    Counters used by `request_page_with_retry`:
+    - `requests`: HTTP requests sent, including hedges.
+    - `retries`: attempts after the first one for the same page.
+    - `timeouts`: requests that hit the connect or read timeout.
+    - `failures`: pages that could not be fetched after every retry.
+    - `hedges_sent` / `hedges_won`: hedged duplicates sent, and how often the duplicate answered first.
+    - `bytes`: response bytes received.
+    - `coalesced`: calls that got the page of an identical request already in flight instead of sending their own.
+    """
+
+    def __init__(self, latency_window: int = 1000, min_samples: int = 20) -> None:
+        """
+        :param latency_window: Number of most recent latencies kept for percentiles.
+        :param min_samples: Percentiles are not reported until this many latencies were observed.
+        """
+        self.lock = threading.Lock()
+        self.counters = Counter()
+        self.latencies = deque(maxlen=latency_window)
+        self.min_samples = min_samples
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        with self.lock:
+            self.counters[name] += amount
+
+    def record_latency(self, seconds: float) -> None:
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        """
+        Returns the given percentile of the recent latencies in seconds, or None if too few were observed.
+
+        :param percentile: Percentile between 0 and 100.
+        """
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+        return latencies[index]
+
+    def summary(self) -> Dict[str, float]:
+        """Returns the counters plus mean, p50 and p95 latency for logging."""
+        with self.lock:
+            summary = dict(self.counters)
+            latencies = list(self.latencies)
+        if latencies:
+            latencies.sort()
+            summary["latency_mean"] = round(mean(latencies), 3)
+            summary["latency_p50"] = round(latencies[len(latencies) // 2], 3)
+            summary["latency_p95"] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3)
+        return summary
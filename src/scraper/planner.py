@@ -0,0 +1,178 @@
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from .metrics import RequestMetrics
+
+# Requests made before any search: main page, search page and an optional login.
+BOOTSTRAP_REQUESTS = 3
+
+# Estimated columns of a crawl plan, left empty for counties without crawl history.
+ESTIMATE_COLUMNS = ("jo_days", "cases", "requests", "bytes", "duration_seconds", "disk_bytes")
+
+
+def get_crawl_history_path(county: str) -> str:
+    """Returns the path of the county's crawl history, one JSON record per completed crawl."""
+    return os.path.join(
+        os.path.dirname(__file__), "..", "..", "data", county, "crawl_history.jsonl"
+    )
+
+
+def record_crawl_stats(
+    county: str,
+    start_date: str,
+    end_date: str,
+    duration: float,
+    ms_wait: int,
+    metrics: RequestMetrics,
+) -> Dict:
+    """
+    Appends the statistics of a finished date-range crawl to the county's crawl history.
+
+    :param county: The county that was crawled.
+    :param start_date: First date crawled, YYYY-MM-DD.
+    :param end_date: Last date crawled, YYYY-MM-DD.
+    :param duration: Wall time of the crawl in seconds.
+    :param ms_wait: Milliseconds waited between requests.
+    :param metrics: The `RequestMetrics` of the crawl.
+    :returns: The record that was written.
+    """
+    days = (
+        datetime.strptime(end_date, "%Y-%m-%d") - datetime.strptime(start_date, "%Y-%m-%d")
+    ).days + 1
+    record = {
+        "crawled_at": datetime.now().isoformat(timespec="seconds"),
+        "start_date": start_date,
+        "end_date": end_date,
+        "days": days,
+        "duration_seconds": round(duration, 2),
+        "ms_wait": ms_wait,
+    }
+    record.update(metrics.summary())
+    history_path = get_crawl_history_path(county)
+    os.makedirs(os.path.dirname(history_path), exist_ok=True)
+    with open(history_path, "a") as file_handle:
+        file_handle.write(json.dumps(record) + "\n")
+    return record
+
+
+def load_crawl_history(county: str) -> List[Dict]:
+    """Reads every crawl record of a county, or an empty list if it was never crawled."""
+    history_path = get_crawl_history_path(county)
+    if not os.path.exists(history_path):
+        return []
+    with open(history_path, "r") as file_handle:
+        return [json.loads(line) for line in file_handle if line.strip()]
+
+
+def summarize_crawl_history(history: List[Dict]) -> Optional[Dict[str, float]]:
+    """
+    Combines crawl records into per-county rates, weighting every crawl by its size.
+
+    :returns: Rates per judicial officer day and per request, or None if no crawl searched anything.
+        `bytes_per_case` is None if no crawl stored a case.
+    """
+    totals = {
+        key: sum(record.get(key, 0) for record in history)
+        for key in ("days", "jo_days", "cases", "requests", "retries", "bytes", "case_bytes")
+    }
+    if not totals["jo_days"] or not totals["requests"]:
+        return None
+    latency_weighted = sum(
+        record.get("latency_mean", 0) * record.get("requests", 0) for record in history
+    )
+    return {
+        "jos_per_day": totals["jo_days"] / max(totals["days"], 1),
+        "cases_per_jo_day": totals["cases"] / totals["jo_days"],
+        "latency_mean": latency_weighted / totals["requests"],
+        "retry_rate": totals["retries"] / totals["requests"],
+        "bytes_per_request": totals["bytes"] / totals["requests"],
+        "bytes_per_case": totals["case_bytes"] / totals["cases"] if totals["cases"] else None,
+    }
+
+
+def estimate_crawl(
+    county: str,
+    start_date: str,
+    end_date: str,
+    ms_wait: int = 200,
+    judicial_officers: Optional[List[str]] = None,
+    history: Optional[List[Dict]] = None,
+    workers: int = 1,
+) -> Dict:
+    """
+    Estimates the cost of crawling a county for a date range from its crawl history, without contacting
+    its portal. Counties that were never crawled get no estimate and are reported as having no history.
+
+    The bootstrap and the searches are sent one after another. Case pages are fetched by `workers`
+    concurrent requests whose latencies overlap, but which still share the portal's pacing budget of one
+    request every `ms_wait`. A date-range crawl fetches its case pages one after another too, so plan it
+    with one worker; only case number lookups and refreshes use more.
+
+    :param county: The county to plan.
+    :param start_date: First date to crawl, YYYY-MM-DD.
+    :param end_date: Last date to crawl, YYYY-MM-DD.
+    :param ms_wait: Milliseconds waited between requests.
+    :param judicial_officers: Judicial officers that will be searched. All of them when None.
+    :param history: Crawl records to use instead of the county's crawl history file.
+    :param workers: Number of case pages requested at the same time, 1 for a date-range crawl.
+    :returns: A dictionary with the estimated requests, bytes, duration and disk footprint, each None
+        when the county has no usable crawl history.
+    """
+    if history is None:
+        history = load_crawl_history(county)
+    stats = summarize_crawl_history(history)
+    days = (
+        datetime.strptime(end_date, "%Y-%m-%d") - datetime.strptime(start_date, "%Y-%m-%d")
+    ).days + 1
+    plan = {"county": county, "based_on": "no history", "days": days, "workers": workers}
+    plan.update(dict.fromkeys(ESTIMATE_COLUMNS))
+    if stats is None:
+        return plan
+
+    jos_per_day = len(judicial_officers) if judicial_officers else stats["jos_per_day"]
+    jo_days = days * jos_per_day
+    cases = jo_days * stats["cases_per_jo_day"]
+    retry_factor = 1 + stats["retry_rate"]
+    search_requests = (BOOTSTRAP_REQUESTS + jo_days) * retry_factor
+    case_requests = cases * retry_factor
+    request_seconds = stats["latency_mean"] + ms_wait / 1000
+    # concurrent workers overlap their latencies, but the rate limiter still starts one request per ms_wait
+    case_request_seconds = max(request_seconds / max(workers, 1), ms_wait / 1000)
+    requests = search_requests + case_requests
+    plan.update(
+        based_on=f"{len(history)} previous crawls",
+        jo_days=round(jo_days),
+        cases=round(cases),
+        requests=round(requests),
+        bytes=round(requests * stats["bytes_per_request"]),
+        duration_seconds=round(search_requests * request_seconds + case_requests * case_request_seconds),
+        disk_bytes=(
+            round(cases * stats["bytes_per_case"]) if stats["bytes_per_case"] is not None else None
+        ),
+    )
+    return plan
+
+
+def format_crawl_plan(plans: List[Dict]) -> str:
+    """Formats crawl estimates as a table with a total row. Columns that could not be estimated are shown as "-"."""
+    columns = ("county", "days", "workers", "cases", "requests", "bytes", "duration_seconds", "disk_bytes")
+
+    def format_value(value) -> str:
+        return "-" if value is None else str(value)
+
+    rows = [[format_value(plan[column]) for column in columns] for plan in plans]
+    if len(plans) > 1:
+        rows.append(
+            ["total", "", ""]
+            + [
+                str(sum(plan[column] for plan in plans if plan[column] is not None))
+                for column in columns[3:]
+            ]
+        )
+    widths = [max(len(column), *(len(row[i]) for row in rows)) for i, column in enumerate(columns)]
+    lines = ["  ".join(column.ljust(width) for column, width in zip(columns, widths))]
+    lines += ["  ".join(value.ljust(width) for value, width in zip(row, widths)) for row in rows]
+    lines += [f"{plan['county']}: based on {plan['based_on']}" for plan in plans]
+    return "\n".join(lines)
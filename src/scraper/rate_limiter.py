@@ -0,0 +1,166 @@
+import heapq
+import itertools
+import json
+import os
+import tempfile
+import threading
+from enum import IntEnum
+from time import monotonic, time
+from typing import Dict, Optional
+
+import xxhash
+
+try:
+    import fcntl
+except ImportError:  # Windows: portals are only shared between the threads of one process
+    fcntl = None
+
+# Folder of the schedules that processes crawling the same portal share, one file per portal.
+SHARED_SCHEDULE_DIR = os.path.join(tempfile.gettempdir(), "odyssey-rate-limits")
+
+# Seconds a process waiting for a slot keeps its claim in a shared schedule without renewing it. Claims of
+# higher priority requests hold back lower priority ones in every process, so a crashed process's claims expire.
+CLAIM_TTL = 2.0
+
+# Longest wait in seconds between two looks at a shared schedule while another process holds the next slot.
+SHARED_POLL_INTERVAL = 0.05
+
+
+class Priority(IntEnum):
+    """Request classes sharing a portal's pacing budget; lower values are served first."""
+
+    INTERACTIVE = 0
+    REFRESH = 1
+    BACKFILL = 2
+
+
+class SharedSchedule:
+    """
+    The next free request slot of a portal, kept in a file locked with `fcntl.flock` so every process
+    crawling the portal on this machine paces its requests against the others.
+
+    The file also holds a claim per priority with a process waiting at that priority, so a backfill in one
+    process leaves the next slot to an interactive lookup waiting in another.
+    """
+
+    def __init__(self, path: str) -> None:
+        """:param path: The schedule file, created when missing."""
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    @classmethod
+    def for_portal(cls, base_url: str) -> Optional["SharedSchedule"]:
+        """Returns the shared schedule of a portal, or None where files can't be locked."""
+        if fcntl is None:
+            return None
+        return cls(os.path.join(SHARED_SCHEDULE_DIR, f"{xxhash.xxh64_hexdigest(base_url)}.json"))
+
+    def try_acquire(self, priority: Priority, interval: float) -> float:
+        """
+        Takes the next slot if it is due and no process waits for it with a higher priority.
+
+        :param priority: Class of the request.
+        :param interval: Seconds until the slot after this one.
+        :returns: 0 when the slot was taken, otherwise the seconds to wait before trying again.
+        """
+        with open(self.path, "a+") as file_handle:
+            fcntl.flock(file_handle, fcntl.LOCK_EX)
+            try:
+                file_handle.seek(0)
+                content = file_handle.read()
+                state = json.loads(content) if content else {}
+                now = time()
+                next_slot = state.get("next_slot", 0.0)
+                claims = {
+                    int(claim): expires_at
+                    for claim, expires_at in state.get("claims", {}).items()
+                    if expires_at > now
+                }
+                if now >= next_slot and not any(claim < priority for claim in claims):
+                    claims.pop(int(priority), None)
+                    state = {"next_slot": max(now, next_slot) + interval, "claims": claims}
+                    wait = 0.0
+                else:
+                    claims[int(priority)] = now + CLAIM_TTL
+                    state = {"next_slot": next_slot, "claims": claims}
+                    wait = min(max(next_slot - now, 0.0), SHARED_POLL_INTERVAL) or SHARED_POLL_INTERVAL
+                file_handle.seek(0)
+                file_handle.truncate()
+                file_handle.write(json.dumps(state))
+                file_handle.flush()
+            finally:
+                fcntl.flock(file_handle, fcntl.LOCK_UN)
+        return wait
+
+
+class RateLimiter:
+    """
+    Spaces out the start of requests to a portal so concurrent workers share one pacing budget.
+
+    Every call to `acquire` waits for the next free slot, at least the caller's `ms_wait` milliseconds after
+    the previous one. When several callers are waiting, the slot goes to the one with the highest
+    priority (strict priority), and to the longest waiting one within a priority. An interactive
+    lookup therefore waits for at most one slot even while a backfill keeps the portal saturated.
+
+    Use `for_portal` so every scraper that talks to the same portal shares one limiter, and with a
+    `SharedSchedule` one pacing budget with the scrapers of other processes.
+    """
+
+    _portals: Dict[str, "RateLimiter"] = {}
+    _portals_lock = threading.Lock()
+
+    def __init__(self, ms_wait: int, shared_schedule: Optional[SharedSchedule] = None) -> None:
+        """
+        :param ms_wait: Minimum milliseconds between the start of two requests of callers that don't give their own.
+        :param shared_schedule: Optional schedule shared with other processes, which every slot must also be taken from.
+        """
+        self.interval = ms_wait / 1000
+        self.shared_schedule = shared_schedule
+        self.condition = threading.Condition()
+        self.next_slot = 0.0
+        self.waiting = []
+        self.tickets = itertools.count()
+
+    @classmethod
+    def for_portal(cls, base_url: str, ms_wait: int) -> "RateLimiter":
+        """
+        Returns the process-wide limiter of a portal, which also paces requests against other processes
+        crawling it. Each caller's requests are spaced by the `ms_wait` it passes to `acquire`.
+        """
+        with cls._portals_lock:
+            rate_limiter = cls._portals.get(base_url)
+            if rate_limiter is None:
+                rate_limiter = cls._portals[base_url] = cls(ms_wait, SharedSchedule.for_portal(base_url))
+            return rate_limiter
+
+    def acquire(self, priority: Priority = Priority.BACKFILL, ms_wait: Optional[int] = None) -> None:
+        """
+        Waits for a slot to start a request.
+
+        :param priority: Class of the request.
+        :param ms_wait: Milliseconds until the slot after this one. The limiter's own wait when None.
+        """
+        interval = self.interval if ms_wait is None else ms_wait / 1000
+        with self.condition:
+            ticket = (priority, next(self.tickets))
+            heapq.heappush(self.waiting, ticket)
+            # a new caller may outrank the one currently waiting for the next slot
+            self.condition.notify_all()
+            while True:
+                now = monotonic()
+                if self.waiting[0] == ticket:
+                    if now < self.next_slot:
+                        self.condition.wait(self.next_slot - now)
+                        continue
+                    if self.shared_schedule is None:
+                        break
+                    # stay first in line while another process holds the portal's next slot
+                    wait = self.shared_schedule.try_acquire(priority, interval)
+                    if not wait:
+                        break
+                    self.condition.wait(wait)
+                else:
+                    self.condition.wait()
+            heapq.heappop(self.waiting)
+            self.next_slot = max(now, self.next_slot) + interval
+            self.condition.notify_all()
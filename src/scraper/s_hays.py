@@ -1,12 +1,12 @@
 import logging
-from helpers import *
+from scraper.helpers import *
 
 class ScraperHays():
 
     def __init__(self):
         pass
 
-    def scraper_hays(self, base_url, results_soup, case_html_path, logger, session, ms_wait):
+    def scraper_hays(self, base_url, results_soup, case_html_path, logger, session, ms_wait, case_queue=None, request_kwargs=None, slim=False):
         case_urls = [
             base_url + anchor["href"]
             for anchor in results_soup.select('a[href^="CaseDetail"]')
@@ -23,13 +23,12 @@ class ScraperHays():
                     verification_text="Date Filed",
                     logger=logger,
                     ms_wait=ms_wait,
+                    **(request_kwargs or {}),
                 )
             except:
                 logger.info(f"Issue with scraping this case: {case_id}. Moving to next one.")
-            # write html case data
-            logger.info(f"{len(case_html)} response string length")
-
-            with open(
-                os.path.join(case_html_path, f"{case_id}.html"), "w"
-            ) as file_handle:
-                file_handle.write(case_html)
+                continue
+            # write html case data and pass it on to the parser when pipelined
+            write_case_html(
+                case_html_path, case_id, case_html, logger, case_queue, (request_kwargs or {}).get("metrics"), slim
+            )
@@ -0,0 +1,33 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+
+def use_temporary_data_dir() -> str:
+    """
+    Keeps the compiled charge index and the county seen-sets, which live under data/ by default, in a
+    temporary directory for the rest of the calling test module. Call it from `setUpModule`.
+
+    :returns: The temporary directory, removed once the module's tests are done.
+    """
+    from parser.seen_set import SeenSet, get_file_name
+
+    data_dir = tempfile.mkdtemp()
+
+    def get_compiled_path(source_path):
+        name = os.path.splitext(os.path.basename(source_path))[0]
+        return os.path.join(data_dir, "charge_index", f"{name}.idx")
+
+    def for_county(cls, county, kind, database="", **kwargs):
+        return cls(os.path.join(data_dir, county, get_file_name(kind, database)), **kwargs)
+
+    for patcher in [
+        patch("parser.charge_index.get_compiled_path", get_compiled_path),
+        patch.object(SeenSet, "for_county", classmethod(for_county)),
+    ]:
+        patcher.start()
+        unittest.addModuleCleanup(patcher.stop)
+    unittest.addModuleCleanup(shutil.rmtree, data_dir, ignore_errors=True)
+    return data_dir
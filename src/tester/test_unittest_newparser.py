@@ -5,6 +5,11 @@ from sqlmodel import Session, create_engine, SQLModel
 from datetime import date
 import unittest
 import parser.p_hays
+from tester import use_temporary_data_dir
+
+
+def setUpModule():
+    use_temporary_data_dir()
 
 
 class TestModels(unittest.TestCase):
@@ -4,8 +4,14 @@ import sys
 import os
 import json
 import logging
+import re
 from unittest.mock import patch, MagicMock, mock_open
 import tempfile
+import queue
+import threading
+import time
+import requests
+import xxhash
 from bs4 import BeautifulSoup
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
@@ -589,6 +595,457 @@ class ScraperTestCase(unittest.TestCase):
         )  # Note: This is already validated by "verification_text" within the request_page_with_retry function.
         # TODO: Add more validation here of what one should expect from the results page HTML.
 
+    def test_write_case_html_puts_page_on_queue(self):
+        case_html_path = tempfile.mkdtemp()
+        case_queue = queue.Queue(maxsize=1)
+        logger = logging.getLogger(__name__)
+
+        scraper.write_case_html(case_html_path, "12947592", "<html>case</html>", logger, case_queue)
+
+        with open(os.path.join(case_html_path, "12947592.html"), "r") as file_handle:
+            self.assertEqual(file_handle.read(), "<html>case</html>")
+        self.assertEqual(case_queue.get_nowait(), ("12947592", "<html>case</html>"))
+
+    def test_slim_case_html_keeps_parser_output(self):
+        case_html_file = os.path.join(
+            os.path.dirname(__file__), "..", "..", "resources", "test_files", "test_123456.html"
+        )
+        with open(case_html_file, "r", encoding="utf-8", errors="ignore") as file_handle:
+            case_html = file_handle.read()
+        logger = logging.getLogger(__name__)
+        parser_instance, _ = parser.Parser().get_class_and_method(county="hays", logger=logger, test=True)
+
+        def extract(html):
+            case_soup = BeautifulSoup(html, "html.parser")
+            sections = [parser_instance.get_case_metadata("hays", "123456", case_soup, logger)]
+            for table in case_soup.select("body>table"):
+                if "Case Type:" in table.text and "Date Filed:" in table.text:
+                    sections.append(parser_instance.get_case_details(table, logger))
+                elif "Party Information" in table.text:
+                    sections.append(parser_instance.extract_rows(table, logger))
+                elif "Charge Information" in table.text:
+                    sections.append(parser_instance.get_charge_information(table, logger))
+                elif "Events & Orders of the Court" in table.text:
+                    sections.append(
+                        parser_instance.format_events_and_orders_of_the_court(table, case_soup, logger)
+                    )
+            return sections
+
+        slimmed_html = scraper.slim_case_html(case_html)
+
+        self.assertLess(len(slimmed_html), len(case_html) * 0.6)
+        self.assertNotIn("<script", slimmed_html)
+        self.assertNotIn("ssBlackNavBarHyperlink", slimmed_html)
+        self.assertIn(xxhash.xxh3_128_hexdigest(case_html.encode("utf-8")), slimmed_html)
+        self.assertEqual(len(extract(slimmed_html)), 5)
+        self.assertEqual(extract(slimmed_html), extract(case_html))
+
+        # a form around the case content is unwrapped, not dropped with its content
+        form_html = re.sub(r"(<body[^>]*>)", r'\1<form name="Form1" method="post">', case_html, count=1)
+        form_html = form_html.replace("</body>", "</form></body>", 1)
+        slimmed_form_html = scraper.slim_case_html(form_html)
+        self.assertNotIn("<form", slimmed_form_html)
+        self.assertEqual(extract(slimmed_form_html), extract(case_html))
+
+    def test_request_page_with_retry_returns_on_first_success(self):
+        session = MagicMock()
+        session.post.return_value = MagicMock(text="Date Filed", content=b"Date Filed")
+        metrics = scraper.RequestMetrics()
+
+        page = scraper.request_page_with_retry(
+            session=session,
+            url="http://example.com/CaseDetail.aspx?CaseID=1",
+            verification_text="Date Filed",
+            logger=logging.getLogger(__name__),
+            ms_wait=0,
+            timeout=(1, 2),
+            metrics=metrics,
+        )
+
+        self.assertEqual(page, "Date Filed")
+        session.post.assert_called_once_with(
+            "http://example.com/CaseDetail.aspx?CaseID=1", params={}, timeout=(1, 2)
+        )
+        self.assertEqual(metrics.counters["requests"], 1)
+
+    def test_request_page_with_retry_counts_timeouts(self):
+        session = MagicMock()
+        session.get.side_effect = [
+            requests.Timeout("stalled"),
+            MagicMock(text="ok", content=b"ok"),
+        ]
+        metrics = scraper.RequestMetrics()
+
+        page = scraper.request_page_with_retry(
+            session=session,
+            url="http://example.com/",
+            logger=logging.getLogger(__name__),
+            http_method=scraper.HTTPMethod.GET,
+            ms_wait=0,
+            metrics=metrics,
+        )
+
+        self.assertEqual(page, "ok")
+        self.assertEqual(metrics.counters["timeouts"], 1)
+        self.assertEqual(metrics.counters["retries"], 1)
+
+    def test_request_page_with_retry_hedges_slow_requests(self):
+        calls = []
+
+        def slow_then_fast(url, params, timeout):
+            calls.append(url)
+            if len(calls) == 1:
+                time.sleep(0.5)
+                return MagicMock(text="slow", content=b"slow")
+            return MagicMock(text="fast", content=b"fast")
+
+        session = MagicMock()
+        session.get.side_effect = slow_then_fast
+        metrics = scraper.RequestMetrics(min_samples=1)
+        metrics.record_latency(0.01)
+
+        page = scraper.request_page_with_retry(
+            session=session,
+            url="http://example.com/CaseDetail.aspx?CaseID=1",
+            logger=logging.getLogger(__name__),
+            http_method=scraper.HTTPMethod.GET,
+            ms_wait=0,
+            hedge=True,
+            metrics=metrics,
+        )
+
+        self.assertEqual(page, "fast")
+        self.assertEqual(metrics.counters["hedges_sent"], 1)
+        self.assertEqual(metrics.counters["hedges_won"], 1)
+
+    def test_hedge_timer_starts_after_rate_limiter_slot(self):
+        metrics = scraper.RequestMetrics(min_samples=1)
+        slots = []
+
+        def acquire():
+            # waiting for the slot takes longer than the hedge delay, but the request itself is fast
+            slots.append(time.monotonic())
+            time.sleep(0.3)
+
+        response = scraper.send_hedged_request(
+            lambda: MagicMock(text="ok"), hedge_after=0.1, metrics=metrics, acquire=acquire
+        )
+
+        self.assertEqual(response.text, "ok")
+        self.assertEqual(len(slots), 1)
+        self.assertEqual(metrics.counters["hedges_sent"], 0)
+
+    def test_scrape_case_numbers_looks_up_batch(self):
+        case_html_path = os.path.join(tempfile.mkdtemp(), "case_html")
+        os.makedirs(case_html_path)
+        scraper_instance = scraper.Scraper()
+        found = {"24-1234CR": "111", "24-5678CR": "222"}
+
+        def search(session, search_url, logger, ms_wait, hidden_values, case_number):
+            if case_number == "24-9999CR":
+                self.assertFalse(scraper_instance.request_kwargs["quit_on_failure"])
+                raise scraper.PageRequestError("portal kept erroring")
+            links = f'<a href="CaseDetail.aspx?CaseID={found[case_number]}">x</a>' if case_number in found else ""
+            return BeautifulSoup(f"<html>Record Count{links}</html>", "html.parser")
+
+        with patch.object(scraper_instance, "get_search_results", side_effect=search), patch(
+            "scraper.request_page_with_retry", side_effect=lambda url, **kwargs: f"<html>{url}</html>"
+        ):
+            not_found = scraper_instance.scrape_case_numbers(
+                "http://example.com/", "http://example.com/Search.aspx", {},
+                ["24-1234CR", "24-0000CR", "24-9999CR", "24-5678CR"],
+                case_html_path, requests.Session(), logging.getLogger(__name__), ms_wait=0, workers=2,
+            )
+
+        # a failed lookup is reported apart from the case numbers the portal doesn't have
+        self.assertEqual(not_found, ["24-0000CR"])
+        self.assertEqual(sorted(os.listdir(case_html_path)), ["111.html", "222.html"])
+        with open(os.path.join(case_html_path, "..", "case_numbers_not_found.txt"), "r") as file_handle:
+            self.assertEqual(file_handle.read(), "24-0000CR\n")
+        with open(os.path.join(case_html_path, "..", "case_numbers_failed.txt"), "r") as file_handle:
+            self.assertEqual(file_handle.read(), "24-9999CR\n")
+        self.assertTrue(scraper_instance.request_kwargs["quit_on_failure"])
+
+    def test_request_page_with_retry_raises_instead_of_quitting(self):
+        session = MagicMock()
+        session.get.return_value = MagicMock(text="Error page", content=b"Error page")
+
+        with self.assertRaises(scraper.PageRequestError):
+            scraper.request_page_with_retry(
+                session=session,
+                url="http://example.com/CaseDetail.aspx?CaseID=1",
+                logger=logging.getLogger(__name__),
+                verification_text="Date Filed",
+                http_method=scraper.HTTPMethod.GET,
+                max_retries=2,
+                ms_wait=0,
+                quit_on_failure=False,
+            )
+
+    def test_scrape_individual_case_skips_current_case(self):
+        case_html_path = tempfile.mkdtemp()
+        with open(os.path.join(case_html_path, "111.html"), "w") as file_handle:
+            file_handle.write("<html>case</html>")
+        scraper_instance = scraper.Scraper()
+        results_soup = BeautifulSoup('<a href="CaseDetail.aspx?CaseID=111">x</a>', "html.parser")
+
+        with patch.object(scraper_instance, "get_search_results", return_value=results_soup), patch(
+            "scraper.request_page_with_retry"
+        ) as request_page:
+            case_id = scraper_instance.scrape_individual_case(
+                "http://example.com/", "http://example.com/Search.aspx", {}, "24-1234CR", case_html_path,
+                requests.Session(), logging.getLogger(__name__), ms_wait=0, max_age_hours=1,
+            )
+
+        self.assertEqual(case_id, "111")
+        request_page.assert_not_called()
+        self.assertEqual(scraper_instance.metrics.counters["cases_skipped"], 1)
+
+    def test_scrape_odyssey_ids_fetches_detail_pages_without_searching(self):
+        case_html_path = tempfile.mkdtemp()
+        scraper_instance = scraper.Scraper()
+
+        def detail_page(url, **kwargs):
+            if url.endswith("=222"):
+                raise requests.ConnectionError("reset")
+            return f"<html>{url}</html>"
+
+        with patch.object(scraper_instance, "get_search_results") as search, patch(
+            "scraper.request_page_with_retry", side_effect=detail_page
+        ) as request_page:
+            failed = scraper_instance.scrape_odyssey_ids(
+                "http://example.com/", ["111", "222", "333"], case_html_path, requests.Session(),
+                logging.getLogger(__name__), ms_wait=0, workers=2,
+            )
+
+        search.assert_not_called()
+        self.assertEqual(request_page.call_count, 3)
+        self.assertEqual(failed, ["222"])
+        with open(os.path.join(case_html_path, "111.html"), "r") as file_handle:
+            self.assertEqual(file_handle.read(), "<html>http://example.com/CaseDetail.aspx?CaseID=111</html>")
+        self.assertFalse(os.path.exists(os.path.join(case_html_path, "222.html")))
+
+    def test_rate_limiter_spaces_request_starts(self):
+        rate_limiter = scraper.RateLimiter(ms_wait=50)
+        start = time.monotonic()
+        for _ in range(4):
+            rate_limiter.acquire()
+        # the first request starts right away, the next three wait one interval each
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+    def test_rate_limiter_serves_interactive_before_queued_backfill(self):
+        rate_limiter = scraper.RateLimiter(ms_wait=100)
+        rate_limiter.acquire()
+        granted = []
+
+        def acquire(name, priority):
+            rate_limiter.acquire(priority)
+            granted.append(name)
+
+        backfill = [
+            threading.Thread(target=acquire, args=(f"backfill-{i}", scraper.Priority.BACKFILL)) for i in range(3)
+        ]
+        for thread in backfill:
+            thread.start()
+        time.sleep(0.02)
+        interactive = threading.Thread(target=acquire, args=("interactive", scraper.Priority.INTERACTIVE))
+        interactive.start()
+        for thread in backfill + [interactive]:
+            thread.join()
+
+        self.assertEqual(granted[0], "interactive")
+        self.assertEqual(len(granted), 4)
+
+    def test_rate_limiter_is_shared_per_portal(self):
+        rate_limiter = scraper.RateLimiter.for_portal("http://shared.example.com/", 100)
+
+        self.assertIs(scraper.RateLimiter.for_portal("http://shared.example.com/", 300), rate_limiter)
+        # a later scraper's longer wait doesn't slow down the others, each caller passes its own to acquire
+        self.assertEqual(rate_limiter.interval, 0.1)
+
+    def test_rate_limiter_spaces_each_caller_by_its_own_wait(self):
+        rate_limiter = scraper.RateLimiter(ms_wait=1000)
+        start = time.monotonic()
+        for _ in range(3):
+            rate_limiter.acquire(ms_wait=50)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+    @unittest.skipIf(scraper.rate_limiter.fcntl is None, "no fcntl")
+    def test_rate_limiter_shares_schedule_between_processes(self):
+        path = os.path.join(tempfile.mkdtemp(), "portal.json")
+        # two limiters on one schedule file stand for the limiters of two processes
+        backfill_process = scraper.RateLimiter(100, scraper.rate_limiter.SharedSchedule(path))
+        interactive_process = scraper.RateLimiter(100, scraper.rate_limiter.SharedSchedule(path))
+        backfill_process.acquire()
+        granted = []
+
+        def acquire(name, rate_limiter, priority):
+            rate_limiter.acquire(priority)
+            granted.append((name, time.monotonic()))
+
+        backfill = threading.Thread(target=acquire, args=("backfill", backfill_process, scraper.Priority.BACKFILL))
+        backfill.start()
+        time.sleep(0.02)
+        interactive = threading.Thread(
+            target=acquire, args=("interactive", interactive_process, scraper.Priority.INTERACTIVE)
+        )
+        interactive.start()
+        backfill.join()
+        interactive.join()
+
+        self.assertEqual([name for name, _ in granted], ["interactive", "backfill"])
+        self.assertGreaterEqual(granted[1][1] - granted[0][1], 0.08)
+
+    def test_request_page_with_retry_coalesces_identical_requests(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_post(url, params, timeout):
+            started.set()
+            release.wait(5)
+            return MagicMock(text="Date Filed", content=b"Date Filed")
+
+        session = MagicMock()
+        session.post.side_effect = slow_post
+        metrics = scraper.RequestMetrics()
+        single_flight = scraper.SingleFlight()
+        pages = []
+
+        def fetch():
+            pages.append(
+                scraper.request_page_with_retry(
+                    session=session,
+                    url="http://example.com/CaseDetail.aspx?CaseID=1",
+                    verification_text="Date Filed",
+                    logger=logging.getLogger(__name__),
+                    ms_wait=0,
+                    metrics=metrics,
+                    single_flight=single_flight,
+                )
+            )
+
+        leader = threading.Thread(target=fetch)
+        leader.start()
+        started.wait(5)
+        waiter = threading.Thread(target=fetch)
+        waiter.start()
+        # give the second caller time to join the in-flight request before it finishes
+        time.sleep(0.1)
+        release.set()
+        leader.join()
+        waiter.join()
+
+        self.assertEqual(pages, ["Date Filed", "Date Filed"])
+        session.post.assert_called_once()
+        self.assertEqual(metrics.counters["coalesced"], 1)
+
+    def test_single_flight_shares_errors_and_does_not_cache(self):
+        single_flight = scraper.SingleFlight()
+
+        with self.assertRaises(ValueError):
+            single_flight.do("key", MagicMock(side_effect=ValueError("portal error")))
+        self.assertEqual(single_flight.do("key", lambda: "page"), ("page", False))
+        self.assertEqual(single_flight.calls, {})
+
+    def test_estimate_crawl_from_history(self):
+        history = [
+            {"days": 2, "jo_days": 20, "cases": 100, "requests": 123, "retries": 0,
+             "bytes": 1_230_000, "case_bytes": 1_000_000, "latency_mean": 0.8},
+        ]
+
+        plan = scraper.planner.estimate_crawl(
+            "hays", "2024-01-01", "2024-01-10", ms_wait=200, history=history
+        )
+
+        self.assertEqual(plan["jo_days"], 100)
+        self.assertEqual(plan["cases"], 500)
+        self.assertEqual(plan["requests"], 603)
+        self.assertEqual(plan["bytes"], 6_030_000)
+        self.assertEqual(plan["duration_seconds"], 603)
+        self.assertEqual(plan["disk_bytes"], 5_000_000)
+        self.assertIn("hays", scraper.planner.format_crawl_plan([plan]))
+
+        # four workers overlap the 1s case requests, the searches are still sent one after another
+        plan = scraper.planner.estimate_crawl(
+            "hays", "2024-01-01", "2024-01-10", ms_wait=200, history=history, workers=4
+        )
+        self.assertEqual(plan["duration_seconds"], 103 + 125)
+
+        # the portal's pacing caps the gain of more workers
+        plan = scraper.planner.estimate_crawl(
+            "hays", "2024-01-01", "2024-01-10", ms_wait=200, history=history, workers=50
+        )
+        self.assertEqual(plan["duration_seconds"], 103 + 100)
+
+    def test_estimate_crawl_without_history_reports_no_history(self):
+        plan = scraper.planner.estimate_crawl(
+            "hays", "2024-01-01", "2024-01-01", judicial_officers=["Boyer, Bruce"], history=[]
+        )
+
+        self.assertEqual(plan["based_on"], "no history")
+        self.assertIsNone(plan["requests"])
+        self.assertIsNone(plan["duration_seconds"])
+        self.assertIn("hays: based on no history", scraper.planner.format_crawl_plan([plan]))
+
+    def test_circuit_breaker_opens_after_repeated_failures(self):
+        store = scraper.health.PortalStatusStore(os.path.join(tempfile.mkdtemp(), "portal_status.json"))
+        breaker = scraper.health.CircuitBreaker("hays", store, failure_threshold=2, cooldown_seconds=60)
+
+        breaker.record_failure("probe: HTTP 503", source="probe")
+        self.assertTrue(breaker.allow())
+        breaker.record_failure("probe: HTTP 503", source="probe")
+        self.assertFalse(breaker.allow())
+        self.assertEqual(store.get("hays")["state"], "open")
+
+        # once the cooldown has passed a trial attempt is let through, and a success closes the breaker
+        with patch("scraper.health.time", return_value=time.time() + 61):
+            self.assertTrue(breaker.allow())
+        breaker.record_success(0.2, source="probe")
+        self.assertEqual(store.get("hays")["state"], "closed")
+        self.assertEqual(store.get("hays")["consecutive_failures"], 0)
+
+    def test_circuit_breaker_counts_crawl_failures_despite_healthy_probes(self):
+        store = scraper.health.PortalStatusStore(os.path.join(tempfile.mkdtemp(), "portal_status.json"))
+        breaker = scraper.health.CircuitBreaker("hays", store, failure_threshold=2, cooldown_seconds=60)
+
+        # the portal answers every probe, but every crawl of it fails
+        breaker.record_success(0.2, source="probe")
+        breaker.record_failure("crawl: SystemExit: 1", source="crawl")
+        breaker.record_success(0.2, source="probe")
+        self.assertEqual(store.get("hays")["crawl_failures"], 1)
+        breaker.record_failure("crawl: SystemExit: 1", source="crawl")
+        self.assertFalse(breaker.allow())
+
+        # a healthy probe after the cooldown lets a trial crawl through without closing the breaker
+        with patch("scraper.health.time", return_value=time.time() + 61):
+            breaker.record_success(0.2, source="probe")
+            self.assertTrue(breaker.allow())
+        self.assertEqual(store.get("hays")["state"], "open")
+        breaker.record_success(source="crawl")
+        self.assertEqual(store.get("hays")["state"], "closed")
+        self.assertEqual(store.get("hays")["crawl_failures"], 0)
+
+    def test_check_portal_skips_blocked_and_failing_portals(self):
+        store = scraper.health.PortalStatusStore(os.path.join(tempfile.mkdtemp(), "portal_status.json"))
+        logger = logging.getLogger(__name__)
+
+        with patch("scraper.health.probe_portal") as probe:
+            self.assertFalse(
+                scraper.health.check_portal("bexar", "http://example.com/", scraper.health.CircuitBreaker("bexar", store), logger)
+            )
+            probe.assert_not_called()
+
+        with patch("scraper.health.probe_portal", return_value=(False, 5.0, "ConnectTimeout: stalled")):
+            self.assertFalse(
+                scraper.health.check_portal("hays", "http://example.com/", scraper.health.CircuitBreaker("hays", store), logger)
+            )
+        self.assertEqual(store.get("hays")["last_error"], "probe: ConnectTimeout: stalled")
+
+        with patch("scraper.health.probe_portal", return_value=(True, 0.3, None)):
+            self.assertTrue(
+                scraper.health.check_portal("hays", "http://example.com/", scraper.health.CircuitBreaker("hays", store), logger)
+            )
+
     # This unit test for scrape_cases also covers unit testing for scrape_case_data_pre2017 and scrape_case_data_post2017. Only one or the other is used, and scrape_cases is mostly the pre or post2017 code.
     # In the future unit tests could be written for:
     # def scrape_case_data_pre2017()
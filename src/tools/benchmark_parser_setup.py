@@ -0,0 +1,66 @@
+import os
+import sys
+import logging
+import argparse
+import tempfile
+
+from time import perf_counter
+
+# Compares the per-case cost of parsing when the county parser, engine and session are
+# set up for every file (the old behavior) with reusing them for the whole batch.
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import parser
+
+argparser = argparse.ArgumentParser()
+argparser.add_argument(
+    "-cases", "-n", type=int, default=50, help="Number of times the test case is parsed."
+)
+argparser.add_argument(
+    "-url",
+    type=str,
+    default=None,
+    help="Database URL. Defaults to the URL environment variable, or a temporary SQLite file.",
+)
+argparser.description = "Benchmark per-case parser setup overhead."
+args = argparser.parse_args()
+
+if args.url:
+    os.environ["URL"] = args.url
+elif not os.getenv("URL"):
+    os.environ["URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "benchmark.db")
+
+case_html_file = os.path.join(
+    os.path.dirname(__file__), "..", "..", "resources", "test_files", "test_123456.html"
+)
+with open(case_html_file, "r", encoding="utf-8", errors="ignore") as file_handle:
+    case_html = file_handle.read()
+
+logger = logging.getLogger("benchmark")
+logging.disable(logging.CRITICAL)
+case_json_path = tempfile.mkdtemp()
+
+
+def run(setup_every_case: bool) -> float:
+    batch_parser = parser.Parser()
+    start = perf_counter()
+    for i in range(args.cases):
+        if setup_every_case:
+            # what Parser.parse did before: a new ParserHays, engine and schema check per file
+            sys.modules["p_hays"].ENGINES.clear()
+            batch_parser.county_parsers.__dict__.clear()
+        batch_parser.parse_case_html(
+            "hays", str(i), None, case_html, case_json_path, logger, test=True
+        )
+    return (perf_counter() - start) / args.cases
+
+
+# warm up imports so neither run pays for them
+parser.Parser().get_class_and_method(logger, "hays", test=True)
+
+per_case_before = run(setup_every_case=True)
+per_case_after = run(setup_every_case=False)
+print(f"cases: {args.cases}")
+print(f"setup per case:  {per_case_before * 1000:.1f} ms per case")
+print(f"setup per batch: {per_case_after * 1000:.1f} ms per case")
+print(f"speedup: {per_case_before / per_case_after:.2f}x")
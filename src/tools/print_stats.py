@@ -1,6 +1,7 @@
 import os
 import json
 import argparse
+import heapq
 
 from time import time
 from statistics import mean, median, mode
@@ -8,8 +9,6 @@ from statistics import mean, median, mode
 N_LONGEST = 5
 START_TIME = time()
 
-case_data_list = []
-
 argparser = argparse.ArgumentParser()
 argparser.add_argument(
     "-county",
@@ -24,28 +23,6 @@ args = argparser.parse_args()
 case_json_path = os.path.join(
     os.path.dirname(__file__), "..", "..", "data", args.county, "case_json"
 )
-for case_file in os.scandir(case_json_path):
-    with open(case_file.path, "r") as file_handle:
-        case_data_list.append(json.loads(file_handle.read()))
-
-
-def print_top_cases_by_lambda(sort_function, description):
-    print("\n", description)
-    cases_by_lambda = sorted(case_data_list, key=sort_function)[-N_LONGEST:]
-    converted_data = list(sort_function(case) for case in case_data_list)
-    print(
-        "\n".join(
-            f"{i}. {sort_function(case)}".ljust(20) + case["odyssey id"]
-            for i, case in enumerate(reversed(cases_by_lambda), 1)
-        ),
-        "\nMean:",
-        round(mean(converted_data), 2),
-        " Median:",
-        round(median(converted_data), 2),
-        " Mode:",
-        round(mode(converted_data), 2),
-    )
-
 
 disposition_len = (lambda case: len(case["dispositions"]), "dispositions length")
 charges_len = (lambda case: len(case["charge information"]), "number of charges")
@@ -61,10 +38,43 @@ case_cost = (
     else 0.0,
     "highest cost",
 )
-for sort_function, description in (events_len, disposition_len, case_cost, charges_len):
-    print_top_cases_by_lambda(
-        sort_function,
-        description,
+stats = (events_len, disposition_len, case_cost, charges_len)
+
+# Only the value of each stat is kept per case, and the top N_LONGEST (value, odyssey id) in a heap,
+# so the cases themselves are read one at a time and never all held in memory.
+values = [[] for _ in stats]
+top_cases = [[] for _ in stats]
+case_count = 0
+for case_file in os.scandir(case_json_path):
+    with open(case_file.path, "r") as file_handle:
+        case = json.load(file_handle)
+    case_count += 1
+    for (sort_function, _), stat_values, heap in zip(stats, values, top_cases):
+        value = sort_function(case)
+        stat_values.append(value)
+        if len(heap) < N_LONGEST:
+            heapq.heappush(heap, (value, case["odyssey id"]))
+        else:
+            heapq.heappushpop(heap, (value, case["odyssey id"]))
+
+
+def print_top_cases(description, stat_values, heap):
+    print("\n", description)
+    print(
+        "\n".join(
+            f"{i}. {value}".ljust(20) + odyssey_id
+            for i, (value, odyssey_id) in enumerate(sorted(heap, reverse=True), 1)
+        ),
+        "\nMean:",
+        round(mean(stat_values), 2),
+        " Median:",
+        round(median(stat_values), 2),
+        " Mode:",
+        round(mode(stat_values), 2),
     )
-print("\nNumber of cases:", len(case_data_list))
+
+
+for (_, description), stat_values, heap in zip(stats, values, top_cases):
+    print_top_cases(description, stat_values, heap)
+print("\nNumber of cases:", case_count)
 print("Stats parsing runtime:", round(time() - START_TIME, 2), "seconds")